@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Goal: measure how the sprint copy scales with the size of the template
+
+For every size the benchmark creates a template sprint on the Redmine
+stand-in server, copies it (dividers, stories and tasks) and then deletes
+the copy. The wall time, the number of requests by endpoint and the peak
+memory are saved as json so regressions can be spotted by comparing the
+output with a previous run.
+
+Every size is measured in its own process: the peak memory of a process
+never goes down and the stand-in data is excluded from `copy_memory_kb`.
+
+Usage:
+    python bench_copy.py
+    python bench_copy.py --sizes 10,100 --latency 0.005 --output bench.json
+    python bench_copy.py --baseline bench.json --output bench_latest.json
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import resource
+from datetime import date
+
+import fabfile
+from fabfile import env
+from redmine_standin import RedmineStandin
+
+# one story per this many issues (the rest are tasks)
+ISSUES_PER_STORY = 10
+
+# a wall time or a request count growing more than this is reported
+REGRESSION_THRESHOLD = 1.2
+
+
+def populate_template(standin, size):
+    """
+    Create a template sprint with `size` issues: one divider and stories
+    with tasks
+
+    @return the template name
+    """
+    data = standin.data
+    project = data.add_project('admin_project')
+    name = 'TEMPLATE_SPRINT_GREEN'
+    version = data.add_version(project['id'], name=name, sharing='system')
+    data.add_version(project['id'], name='Green Sprint 001')
+
+    data.add_issue(project_id=project['id'], subject='Divider',
+                   tracker_id=fabfile.TRACKERS[fabfile.TRACKER_PLACEHOLDER],
+                   fixed_version_id=version['id'])
+    created = 1
+    while created < size:
+        story = data.add_issue(
+            project_id=project['id'],
+            subject='Story {}'.format(created),
+            tracker_id=fabfile.TRACKERS[fabfile.TRACKER_STORY],
+            fixed_version_id=version['id'])
+        created += 1
+        for _ in range(min(ISSUES_PER_STORY - 1, size - created)):
+            data.add_issue(
+                project_id=project['id'],
+                subject='Task {}'.format(created),
+                tracker_id=fabfile.TRACKERS[fabfile.TRACKER_TASK],
+                fixed_version_id=version['id'],
+                parent_issue_id=story['id'],
+                assigned_to_id=1,
+                estimated_hours=1)
+            created += 1
+    return name
+
+
+def configure(standin, concurrency):
+    """ Point the fabfile to the stand-in server"""
+    env.update({
+        'environment': 'bench',
+        'project_name': 'admin_project',
+        'api_url': standin.url,
+        'api_key': 'bench',
+        'concurrency': concurrency,
+        'http_max_retries': 0,
+    })
+    fabfile.INSTANCE = None
+    fabfile.TRANSPORT = None
+    fabfile.CATALOGUE = None
+
+
+def peak_memory_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def measure(standin, func, *args):
+    """ @return (result, {'seconds', 'requests', 'by_endpoint'})"""
+    standin.reset_counts()
+    started = time.time()
+    result = func(*args)
+    elapsed = time.time() - started
+    counts = standin.reset_counts()
+    return result, {'seconds': round(elapsed, 3),
+                    'requests': sum(counts.values()),
+                    'by_endpoint': counts}
+
+
+def run_size(size, latency, error_rate, concurrency):
+    """
+    Copy and delete a template with `size` issues. Called in a new process
+    for every size (@see measure_size()) since the peak memory of a
+    process never goes down.
+    """
+    standin = RedmineStandin(latency=latency, error_rate=error_rate).start()
+    try:
+        configure(standin, concurrency)
+        template_name = populate_template(standin, size)
+        date_ref = date.today()
+        # the stand-in data is not part of the copy memory
+        populated_kb = peak_memory_kb()
+
+        _, copy_stats = measure(standin, fabfile.copy_template,
+                                template_name, date_ref)
+
+        new_sprint = fabfile.get_sync_target(template_name)
+        _, delete_stats = measure(standin, fabfile.delete_sprint,
+                                  new_sprint)
+    finally:
+        standin.stop()
+
+    return {'size': size,
+            'copy': copy_stats,
+            'delete': delete_stats,
+            'peak_memory_kb': peak_memory_kb(),
+            'copy_memory_kb': peak_memory_kb() - populated_kb}
+
+
+def measure_size(size, latency, error_rate, concurrency):
+    """ Run run_size() in its own process"""
+    [(ok, value)] = fabfile.run_in_processes(
+        run_size, [(size, latency, error_rate, concurrency)])
+    if not ok:
+        sys.exit("Unable to measure size {}: {}".format(size, value))
+    return value
+
+
+def compare(results, baseline):
+    """ Print the measurements which grew compared to the baseline"""
+    previous = dict((item['size'], item) for item in baseline['results'])
+    regressions = 0
+
+    for item in results:
+        old = previous.get(item['size'])
+        if old is None:
+            continue
+        for phase in ('copy', 'delete'):
+            for metric in ('seconds', 'requests'):
+                before, after = old[phase][metric], item[phase][metric]
+                if before and after > before * REGRESSION_THRESHOLD:
+                    regressions += 1
+                    print("REGRESSION size {} {} {}: {} -> {}"
+                          .format(item['size'], phase, metric,
+                                  before, after))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--sizes', default='10,100,1000,10000',
+                        help='comma separated number of template issues')
+    parser.add_argument('--latency', type=float, default=0.002,
+                        help='seconds added to every request')
+    parser.add_argument('--error-rate', type=float, default=0,
+                        help='fraction of requests failing with a 503')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--output', default='bench_results.json',
+                        help='where to save the results (use a file other '
+                             'than the baseline to keep the baseline)')
+    parser.add_argument('--baseline', default=None,
+                        help='previous output to compare with (skipped if '
+                             'the file does not exist yet)')
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as fh:
+            baseline = json.load(fh)
+
+    logging.getLogger('fabfile').setLevel(logging.WARNING)
+    logging.getLogger('transport').setLevel(logging.WARNING)
+
+    results = []
+    for size in [int(size) for size in args.sizes.split(',')]:
+        item = measure_size(size, args.latency, args.error_rate,
+                            args.concurrency)
+        results.append(item)
+        print("{size:>6} issues: copy {copy[seconds]:>8.2f}s "
+              "{copy[requests]:>6} requests, delete {delete[seconds]:>8.2f}s "
+              "{delete[requests]:>6} requests, copy memory "
+              "{copy_memory_kb} KB".format(**item))
+
+    with open(args.output, 'w') as fh:
+        json.dump({'latency': args.latency,
+                   'error_rate': args.error_rate,
+                   'concurrency': args.concurrency,
+                   'results': results}, fh, indent=2, sort_keys=True)
+    print("Saved: {}".format(args.output))
+
+    if baseline is not None:
+        sys.exit(1 if compare(results, baseline) else 0)
+
+
+if __name__ == '__main__':
+    main()
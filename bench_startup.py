@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Goal: measure the start-up cost of a daily no-op cron run
+
+Compares the time spent by `redman check` (stdlib only) on a day when no
+copy is due with the time spent importing the fabfile (Fabric,
+python-redmine, mailer, dateutil...).
+
+Usage:
+    python bench_startup.py
+    python bench_startup.py --runs 20
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+from datetime import date, timedelta
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SETTINGS = """
+def get_settings(overrides={{}}):
+    return {{'start_date': '{}', 'repeat_after': 14}}
+"""
+
+
+def create_environment(work_dir):
+    """ Create a `bench/fabric.py` which is not due today"""
+    os.mkdir(os.path.join(work_dir, 'bench'))
+    tomorrow = date.today() + timedelta(days=1)
+    with open(os.path.join(work_dir, 'bench', 'fabric.py'), 'w') as fh:
+        fh.write(SETTINGS.format(tomorrow.isoformat()))
+
+
+def measure(command, work_dir, runs):
+    """ @return the run times (milliseconds) of `command`"""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+        [REPO_DIR] + os.environ.get('PYTHONPATH', '').split(os.pathsep)))
+    timings = []
+    with open(os.devnull, 'w') as devnull:
+        for _ in range(runs):
+            started = time.time()
+            subprocess.check_call(command, cwd=work_dir, env=env,
+                                  stdout=devnull, stderr=devnull)
+            timings.append((time.time() - started) * 1000)
+    return sorted(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    commands = [
+        ('python (baseline)', [sys.executable, '-c', 'pass']),
+        ('redman check', [sys.executable, os.path.join(REPO_DIR, 'redman'),
+                          'check', 'bench.green']),
+        ('import fabfile', [sys.executable, '-W', 'ignore', '-c',
+                            'import fabfile']),
+    ]
+    work_dir = tempfile.mkdtemp()
+    try:
+        create_environment(work_dir)
+        for name, command in commands:
+            timings = measure(command, work_dir, args.runs)
+            print("{:<20} min {:>7.1f} ms, median {:>7.1f} ms"
+                  .format(name, timings[0], timings[len(timings) // 2]))
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
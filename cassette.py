@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Goal: record the Redmine traffic of a run and replay it offline
+
+In `record` mode every request sent by the `Transport` and its response
+(status, body and latency) is saved in a json "cassette" with the api
+keys removed. In `replay` mode the responses are served from the
+cassette -- optionally with a scaled latency -- without any server.
+
+A request which was not recorded raises CassetteError and the recorded
+requests which were not sent are reported by unplayed() so a replay
+catches the changes in the number (e.g. a new N+1 call) and, with
+`strict=True`, in the order of the requests.
+
+@see fabfile.get_transport()
+"""
+
+import os
+import re
+import json
+import time
+import logging
+import threading
+from collections import deque
+
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+
+logger = logging.getLogger(__name__)
+
+# Request parameters which are never saved (the request headers and the
+# authentication are not saved either)
+SECRET_PARAMS = ('key',)
+
+# The dates of the requests depend on the day of the run
+DATE_PATTERN = re.compile(r'\d{4}-\d{2}-\d{2}')
+
+
+class CassetteError(Exception):
+    """ The request does not match the recording"""
+
+
+class Cassette(object):
+    """
+    Usage:
+        transport = Transport(cassette=Cassette('copy.json', 'record'))
+        ...
+        transport.cassette.save()
+    """
+
+    def __init__(self, path, mode='replay', latency_scale=1.0, strict=False):
+        """
+        :param path: the json file of the cassette
+        :param mode: 'record' or 'replay'
+        :param latency_scale: multiplies the recorded latency on replay
+            (use 0 for replaying as fast as possible)
+        :param strict: on replay the requests must come in the recorded
+            order (use with `concurrency=1`)
+        """
+        if mode not in ('record', 'replay'):
+            raise ValueError("Invalid cassette mode: {}".format(mode))
+        self.path = path
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self.strict = strict
+        self.interactions = []
+        self.played = 0
+        self._played = set()
+        self._queues = {}
+        self._lock = threading.Lock()
+        if mode == 'replay':
+            self.load()
+
+    def load(self):
+        with open(self.path) as fh:
+            self.interactions = json.load(fh)['interactions']
+        for idx, item in enumerate(self.interactions):
+            self._queues.setdefault(self.signature(item['request']),
+                                    deque()).append(idx)
+        return self
+
+    def save(self):
+        with self._lock:
+            data = {'interactions': list(self.interactions)}
+        tmp_path = '{}.tmp'.format(self.path)
+        with open(tmp_path, 'w') as fh:
+            json.dump(data, fh, indent=1, sort_keys=True)
+        os.rename(tmp_path, self.path)
+        logger.info("Saved [{}] requests to the cassette: {}"
+                    .format(len(data['interactions']), self.path))
+
+    def request(self, session, method, url, **kwargs):
+        """ Called by the Transport instead of `session.request()`"""
+        if self.mode == 'replay':
+            return self.play(method, url, **kwargs)
+
+        started = time.time()
+        response = session.request(method, url, **kwargs)
+        item = {'request': scrub_request(method, url, kwargs),
+                'response': {
+                    'status': response.status_code,
+                    'headers': {'Content-Type':
+                                response.headers.get('Content-Type', '')},
+                    'body': scrub_text(response.text)},
+                'latency': round(time.time() - started, 6)}
+        with self._lock:
+            self.interactions.append(item)
+        return response
+
+    def play(self, method, url, **kwargs):
+        """ @return the recorded Response of the request"""
+        request = scrub_request(method, url, kwargs)
+        key = self.signature(request)
+        with self._lock:
+            queue = self._queues.get(key)
+            if self.strict:
+                expected = self.played
+                if expected >= len(self.interactions) or \
+                        self.signature(self.interactions[expected]
+                                       ['request']) != key:
+                    raise CassetteError(
+                        "Request #{} {} {} is not the recorded one"
+                        .format(expected + 1, method.upper(),
+                                request['url']))
+                queue.remove(expected)
+                idx = expected
+            elif queue:
+                idx = queue.popleft()
+            else:
+                raise CassetteError("Request {} {} was not recorded (or was "
+                                    "sent more times than recorded)"
+                                    .format(method.upper(), request['url']))
+            self.played += 1
+            self._played.add(idx)
+
+        item = self.interactions[idx]
+        if self.latency_scale:
+            time.sleep(item['latency'] * self.latency_scale)
+        return to_response(item['response'], url)
+
+    def unplayed(self):
+        """ @return the recorded requests which were not sent"""
+        with self._lock:
+            return [item['request'] for idx, item
+                    in enumerate(self.interactions)
+                    if idx not in self._played]
+
+    @staticmethod
+    def signature(request):
+        """ @return the key used to match a request with the recording"""
+        return DATE_PATTERN.sub('<date>', json.dumps(request, sort_keys=True))
+
+
+def scrub_request(method, url, kwargs):
+    """ @return the json-friendly request without the secrets"""
+    params = dict((name, value) for name, value
+                  in (kwargs.get('params') or {}).items()
+                  if name not in SECRET_PARAMS)
+    body = kwargs.get('data') or kwargs.get('json')
+    if isinstance(body, basestring):
+        try:
+            body = json.loads(body)
+        except ValueError:
+            pass
+    return {'method': method.upper(),
+            'url': scrub_text(url),
+            'params': params,
+            'body': body}
+
+
+def scrub_text(text):
+    """ Remove the api keys from an url or a response body"""
+    text = re.sub(r'([?&]key=)[^&]*', r'\1<scrubbed>', text)
+    return re.sub(r'("api_key"\s*:\s*")[^"]*', r'\1<scrubbed>', text)
+
+
+def to_response(recorded, url):
+    """ @return a `requests.Response` built from a recording"""
+    response = Response()
+    response.status_code = recorded['status']
+    response.headers = CaseInsensitiveDict(recorded['headers'])
+    response._content = recorded['body'].encode('utf-8')
+    response.encoding = 'utf-8'
+    response.url = url
+    return response
@@ -21,8 +21,13 @@ import os
 import sys
 import imp
 import re
+import json
 import os.path
+import itertools
 import logging
+import atexit
+import threading
+import contextlib
 logging.captureWarnings(True)
 
 # Add timestamps to the log
@@ -30,21 +35,35 @@ logger = logging.getLogger(__name__)
 handler = logging.StreamHandler(sys.stdout)
 formatter = logging.Formatter('%(asctime)s %(levelname)s %(message)s')
 handler.setFormatter(formatter)
-logger.addHandler(handler)
-logger.setLevel(logging.INFO)
+
+for log_name in [__name__, 'transport', 'outbox', 'scheduler', 'journal',
+                 'cassette']:
+    logging.getLogger(log_name).addHandler(handler)
+    logging.getLogger(log_name).setLevel(logging.INFO)
 
 from fabric.api import local, task, env
 from fabric.utils import abort
 from fabric.operations import require
 
 import time
-from datetime import date
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from collections import OrderedDict
+from datetime import date, datetime
 from dateutil.parser import parse
 from dateutil.rrule import WE, TH
 from dateutil.relativedelta import relativedelta
 
-from mailer import Mailer, Message
 import redmine
+from redmine.exceptions import ResourceNotFoundError
+from transport import Transport, AimdLimiter
+from metrics import Metrics
+from profiling import Profiler, Tracer, NULL_SPAN
+from scheduler import DagScheduler, call_safely
+from redman_cli import get_skip_reason, parse_template_list
+from outbox import Outbox, OutboxSender
+from journal import Journal
+from cassette import Cassette
 
 
 """
@@ -79,11 +98,43 @@ TRACKERS = {
 }
 
 ISSUE_STATUS_NEW = 1
+# Redmine returns at most this many items per page
+PAGE_SIZE = 100
+DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
 CREATED_BY = ''
 
 # the redmine connector instance
 INSTANCE = None
 
+# the pooled http session used by INSTANCE (@see get_transport())
+TRANSPORT = None
+
+# the versions of the project (@see get_version_catalogue())
+CATALOGUE = None
+
+# the request metrics and phase timings of this run (@see save_metrics())
+METRICS = Metrics()
+
+# the versions listed before are listed again to number a new sprint
+# (@see reset_metrics())
+RUN_STARTED = time.time()
+
+# the timeline recorder used when profiling (@see copy_template_profiled())
+TRACER = None
+
+# the background delivery of the summary emails (@see get_outbox_sender())
+OUTBOX_SENDER = None
+
+# the templates read by this process {(api_url, sprint_id): Template}
+TEMPLATES = {}
+
+# The journals of the copies in progress by new sprint id
+JOURNALS = {}
+
+# guards the creation of INSTANCE, TRANSPORT and CATALOGUE (the templates
+# of an environment are copied by several threads)
+GLOBALS_LOCK = threading.RLock()
+
 
 @task
 def help():
@@ -107,20 +158,115 @@ def get_client_instance():
     """ Create an instance of the the object used
     to communicate with the redmine API"""
     require('environment', provided_by=[production, staging])
-    logger.info("Using api_url: {}".format(env.api_url))
-    # logger.info("Using api_key: {}".format(env.api_key))
 
     global INSTANCE
-    if INSTANCE is None:
-        INSTANCE = redmine.Redmine(env.api_url, key=env.api_key,
-                                   requests={'verify': False})
-    return INSTANCE
+    instance = INSTANCE
+    if instance is not None and instance.url == env.api_url:
+        return instance
+
+    with GLOBALS_LOCK:
+        if INSTANCE is None or INSTANCE.url != env.api_url:
+            logger.info("Using api_url: {}".format(env.api_url))
+            # logger.info("Using api_key: {}".format(env.api_key))
+
+            # python-redmine calls `requests.<method>(url, ...)` for every
+            # API call so we replace the module it uses with our pooled
+            # transport
+            redmine.requests = get_transport()
+            INSTANCE = redmine.Redmine(env.api_url, key=env.api_key,
+                                       requests={'verify': False})
+        return INSTANCE
+
+
+def get_transport():
+    """
+    Create the http transport configured by the `http_*` settings
+    in the `fabric.py` config file (shared by all the environments).
+    """
+    global TRANSPORT
+    if TRANSPORT is not None:
+        return TRANSPORT
+
+    with GLOBALS_LOCK:
+        if TRANSPORT is None:
+            pool_size = int(env.get('http_pool_size') or get_concurrency())
+            ceiling = int(env.get('rate_limit_ceiling') or pool_size)
+            TRANSPORT = Transport(
+                pool_size=pool_size,
+                connect_timeout=float(env.get('http_connect_timeout', 5)),
+                read_timeout=float(env.get('http_read_timeout', 60)),
+                max_retries=int(env.get('http_max_retries', 3)),
+                backoff=float(env.get('http_backoff', 0.5)),
+                limiter=AimdLimiter(ceiling)
+                if to_bool(env.get('rate_limit', True)) else None,
+                metrics=METRICS,
+                cassette=get_cassette())
+        return TRANSPORT
+
+
+def get_cassette():
+    """
+    @return the Cassette configured by the `http_cassette` setting (None
+    for talking to the server as usual). A recorded cassette is saved
+    when the process exits.
+    """
+    path = env.get('http_cassette')
+    if not path:
+        return None
+    mode = env.get('http_cassette_mode', 'replay')
+    cassette = Cassette(
+        path, mode,
+        latency_scale=float(env.get('http_cassette_latency_scale', 1.0)),
+        strict=to_bool(env.get('http_cassette_strict', False)))
+    if mode == 'record':
+        atexit.register(cassette.save)
+    else:
+        atexit.register(report_unplayed, cassette)
+    logger.info("Using the http cassette [{}] in [{}] mode"
+                .format(path, mode))
+    return cassette
+
+
+def report_unplayed(cassette):
+    """ Warn about the recorded requests which were not sent"""
+    unplayed = cassette.unplayed()
+    if unplayed:
+        logger.warn("[{}] recorded requests were not sent, e.g. {} {}"
+                    .format(len(unplayed), unplayed[0]['method'],
+                            unplayed[0]['url']))
+
+
+def reset_metrics():
+    """ Start collecting the metrics of a new run (the long-running
+    daemon copies many times in one process) """
+    global METRICS, RUN_STARTED
+    METRICS = Metrics()
+    RUN_STARTED = time.time()
+    if TRANSPORT is not None:
+        TRANSPORT.metrics = METRICS
+
+
+def save_metrics():
+    """
+    Write the metrics of the run to the files configured by the
+    `metrics_file` (json) and `metrics_textfile` (Prometheus) settings
+    """
+    json_file = env.get('metrics_file')
+    textfile = env.get('metrics_textfile')
+    try:
+        METRICS.save(json_file, textfile)
+    except (IOError, OSError) as exc:
+        logger.error("Unable to save the metrics: {}".format(exc))
+        return
+    for path in [json_file, textfile]:
+        if path:
+            logger.info("Saved metrics: {}".format(path))
 
 
 @task
 def list_projects():
     """ List the projects in Redmine"""
-    projects = get_client_instance().project.all()
+    projects = stream_resources('project')
     for idx, pro in enumerate(projects):
         print(" {}. {}".format(idx+1, pro.name))
 
@@ -135,110 +281,484 @@ def list_versions():
 
 def get_versions():
     """ Retrive all versions in Redmine"""
-    found = []
+    return get_version_catalogue().as_list()
+
+
+class VersionInfo(object):
+    """ Data storage object for the versions kept in the catalogue"""
+
+    def __init__(self, id, name, status='open', due_date=None):
+        """constuctor"""
+        self.id = id
+        self.name = name
+        self.status = status
+        # "YYYY-MM-DD" or None
+        self.due_date = due_date
+
+
+class SprintIndex(object):
+    """
+    The sprints generated from the templates ("Green Sprint 065") indexed
+    by color. Every version name is parsed once and the highest sequence
+    number of every color is kept up to date as versions are added and
+    removed.
+    """
 
+    PATTERN = re.compile(r'^([a-z].*?) sprint ([0-9]+)$', re.IGNORECASE)
+
+    def __init__(self, versions=()):
+        """
+        :param versions: list of VersionInfo objects
+        """
+        # {color: {version_id: (sequence, visible_id)}}
+        self._by_color = {}
+        # {color: (sequence, version_id, visible_id)}
+        self._newest = {}
+        for ver in versions:
+            self.add(ver)
+
+    @classmethod
+    def parse(cls, name):
+        """
+        @return (color, sequence, visible_id) for names like
+        "Green Sprint 065" or None
+        """
+        m = cls.PATTERN.match(' '.join(name.split()))
+        if m is None:
+            return None
+        return m.group(1).lower(), int(m.group(2)), m.group(2)
+
+    def add(self, version):
+        parsed = self.parse(version.name)
+        if parsed is None:
+            return
+        color, sequence, visible_id = parsed
+        self._by_color.setdefault(color, {})[version.id] = \
+            (sequence, visible_id)
+        candidate = (sequence, version.id, visible_id)
+        if candidate > self._newest.get(color, (-1,)):
+            self._newest[color] = candidate
+
+    def remove(self, version):
+        parsed = self.parse(version.name)
+        if parsed is None:
+            return
+        color = parsed[0]
+        sprints = self._by_color.get(color, {})
+        if sprints.pop(version.id, None) is None:
+            return
+        if self._newest[color][1] == version.id:
+            # only the sprints of this color are scanned again
+            self._newest.pop(color)
+            for ver_id, (sequence, visible_id) in sprints.items():
+                candidate = (sequence, ver_id, visible_id)
+                if candidate > self._newest.get(color, (-1,)):
+                    self._newest[color] = candidate
+
+    def find_newest(self, color):
+        """ @return the visible id ("065") of the sprint with the highest
+        sequence number for the color or None """
+        newest = self._newest.get(color.lower())
+        return newest[2] if newest is not None else None
+
+    def find_older(self, cycles, color=None):
+        """
+        @return the ids of the sprints created more than `cycles` sprints
+        before the newest sprint of their color (all the colors by default)
+        """
+        colors = [color.lower()] if color else sorted(self._by_color)
+        found = []
+        for name in colors:
+            if name not in self._newest:
+                continue
+            newest = self._newest[name][0]
+            found.extend(ver_id for ver_id, (sequence, visible_id)
+                         in sorted(self._by_color[name].items(),
+                                   key=lambda item: item[1])
+                         if sequence <= newest - cycles)
+        return found
+
+
+class VersionCatalogue(object):
+    """
+    In-memory list of the project versions with lookups by name and by id.
+
+    The versions are listed once per run (or read from the optional cache
+    file) and the catalogue is updated in place when sprints are created or
+    deleted. They are listed again before numbering a new sprint when they
+    were not listed during the current run (@see reload()).
+    """
+
+    def __init__(self, api_url, versions=None, cache_file=None,
+                 cache_ttl=0, project_name=None):
+        """
+        :param api_url: the Redmine server the versions belong to
+        :param versions: list of VersionInfo objects
+        :param cache_file: optional path of the json file used to persist
+            the catalogue between runs
+        :param cache_ttl: how many seconds the cache file content is valid
+        :param project_name: the project the versions belong to
+        """
+        self.api_url = api_url
+        self.project_name = project_name
+        self.cache_key = "{}|{}".format(api_url, project_name)
+        self.cache_file = cache_file
+        self.cache_ttl = cache_ttl
+        self._lock = threading.RLock()
+        self._versions = []
+        self._by_id = {}
+        self._by_name = {}
+        # built on the first find_newest_sprint() call
+        self._sprints = None
+        # when the versions were listed using the API (None if cached)
+        self.listed_on = None
+        for ver in versions or []:
+            self.add(ver, persist=False)
+
+    def load(self):
+        """ Populate the catalogue from the cache file or from the API"""
+        versions = self._read_cache()
+
+        if versions is None:
+            versions = list_project_versions()
+            self._write_cache(versions)
+            self.listed_on = time.time()
+        else:
+            logger.info("Using [{}] cached versions from: {}"
+                        .format(len(versions), self.cache_file))
+
+        with self._lock:
+            for ver in versions:
+                self.add(ver, persist=False)
+        return self
+
+    def reload(self, since):
+        """ Replace the catalogue content with a new listing of the versions
+        so the sprints created by another run (or by hand) are seen.
+
+        :param since: do nothing if the versions were listed after this
+            timestamp (e.g. the start of the run)
+        """
+        if self.listed_on is not None and self.listed_on >= since:
+            return self
+
+        versions = list_project_versions()
+        with self._lock:
+            self.listed_on = time.time()
+            self._versions = []
+            self._by_id = {}
+            self._by_name = {}
+            self._sprints = None
+            for ver in versions:
+                self.add(ver, persist=False)
+            self._write_cache(self._versions)
+        return self
+
+    def add(self, version, persist=True):
+        """ Insert or replace a version (a VersionInfo or a redmine
+        Resource object of a sprint we just created) """
+        if isinstance(version, VersionInfo):
+            ver = VersionInfo(version.id, version.name, version.status,
+                              version.due_date)
+        else:
+            ver = VersionInfo(version.id, version.name)
+        with self._lock:
+            if ver.id in self._by_id:
+                self.remove(ver, persist=False)
+            self._versions.append(ver)
+            self._by_id[ver.id] = ver
+            self._by_name.setdefault(ver.name, ver)
+            if self._sprints is not None:
+                self._sprints.add(ver)
+            if persist:
+                self._write_cache(self._versions)
+        return ver
+
+    def remove(self, version, persist=True):
+        """ Forget about a deleted version"""
+        with self._lock:
+            ver = self._by_id.pop(version.id, None)
+            if ver is None:
+                return
+            self._versions.remove(ver)
+            if self._sprints is not None:
+                self._sprints.remove(ver)
+            if self._by_name.get(ver.name) is ver:
+                del self._by_name[ver.name]
+                # fall back to the next version with the same name if any
+                for other in self._versions:
+                    if other.name == ver.name:
+                        self._by_name[ver.name] = other
+                        break
+            if persist:
+                self._write_cache(self._versions)
+
+    def find_by_name(self, name):
+        """ @return the first version having the specified name or None"""
+        return self._by_name.get(name)
+
+    def find_by_id(self, version_id):
+        """ @return the version having the specified id or None"""
+        return self._by_id.get(version_id)
+
+    def find_newest_sprint(self, color):
+        """ @return the visible id ("065") of the newest "<color> Sprint 065"
+        version or None (@see SprintIndex) """
+        with self._lock:
+            return self._get_sprints().find_newest(color)
+
+    def find_sprint(self, color, due_date):
+        """ @return the "<color> Sprint NNN" version ending on `due_date`
+        or None """
+        due_date = str(due_date)
+        with self._lock:
+            for ver in self._versions:
+                parsed = SprintIndex.parse(ver.name)
+                if parsed is not None and parsed[0] == color.lower() \
+                        and ver.due_date == due_date:
+                    return ver
+        return None
+
+    def find_old_sprints(self, cycles, color=None):
+        """ @return the open sprints created more than `cycles` sprints
+        before the newest sprint of their color (@see SprintIndex) """
+        with self._lock:
+            found = [self._by_id[ver_id] for ver_id
+                     in self._get_sprints().find_older(cycles, color)]
+        return [ver for ver in found if ver.status == 'open']
+
+    def set_status(self, versions, status):
+        """ Save the new status of the versions (one cache file write)"""
+        with self._lock:
+            for version in versions:
+                ver = self._by_id.get(version.id)
+                if ver is not None:
+                    ver.status = status
+            self._write_cache(self._versions)
+
+    def count_active(self):
+        """ @return how many versions are open"""
+        with self._lock:
+            return len([ver for ver in self._versions
+                        if ver.status == 'open'])
+
+    def _get_sprints(self):
+        """ The index is built on the first call"""
+        if self._sprints is None:
+            self._sprints = SprintIndex(self._versions)
+        return self._sprints
+
+    def as_list(self):
+        """ @return list of {'id': ..., 'name': ...} dictionaries"""
+        with self._lock:
+            return [{'id': ver.id, 'name': ver.name}
+                    for ver in self._versions]
+
+    def _read_cache(self):
+        """ @return the list of cached versions or None if the cache file
+        is disabled, missing or expired"""
+        if not self.cache_file or not os.path.isfile(self.cache_file):
+            return None
+
+        try:
+            with open(self.cache_file) as fh:
+                entry = json.load(fh).get(self.cache_key)
+        except (IOError, ValueError) as exc:
+            logger.warn("Ignoring version cache file {}: {}"
+                        .format(self.cache_file, exc))
+            return None
+
+        if entry is None or time.time() - entry['saved_on'] > self.cache_ttl:
+            return None
+        # the files saved by older versions have fewer fields
+        return [VersionInfo(*fields) for fields in entry['versions']]
+
+    def _write_cache(self, versions):
+        """ Save the versions under the `cache_key` of the cache file"""
+        if not self.cache_file:
+            return
+
+        data = {}
+        if os.path.isfile(self.cache_file):
+            try:
+                with open(self.cache_file) as fh:
+                    data = json.load(fh)
+            except (IOError, ValueError):
+                data = {}
+
+        data[self.cache_key] = {
+            'saved_on': time.time(),
+            'versions': [[ver.id, ver.name, ver.status, ver.due_date]
+                         for ver in versions]}
+
+        tmp_file = "{}.tmp".format(self.cache_file)
+        with open(tmp_file, 'w') as fh:
+            json.dump(data, fh)
+        os.rename(tmp_file, self.cache_file)
+
+
+def list_project_versions():
+    """ Retrieve all the versions of the project using the API
+    (the errors are raised: an empty list would restart the numbering of
+    the sprints and end up in the cache file)
+    @return list of VersionInfo objects
+    """
     try:
         versions = get_client_instance().version.filter(
             project_id=env.project_name)
-        found = [{'id': ver.id, 'name': ver.name}
-                 for ver in versions]
-    except Exception:
-        pass
+        return [VersionInfo(ver.id, ver.name,
+                            getattr(ver, 'status', 'open'),
+                            get_due_date(ver))
+                for ver in versions]
+    except Exception as exc:
+        logger.error("Exception in list_project_versions(): {}".format(exc))
+        raise
+
 
-    return found
+def get_due_date(version):
+    """ @return the "YYYY-MM-DD" due date of a redmine version or None"""
+    due_date = getattr(version, 'due_date', None)
+    return str(due_date)[:10] if due_date else None
+
+
+def get_version_catalogue():
+    """
+    @return the VersionCatalogue for the current `api_url` and
+    `project_name` (the versions are listed only once per run)
+    """
+    global CATALOGUE
+    catalogue = CATALOGUE
+    if is_current_catalogue(catalogue):
+        return catalogue
+
+    with GLOBALS_LOCK:
+        if not is_current_catalogue(CATALOGUE):
+            CATALOGUE = VersionCatalogue(
+                env.api_url,
+                cache_file=env.get('version_cache_file'),
+                cache_ttl=int(env.get('version_cache_ttl', 0)),
+                project_name=env.get('project_name')).load()
+        return CATALOGUE
+
+
+def is_current_catalogue(catalogue):
+    """ @return True if the catalogue lists the versions of the current
+    environment """
+    return catalogue is not None and catalogue.api_url == env.api_url \
+        and catalogue.project_name == env.get('project_name')
 
 
 @task
-def copy_sprint_template_brown(is_dry_run=True):
+def copy_sprint_template_brown(is_dry_run=True, profile=False):
     require('environment', provided_by=[production, staging])
     copy_sprint(env.sprint_name_brown, env.start_date, env.repeat_after,
-                is_dry_run)
+                is_dry_run, profile)
 
 
 @task
-def copy_sprint_template_green(is_dry_run=True):
+def copy_sprint_template_green(is_dry_run=True, profile=False):
     require('environment', provided_by=[production, staging])
     copy_sprint(env.sprint_name_green, env.start_date, env.repeat_after,
-                is_dry_run)
+                is_dry_run, profile)
 
 
 @task
-def copy_sprint_template_misc(is_dry_run=True):
+def copy_sprint_template_misc(is_dry_run=True, profile=False):
     require('environment', provided_by=[production, staging])
     copy_sprint(env.sprint_name_misc, env.start_date, env.repeat_after,
-                is_dry_run)
-
+                is_dry_run, profile)
 
-def needs_to_run(date_ref, date_test, repeat_after):
-    """
-    :param date_ref: the day we enabled the cron (used as a reference)
-    :param date_test: usually this is today's date
-    :param repeat_after: after how many days the cron needs to re-run
 
-    @return true if we are in on the day when the cron job needs to run
-    """
-    needs = False
-
-    if date_ref is not None \
-            and date_test is not None \
-            and repeat_after is not None:
-        diff = date_test - date_ref
-
-        # logger.info("Diff days: {}".format(diff))
-
-        if 0 == (diff.days % repeat_after):
-            needs = True
-
-    return needs
-
-
-def copy_sprint(sprint_name, cron_start_date, cron_repeat_after, is_dry_run):
+def copy_sprint(sprint_name, cron_start_date, cron_repeat_after, is_dry_run,
+                profile=False):
     """
     :param sprint_name: string representing the template name to be copied
     :param cron_start_date: date used to decide if cron needs to be skipped/run
     :param cron_repeat_after: after how many days the cron needs to re-run
+    :param profile: save a cProfile dump and a trace timeline of the copy
     """
     date_ref = date.today()
-    cron_start_date = parse(cron_start_date).date()
+    skip_reason = get_skip_reason(cron_start_date, cron_repeat_after,
+                                  date_ref)
+    if skip_reason is not None:
+        abort(skip_reason)
+
+    if to_bool(is_dry_run):
+        abort(get_dry_run_message(sprint_name, date_ref))
+    get_outbox_sender()
 
-    if not needs_to_run(cron_start_date, date_ref, cron_repeat_after):
-        diff = date_ref - cron_start_date
-        abort("No need to copy the sprint since days passed [{}] is not a "
-              " multiple of [{}] specified in the `fabric.py` config file."
-              .format(diff.days, cron_repeat_after))
+    if to_bool(profile):
+        content = copy_template_profiled(sprint_name, date_ref)
+    else:
+        content = copy_template(sprint_name, date_ref)
+    send_summary(get_email_props(), content)
+    save_metrics()
 
-    # sanity check
+
+def to_bool(value):
+    """ Helper for parsing the boolean arguments passed to the fab tasks"""
+    if type(value) != bool:
+        value = value.lower() in ['t', 'true', '1']
+    return value
+
+
+def get_template_sprint(sprint_name):
+    """ Sanity check: @return the template sprint or abort"""
     old_sprint = get_sprint_from_name(sprint_name)
 
     if old_sprint is None:
         abort("Sprint [{}] does not exist. Please check the name."
               .format(sprint_name))
+    return old_sprint
 
+
+def get_dry_run_message(sprint_name, date_ref):
+    """ @return the description of what copy_template() would do"""
+    get_template_sprint(sprint_name)
     start_date, end_date = get_sprint_dates(date_ref)
+    new_sprint_name = get_new_sprint_name(sprint_name, start_date, end_date)
+    return ("Dry-run mode. In real mode will create a sprint "
+            "named [{}] for dates [{} to {}]"
+            .format(new_sprint_name, start_date, end_date))
 
-    if type(is_dry_run) != bool:
-        is_dry_run = is_dry_run.lower() in ['t', 'true', '1']
 
-    if is_dry_run:
-        new_sprint_name = get_new_sprint_name(sprint_name,
-                                              start_date, end_date)
-        abort("Dry-run mode. In real mode will create a sprint "
-              "named [{}] for dates [{} to {}]"
-              .format(new_sprint_name, start_date, end_date))
+def copy_template(sprint_name, date_ref):
+    """
+    Copy the template sprint to a new sprint starting after `date_ref`
 
-    new_sprint = create_sprint(sprint_name, start_date, end_date)
-    logger.info("Sprint [{}] was saved with id [{}]"
-                .format(new_sprint.name, new_sprint.id))
+    When the `journal_dir` setting is specified every created issue is
+    recorded in a journal so running the copy again after a failure
+    creates only the missing issues (@see open_journal()).
 
-    dividers = copy_dividers(old_sprint.id,
-                             new_sprint,
-                             start_date,
-                             end_date)
+    @return the html summary of the copied issues (a generator of chunks)
+    """
+    with METRICS.phase('template_read'), trace('template_read', 'phase'):
+        old_sprint = get_template_sprint(sprint_name)
+        template = load_template(old_sprint.id)
 
-    stories, tasks = copy_stories(old_sprint.id,
-                                  new_sprint,
-                                  start_date,
-                                  end_date)
+    start_date, end_date = get_sprint_dates(date_ref)
+    journal = open_journal(old_sprint.id, start_date)
+
+    existing = find_existing_sprint(sprint_name, end_date, journal)
+    if existing is not None:
+        check_sprint_complete(existing, template)
+        message = "Sprint [{}] for dates [{} to {}] already exists"\
+            .format(existing.name, start_date, end_date)
+        logger.info(message)
+        return iter(["<p>{}</p>".format(message)])
+
+    shards = []
+    with resumable([journal]):
+        if get_concurrency() > 1:
+            new_sprint, dividers, stories, tasks, shards = \
+                copy_template_graph(sprint_name, template, start_date,
+                                    end_date, journal)
+        else:
+            new_sprint, dividers, stories, tasks = copy_template_serial(
+                sprint_name, template, start_date, end_date, journal)
+
+    if journal is not None:
+        journal.close(complete=True)
 
     msg_divs = "\nCopied [{}] dividers".format(len(dividers))
     msg_tasks = "\nCopied [{}] stories and [{}] tasks "\
@@ -246,20 +766,561 @@ def copy_sprint(sprint_name, cron_start_date, cron_repeat_after, is_dry_run):
     logger.info(msg_divs)
     logger.info(msg_tasks)
 
-    email_props = EmailProps(
+    for name, story_count, task_count, seconds in shards:
+        logger.info("Project [{}]: copied [{}] stories and [{}] tasks in "
+                    "[{:.1f}] seconds".format(name, story_count, task_count,
+                                              seconds))
+
+    issues = itertools.chain(dividers, stories, tasks)
+    return render_content(old_sprint, new_sprint, issues, env.api_url,
+                          shards)
+
+
+@contextlib.contextmanager
+def resumable(journals):
+    """
+    Close the journals of a copy which failed (they are used for resuming
+    it) and forget about the journals of the copied sprints.
+    """
+    try:
+        yield
+    except BaseException:
+        for journal in journals:
+            if journal is not None:
+                journal.close()
+                logger.error("The copy was interrupted: run it again to "
+                             "resume it from the journal {}"
+                             .format(journal.path))
+        raise
+    finally:
+        for sprint_id, found in list(JOURNALS.items()):
+            if found in journals:
+                del JOURNALS[sprint_id]
+
+
+def copy_template_serial(sprint_name, template, start_date, end_date,
+                         journal=None):
+    """
+    Helper for copy_template(): create the sprint, the dividers and the
+    stories one by one
+
+    @return (new_sprint, dividers, stories, tasks)
+    """
+    with METRICS.phase('sprint_create'), trace('sprint_create', 'phase'):
+        new_sprint = start_sprint(sprint_name, template, start_date,
+                                  end_date, journal)
+    logger.info("Sprint [{}] was saved with id [{}]"
+                .format(new_sprint.name, new_sprint.id))
+
+    with METRICS.phase('divider_copy'), trace('divider_copy', 'phase'):
+        dividers = copy_dividers(template.sprint_id,
+                                 new_sprint,
+                                 start_date,
+                                 end_date,
+                                 template=template)
+
+    with METRICS.phase('story_copy'), trace('story_copy', 'phase'):
+        stories, tasks = copy_stories(template.sprint_id,
+                                      new_sprint,
+                                      start_date,
+                                      end_date,
+                                      template=template)
+    return new_sprint, dividers, stories, tasks
+
+
+def copy_template_graph(sprint_name, template, start_date, end_date,
+                        journal=None):
+    """
+    Helper for copy_template(): run the copy as a graph of API calls
+    (sprint -> dividers, sprint -> stories -> tasks) with at most
+    `concurrency` calls in flight. A failed call cancels the calls which
+    did not start yet.
+
+    The stories and tasks of every project are a shard limited by the
+    `project_concurrency` setting (@see get_story_scheduler()).
+
+    The divider/story copy phases report the time spent by all the
+    workers (the calls overlap) and `issue_copy` reports the wall time.
+
+    @return (new_sprint, dividers, stories, tasks, shards) in the template
+    order (@see get_shards())
+    """
+    dag = get_story_scheduler(get_concurrency())
+    add_template_nodes(dag, sprint_name, template, start_date, end_date,
+                       journal)
+
+    with METRICS.phase('issue_copy'), trace('issue_copy', 'phase'):
+        results = dag.run()
+
+    return collect_template_nodes(results, template) + (
+        get_shards(template.stories, template.tasks_by_story, dag.timings),)
+
+
+def add_template_nodes(dag, sprint_name, template, start_date, end_date,
+                       journal=None, new_sprint_name=None, prefix=()):
+    """
+    Add the nodes copying the template to a new sprint to the DagScheduler.
+    The keys start with `prefix` so several sprints can be copied by the
+    same scheduler (@see copy_template_windows()).
+    """
+    def create_sprint_node():
+        with METRICS.phase('sprint_create'):
+            new_sprint = start_sprint(sprint_name, template, start_date,
+                                      end_date, journal, new_sprint_name)
+        logger.info("Sprint [{}] was saved with id [{}]"
+                    .format(new_sprint.name, new_sprint.id))
+        return new_sprint
+
+    def create_divider_node(div):
+        def create(new_sprint):
+            logger.info("\n==> Copying divider [{}] for project [{}]"
+                        .format(div.subject, div.project_name))
+            with METRICS.phase('divider_copy'):
+                return create_story(div, new_sprint, start_date, end_date)
+        return create
+
+    sprint_key = dag.add(prefix + ('sprint',), create_sprint_node)
+    for div in template.dividers:
+        dag.add(prefix + ('divider', div.id), create_divider_node(div),
+                [sprint_key])
+    add_story_nodes(dag, sprint_key, template.stories,
+                    template.tasks_by_story, start_date, end_date, prefix)
+
+
+def collect_template_nodes(results, template, prefix=()):
+    """ @return (new_sprint, dividers, stories, tasks) in the template
+    order """
+    new_stories, new_tasks = collect_story_nodes(
+        results, template.stories, template.tasks_by_story, prefix)
+    return (results[prefix + ('sprint',)],
+            [results[prefix + ('divider', div.id)]
+             for div in template.dividers],
+            new_stories,
+            new_tasks)
+
+
+def copy_template_profiled(sprint_name, date_ref):
+    """
+    Run copy_template() under cProfile and record a timeline with one span
+    per API call and per story/task copy. The files are saved in the
+    `profile_dir` folder:
+        <sprint_name>_<timestamp>.prof (open with `python -m pstats`)
+        <sprint_name>_<timestamp>.trace.json (open with ui.perfetto.dev)
+    """
+    global TRACER
+    profile_dir = env.get('profile_dir') or '.'
+    if not os.path.isdir(profile_dir):
+        os.makedirs(profile_dir)
+    prefix = os.path.join(profile_dir, "{}_{}".format(
+        sprint_name, datetime.now().strftime('%Y%m%d_%H%M%S')))
+
+    profiler = Profiler()
+    TRACER = get_transport().tracer = Tracer()
+    profiler.start()
+    try:
+        return copy_template(sprint_name, date_ref)
+    finally:
+        profiler.stop()
+        TRACER.save(prefix + '.trace.json')
+        profiler.save(prefix + '.prof')
+        TRACER = get_transport().tracer = None
+        logger.info("Saved profile: {0}.prof and trace: {0}.trace.json"
+                    .format(prefix))
+
+
+def trace(name, category, **args):
+    """ @return a context manager recording a span when profiling"""
+    if TRACER is None:
+        return NULL_SPAN
+    return TRACER.span(name, category, **args)
+
+
+@task
+def generate_sprints(color, count=None, until=None, start=None,
+                     is_dry_run=True):
+    """
+    Create the sprints of several cycles in one run (e.g. after an outage
+    or ahead of time), e.g.:
+        fab production generate_sprints:green,count=3
+        fab production generate_sprints:green,until=2026-12-31,is_dry_run=False
+
+    The versions are listed and the template is read only once and the
+    sprints are copied by one DagScheduler so the run costs about one
+    write per created issue. The dates which already have a sprint are
+    skipped (and copy_sprint() skips the pre-generated sprints). Run it
+    again with the same `start` to resume a failed run (@see
+    open_journal()).
+
+    :param color: the template to copy (green, brown, misc)
+    :param count: how many sprints to create
+    :param until: create the sprints starting on or before this date
+        (instead of specifying the `count`)
+    :param start: the date used for the first sprint (defaults to today)
+    """
+    require('environment', provided_by=[production, staging])
+    if (count is None) == (until is None):
+        abort("Please specify either the `count` or the `until` date.")
+
+    template_name = env['sprint_name_{}'.format(color.lower())]
+    date_ref = parse(start).date() if start else date.today()
+    windows = get_sprint_windows(
+        date_ref,
+        count=int(count) if count is not None else None,
+        until=parse(until).date() if until is not None else None)
+    if not windows:
+        abort("No sprint starts before [{}]".format(until))
+
+    old_sprint = get_template_sprint(template_name)
+    journals = []
+    for start_date, end_date in list(windows):
+        journal = open_journal(old_sprint.id, start_date)
+        existing = find_existing_sprint(template_name, end_date, journal)
+        if existing is not None:
+            check_sprint_complete(existing, load_template(old_sprint.id))
+            logger.info("Skipping the dates [{} to {}]: sprint [{}] exists"
+                        .format(start_date, end_date, existing.name))
+            windows.remove((start_date, end_date))
+            continue
+        journals.append(journal)
+    if not windows:
+        logger.info("All the sprints exist already")
+        return
+    names = get_new_sprint_names(template_name, windows, journals)
+
+    if to_bool(is_dry_run):
+        abort("Dry-run mode. In real mode will create the sprints:\n{}"
+              .format('\n'.join("[{}] for dates [{} to {}]"
+                                .format(name, start_date, end_date)
+                                for name, (start_date, end_date)
+                                in zip(names, windows))))
+
+    get_outbox_sender()
+    content = copy_template_windows(template_name, old_sprint, windows,
+                                    names, journals)
+    send_summary(get_email_props(), content)
+    save_metrics()
+
+
+def get_sprint_windows(date_ref, count=None, until=None):
+    """
+    @return the (start_date, end_date) of `count` consecutive sprints (or
+    of the sprints starting on or before `until`) which are `repeat_after`
+    days apart (@see get_sprint_dates())
+    """
+    cycle = relativedelta(days=max(1, int(env.get('repeat_after', 14))))
+    windows = []
+    while True:
+        start_date, end_date = get_sprint_dates(date_ref)
+        if count is not None and len(windows) >= count \
+                or until is not None and start_date > until:
+            return windows
+        windows.append((start_date, end_date))
+        date_ref += cycle
+
+
+def get_new_sprint_names(template_name, windows, journals):
+    """
+    Number the new sprints from one lookup of the newest sprint created
+    from the template. A sprint resumed from its journal keeps the name
+    recorded by the interrupted copy.
+
+    @return list of names (one per window)
+    """
+    newest = find_newest_sprint_for_template(template_name, relist=True)
+    sequence = increment(newest['visible_id'])
+    names = []
+
+    for (start_date, end_date), journal in zip(windows, journals):
+        if journal is not None and journal.get('sprint') is not None:
+            names.append(journal.get('sprint')['name'])
+        elif journal is not None and journal.get('sprint_name') is not None:
+            names.append(journal.get('sprint_name'))
+        elif newest['color'] is None or sequence is None:
+            names.append(get_new_sprint_name(template_name, start_date,
+                                             end_date))
+        else:
+            names.append("{} Sprint {:0>3}".format(newest['color'],
+                                                   sequence))
+            sequence += 1
+    return names
+
+
+def copy_template_windows(sprint_name, old_sprint, windows, names,
+                          journals):
+    """
+    Helper for generate_sprints(): copy the template to one new sprint per
+    window. All the calls run in one DagScheduler (@see
+    add_template_nodes()) so the issues of a sprint are copied while the
+    other sprints are created, with at most `concurrency` calls in flight.
+
+    @return the html summary of all the sprints (a generator of chunks)
+    """
+    with METRICS.phase('template_read'), trace('template_read', 'phase'):
+        template = load_template(old_sprint.id)
+
+    dag = get_story_scheduler(get_concurrency())
+    for idx, ((start_date, end_date), name, journal) in \
+            enumerate(zip(windows, names, journals)):
+        add_template_nodes(dag, sprint_name, template, start_date, end_date,
+                           journal, name, prefix=(idx,))
+
+    with resumable(journals):
+        with METRICS.phase('issue_copy'), trace('issue_copy', 'phase'):
+            results = dag.run()
+
+    contents = []
+    for idx, journal in enumerate(journals):
+        if journal is not None:
+            journal.close(complete=True)
+        new_sprint, dividers, stories, tasks = collect_template_nodes(
+            results, template, prefix=(idx,))
+        logger.info("\nCopied [{}] dividers, [{}] stories and [{}] tasks to "
+                    "sprint [{}]".format(len(dividers), len(stories),
+                                         len(tasks), new_sprint.name))
+        contents.append(render_content(
+            old_sprint, new_sprint,
+            itertools.chain(dividers, stories, tasks), env.api_url))
+    return join_chunks("\n    <hr />\n", contents)
+
+
+@task
+def copy_sprint_templates(templates, is_dry_run=True, processes=False):
+    """
+    Copy several templates in one run, e.g.:
+        fab copy_sprint_templates:staging.green+production.misc
+        fab production copy_sprint_templates:green+misc
+
+    The templates of one environment share the client and the version
+    catalogue and are copied in parallel (one thread per template color).
+    With `processes=True` every environment is copied at the same time
+    in its own process. A single summary email is sent at the end and
+    the task fails (after sending it) if any template was not copied.
+
+    :param templates: '+' separated list of [environment.]color items
+    :param processes: copy each environment in a separate process
+    """
+    is_dry_run = to_bool(is_dry_run)
+    processes = to_bool(processes)
+    date_ref = date.today()
+    groups = parse_template_list(templates)
+    if not is_dry_run:
+        if groups and groups[0][0] is not None:
+            load_environ(groups[0][0])
+        if not processes:
+            get_outbox_sender()
+
+    if processes:
+        # the workers are forked before the outbox thread starts
+        # (@see run_in_processes())
+        results = fan_out_environments(groups, date_ref, is_dry_run)
+        if not is_dry_run:
+            get_outbox_sender()
+    else:
+        results = [copy_environment(target, colors, date_ref, is_dry_run)
+                   for target, colors in groups]
+    results = [result for result in results if result is not None]
+
+    if is_dry_run or not results:
+        abort_if_failed(get_failed_templates(results))
+        return results
+
+    # one email for all the environments sharing the same email settings
+    emails = []
+    for props, outcomes in results:
+        same = [email for email in emails
+                if vars(email[0]) == vars(props)]
+        if same:
+            same[0][1].extend(outcomes)
+        else:
+            emails.append((props, list(outcomes)))
+
+    for props, outcomes in emails:
+        send_summary(props, join_chunks(
+            "<hr />", [content for _, content, _ in outcomes]))
+    save_metrics()
+    # the summaries are rendered while they are sent
+    abort_if_failed(get_failed_templates(results))
+    return results
+
+
+def get_failed_templates(results):
+    """ Helper for copy_sprint_templates()
+    @return the names of the templates which were not copied or whose
+    summary could not be rendered (@see SafeSummary) """
+    return [name for _, outcomes in results
+            for name, content, ok in outcomes
+            if not ok or getattr(content, 'failed', False)]
+
+
+def abort_if_failed(sprint_names):
+    """ Helper for copy_sprint_templates(): exit with an error status so
+    cron and the monitoring see the failed templates """
+    if sprint_names:
+        abort("Unable to copy [{}] templates: {}"
+              .format(len(sprint_names), ', '.join(sprint_names)))
+
+
+def copy_environment(target, colors, date_ref, is_dry_run):
+    """
+    Helper for copy_sprint_templates(): copy the templates of one
+    environment (the current one if `target` is None).
+
+    @return (EmailProps, [(sprint_name, html content, ok), ...]) or None
+    if the environment is not scheduled to run on `date_ref`
+    """
+    if target is not None:
+        load_environ(target)
+    require('environment', provided_by=[production, staging])
+
+    skip_reason = get_skip_reason(env.start_date, env.repeat_after, date_ref)
+    if skip_reason is not None:
+        logger.info("[{}] {}".format(env.environment, skip_reason))
+        return None
+
+    sprint_names = [env['sprint_name_{}'.format(color)] for color in colors]
+    return (get_email_props(),
+            run_parallel(lambda name: copy_template_safely(
+                name, date_ref, is_dry_run), sprint_names, len(sprint_names)))
+
+
+def fan_out_environments(groups, date_ref, is_dry_run):
+    """
+    Helper for copy_sprint_templates(): copy every environment in its own
+    worker process. The metrics of the workers are added to METRICS and an
+    environment which fails (or whose process dies) is reported in the
+    summary without stopping the other ones.
+
+    :param groups: list of (environment, [color, ...])
+    @return list of (EmailProps, [(sprint_name, html content, ok), ...])
+    """
+    colors_by_target = OrderedDict()
+    for target, colors in groups:
+        if target is None:
+            target = env.get('environment')
+        if target is None:
+            abort("Please specify the environment of [{}], e.g. "
+                  "production.{}".format(colors[0], colors[0]))
+        merged = colors_by_target.setdefault(target, [])
+        merged.extend(color for color in colors if color not in merged)
+
+    items = [(name, target_colors, date_ref, is_dry_run)
+             for name, target_colors in colors_by_target.items()]
+    started = time.time()
+    outcomes = run_in_processes(copy_environment_in_process, items)
+    logger.info("Copied [{}] environments in [{:.1f}] seconds"
+                .format(len(items), time.time() - started))
+
+    results = []
+    for (target, colors, _, _), (ok, value) in zip(items, outcomes):
+        if ok and value is None:
+            continue
+        if ok:
+            props, copied, metrics, seconds = value
+            METRICS.merge(metrics)
+            logger.info("[{}] copied [{}] templates in [{:.1f}] seconds"
+                        .format(target, len(copied), seconds))
+            results.append((EmailProps(**props), copied))
+            continue
+
+        logger.error("[{}] unable to copy the templates: {}"
+                     .format(target, value))
+        try:
+            load_environ(target)
+            props = get_email_props()
+            sprint_names = [env['sprint_name_{}'.format(color)]
+                            for color in colors]
+        except (Exception, SystemExit) as exc:
+            logger.error("[{}] unable to report the failure: {}"
+                         .format(target, exc))
+            continue
+        results.append((props, [
+            (name, "<p>Unable to copy [{}] on [{}]. Please check the logs."
+                   "</p>".format(name, env.api_url), False)
+            for name in sprint_names]))
+    return results
+
+
+def copy_environment_in_process(target, colors, date_ref, is_dry_run):
+    """
+    Run copy_environment() in a worker process: the connections and the
+    metrics inherited from the parent process are not reused.
+
+    @return (email properties, copied, metrics dictionary, seconds)
+    """
+    global INSTANCE, TRANSPORT, CATALOGUE
+    INSTANCE = TRANSPORT = CATALOGUE = None
+    reset_metrics()
+
+    started = time.time()
+    result = copy_environment(target, colors, date_ref, is_dry_run)
+    if result is None:
+        return None
+    props, copied = result
+    # the summaries are sent to the parent process as strings
+    html = [''.join(iter_chunks(content)) for _, content, _ in copied]
+    failed = get_failed_templates([(props, copied)])
+    copied = [(name, text, name not in failed)
+              for (name, _, _), text in zip(copied, html)]
+    return (vars(props), copied, METRICS.to_dict(), time.time() - started)
+
+
+def copy_template_safely(sprint_name, date_ref, is_dry_run):
+    """
+    Helper for copy_sprint_templates(): a failed template does not stop
+    the other ones.
+
+    @return (sprint_name, html content, ok) where the content of a copied
+    template is a SafeSummary streamed when the email is written
+    """
+    try:
+        if is_dry_run:
+            message = get_dry_run_message(sprint_name, date_ref)
+            logger.info(message)
+            return (sprint_name, "<p>{}</p>".format(message), True)
+        content = copy_template(sprint_name, date_ref)
+        return (sprint_name, SafeSummary(sprint_name, content), True)
+    except (Exception, SystemExit) as exc:
+        logger.error("Unable to copy [{}] on [{}]: {}"
+                     .format(sprint_name, env.environment, exc))
+        return (sprint_name,
+                "<p>Unable to copy [{}] on [{}]. Please check the logs.</p>"
+                .format(sprint_name, env.api_url), False)
+
+
+class SafeSummary(object):
+    """
+    The html summary of a copied template, rendered one chunk at a time
+    while the email is written. A rendering error ends the summary with an
+    error message and sets `failed` instead of dropping the summaries of
+    the other templates.
+    """
+
+    def __init__(self, sprint_name, chunks):
+        """constuctor"""
+        self.sprint_name = sprint_name
+        self.chunks = chunks
+        self.failed = False
+
+    def __iter__(self):
+        try:
+            for chunk in iter_chunks(self.chunks):
+                yield chunk
+        except Exception as exc:
+            self.failed = True
+            logger.error("Unable to render the summary of [{}]: {}"
+                         .format(self.sprint_name, exc))
+            yield ("<p>Unable to copy [{}]: the summary is incomplete. "
+                   "Please check the logs.</p>".format(self.sprint_name))
+
+
+def get_email_props():
+    """ @return EmailProps for the current environment"""
+    return EmailProps(
         env.email_sender,
         env.email_recipient,
         env.email_subject,
         env.email_server)
 
-    issues = []
-    issues.extend(dividers)
-    issues.extend(stories)
-    issues.extend(tasks)
-
-    content = format_content(old_sprint, new_sprint, issues, env.api_url)
-    send_summary(email_props, content)
-
 
 def load_environ(target, new_settings={}):
     """ Load an environment properties file 'environ/fabric.py' """
@@ -282,57 +1343,317 @@ def get_sprint_from_name(name):
 
     @return None if the specified sprint name is not found
     """
-    spr = None
-    try:
-        sprints = get_client_instance().version.filter(
-            project_id="admin_project")
-        found = [sprint for sprint in sprints if sprint.name == name]
-        spr = found[0]
-    except Exception as exc:
-        logger.error("Exception in get_sprint_from_name(): {}".format(exc))
-        pass
-    return spr
+    return get_version_catalogue().find_by_name(name)
 
 
 def delete_sprint(sprint):
-    """Delete stories and tasks for the specified sprint"""
-    deleted_stories = []
-    deleted_tasks = []
+    """
+    Delete all the issues of the specified sprint and then the sprint.
+
+    The issues are found with one paged query and deleted level by level
+    using the worker pool: first the leaves (tasks and dividers), then
+    their parents (stories), so we never delete an issue twice.
+
+    @return (deleted_parents, deleted_leaves)
+    """
+    deleted_parents = []
+    deleted_leaves = []
+
+    if sprint is None:
+        return (deleted_parents, deleted_leaves)
+
+    logger.info("Deleting sprint [{}]: {}".format(sprint.id, sprint.name))
+    timings = []
+    started = time.time()
+
+    issues = list(stream_resources('issue',
+                                   status_id='*',
+                                   fixed_version_id=sprint.id))
+    timings.append(('listing', time.time() - started))
+
+    for height, level in enumerate(group_issues_by_height(issues)):
+        level_started = time.time()
+        run_parallel(delete_issue, level)
+        if height == 0:
+            deleted_leaves.extend(level)
+        else:
+            deleted_parents.extend(level)
+        timings.append(('level {}'.format(height),
+                        time.time() - level_started))
+
+    # finally delete the sprint
+    version_started = time.time()
+    get_client_instance().version.delete(sprint.id)
+    get_version_catalogue().remove(sprint)
+    wait_for_version_deletion(sprint.id)
+    timings.append(('version', time.time() - version_started))
+
+    logger.info("Deleted sprint [{}] with [{}] parent and [{}] leaf issues "
+                "in {:.2f}s ({})"
+                .format(sprint.name, len(deleted_parents),
+                        len(deleted_leaves), time.time() - started,
+                        ', '.join("{}: {:.2f}s".format(name, elapsed)
+                                  for name, elapsed in timings)))
+    return (deleted_parents, deleted_leaves)
+
+
+def group_issues_by_height(issues):
+    """
+    Helper for delete_sprint().
+    The height of an issue is the length of the longest path to one of its
+    descendants (0 for tasks and dividers, 1 for stories with tasks...)
+
+    @return list of lists of issues: the leaves first, the roots last
+    """
+    by_id = dict((issue.id, issue) for issue in issues)
+    heights = dict((issue.id, 0) for issue in issues)
+
+    for issue in issues:
+        height = 0
+        current = issue
+        while hasattr(current, 'parent') and current.parent.id in by_id:
+            height += 1
+            current = by_id[current.parent.id]
+            heights[current.id] = max(heights[current.id], height)
+
+    levels = [[] for _ in range(max(heights.values()) + 1 if heights else 0)]
+    for issue in issues:
+        levels[heights[issue.id]].append(issue)
+    return levels
+
+
+def delete_issue(issue):
+    """ Delete one issue (an issue which is already gone is not an error)"""
+    logger.info("Deleting: {}".format(to_string(issue)))
+    try:
+        get_client_instance().issue.delete(issue.id)
+    except ResourceNotFoundError:
+        logger.warn("Issue [{}] was already deleted".format(issue.id))
+    return issue
+
+
+def wait_for_version_deletion(version_id):
+    """
+    Poll the API until the version is gone instead of sleeping a fixed
+    amount of time. The wait is bounded by the `delete_poll_timeout`
+    setting (seconds).
+
+    @return True if the version is confirmed as deleted
+    """
+    timeout = float(env.get('delete_poll_timeout', 10))
+    delay = 0.1
+    started = time.time()
+
+    while True:
+        try:
+            get_client_instance().version.get(version_id)
+        except ResourceNotFoundError:
+            return True
+
+        if time.time() - started + delay > timeout:
+            logger.warn("Version [{}] still exists after {} seconds"
+                        .format(version_id, timeout))
+            return False
+        time.sleep(delay)
+        delay = min(delay * 2, 1)
+
+
+@task
+def archive_old_sprints(cycles=6, status='closed', color=None,
+                        archive_file=None, is_dry_run=True):
+    """
+    Close (or lock) the generated sprints which are more than `cycles`
+    sprints older than the newest sprint of their color, e.g.:
+        fab production archive_old_sprints:cycles=6
+        fab production archive_old_sprints:color=green,is_dry_run=False
+        fab production archive_old_sprints:archive_file=old.json,is_dry_run=0
+
+    :param cycles: how many of the newest sprints of every color to keep
+    :param status: 'closed' or 'locked'
+    :param color: only archive the sprints of one template (green, brown...)
+    :param archive_file: save the old versions as json lines in this file
+        before they are updated
+    """
+    require('environment', provided_by=[production, staging])
+    if status not in ('closed', 'locked'):
+        abort("Invalid status [{}]. Please use 'closed' or 'locked'."
+              .format(status))
+
+    catalogue = get_version_catalogue()
+    old_sprints = catalogue.find_old_sprints(int(cycles), color)
+    active = catalogue.count_active()
+    logger.info("Found [{}] sprints older than [{}] cycles: {}"
+                .format(len(old_sprints), cycles,
+                        ', '.join(ver.name for ver in old_sprints)))
+
+    if to_bool(is_dry_run):
+        logger.info("Dry run: the active version list would go from [{}] to "
+                    "[{}] versions".format(active, active - len(old_sprints)))
+        return
+
+    if archive_file:
+        export_versions(old_sprints, archive_file)
+
+    outcomes = run_parallel(
+        lambda ver: call_safely(update_version_status, ver, status),
+        old_sprints)
+    archived = [ver for ver, (ok, _) in zip(old_sprints, outcomes) if ok]
+    catalogue.set_status(archived, status)
+    logger.info("Archived [{}] sprints: the active version list went from "
+                "[{}] to [{}] versions"
+                .format(len(archived), active, catalogue.count_active()))
+
+    failed = ["{}: {}".format(ver.name, value) for ver, (ok, value)
+              in zip(old_sprints, outcomes) if not ok]
+    if failed:
+        abort("Unable to archive [{}] sprints:\n{}"
+              .format(len(failed), '\n'.join(failed)))
+
+
+def update_version_status(version, status):
+    """ Helper for archive_old_sprints()"""
+    logger.info("Setting the status of [{}] to: {}"
+                .format(version.name, status))
+    get_client_instance().version.update(version.id, status=status)
+    return version
+
+
+def export_versions(versions, archive_file):
+    """
+    Append the versions retrieved from the API to the archive file (one
+    json line per version)
+    """
+    client = get_client_instance()
+    found = run_parallel(lambda ver: dict(client.version.get(ver.id)),
+                         versions)
+    archived_on = datetime.utcnow().strftime(DATETIME_FORMAT)
+    with open(archive_file, 'a') as fh:
+        for attributes in found:
+            fh.write(json.dumps({'api_url': env.api_url,
+                                 'archived_on': archived_on,
+                                 'version': attributes}) + '\n')
+    logger.info("Saved [{}] versions to the archive: {}"
+                .format(len(found), archive_file))
+
+
+def open_journal(old_sprint_id, start_date):
+    """
+    @return the Journal of the copy of the template for `start_date` in
+    the `journal_dir` folder (None if the setting is not specified)
+    """
+    journal_dir = env.get('journal_dir')
+    if not journal_dir:
+        return None
+    server = re.sub('[^a-z0-9]+', '_', env.api_url.lower()).strip('_')
+    return Journal(os.path.join(journal_dir, "{}_{}_{}.journal".format(
+        server, old_sprint_id, start_date.strftime('%Y%m%d')))).load()
 
-    if sprint is not None:
-        logger.info("Deleting sprint [{}]: {}"
-                    .format(sprint.id, sprint.name))
-        stories = get_client_instance().issue.filter(
-            tracker_id=TRACKERS[TRACKER_STORY],
-            fixed_version_id=sprint.id)
 
-        for story in stories:
-            for taskk in story.children:
-                logger.info("Deleting: {}".format(to_string(taskk)))
-                get_client_instance().issue.delete(taskk.id)
-                deleted_tasks.append(taskk)
+def start_sprint(sprint_name, template, start_date, end_date, journal=None,
+                 new_sprint_name=None):
+    """
+    Helper for copy_template(): create the new sprint or -- when the
+    `journal` comes from an interrupted copy -- find the sprint created
+    by that copy. The issues created by a copy are found by their
+    version id in JOURNALS (@see create_story()).
+
+    :param new_sprint_name: the name of the new sprint (computed by
+        get_new_sprint_name() if not specified)
+    @return the new sprint
+    """
+    if journal is None:
+        return create_sprint(sprint_name, start_date, end_date,
+                             new_sprint_name)
+
+    journal.plan(['sprint'] + ['issue:{}'.format(issue.id)
+                               for issue in template.issues()])
+    catalogue = get_version_catalogue()
+    new_sprint = None
+    if journal.get('sprint') is not None:
+        new_sprint = catalogue.find_by_id(journal.get('sprint')['id'])
+    elif journal.get('sprint_name') is not None:
+        # the sprint may have been created right before the interruption
+        new_sprint = catalogue.find_by_name(journal.get('sprint_name'))
+
+    if new_sprint is None and len(journal):
+        logger.warn("The sprint of the journal {} does not exist: starting "
+                    "over".format(journal.path))
+        journal.reset()
+        journal.plan(['sprint'] + ['issue:{}'.format(issue.id)
+                                   for issue in template.issues()])
+
+    if new_sprint is None:
+        new_sprint_name = new_sprint_name or get_new_sprint_name(
+            sprint_name, start_date, end_date)
+        journal.record('sprint_name', new_sprint_name)
+        new_sprint = create_sprint(sprint_name, start_date, end_date,
+                                   new_sprint_name)
+    else:
+        logger.info("Resuming the copy to sprint [{}]: [{}] operations "
+                    "left".format(new_sprint.name, journal.remaining()))
+        adopt_untracked_issues(journal, template, new_sprint)
 
-            logger.info("Deleting: {}".format(to_string(story)))
-            get_client_instance().issue.delete(story.id)
-            deleted_stories.append(story)
+    if journal.get('sprint') is None:
+        journal.record('sprint', {'id': new_sprint.id,
+                                  'name': new_sprint.name})
+    JOURNALS[new_sprint.id] = journal
+    return new_sprint
 
-        # finally delete the sprint
-        get_client_instance().version.delete(sprint.id)
-    return (deleted_stories, deleted_tasks)
+
+def adopt_untracked_issues(journal, template, new_sprint):
+    """
+    Record the issues created by the interrupted copy after its last
+    journal entry (the create succeeded but the entry was not written).
+    Issues are matched like in sync_sprint(), using one paged listing.
+    """
+    known = set(value['id'] for key, value in journal.done.items()
+                if key.startswith('issue:'))
+    untracked = {}
+    for issue in stream_resources('issue', status_id='*',
+                                  fixed_version_id=new_sprint.id):
+        if issue.id in known:
+            continue
+        parent_id = issue.parent.id if hasattr(issue, 'parent') else None
+        key = (issue.project.id, parent_id, issue.subject)
+        untracked.setdefault(key, []).append(issue)
+
+    def adopt(issue, parent_id):
+        key = 'issue:{}'.format(issue.id)
+        if journal.get(key) is None:
+            found = untracked.get((issue.project_id, parent_id,
+                                   issue.subject))
+            if not found:
+                return None
+            record = IssueRecord.from_resource(found.pop(0))
+            journal.record(key, record.to_dict())
+            logger.info("Adopted the untracked issue #{}".format(record.id))
+        return journal.get(key)['id']
+
+    for div in template.dividers:
+        adopt(div, None)
+    for story in template.stories:
+        new_story_id = adopt(story, None)
+        if new_story_id is None:
+            continue
+        for taskk in template.tasks_by_story.get(story.id, []):
+            adopt(taskk, new_story_id)
 
 
-def create_sprint(template_sprint_name, start_date, end_date):
+def create_sprint(template_sprint_name, start_date, end_date,
+                  new_sprint_name=None):
     """
     Create a sprint with a specified name.
 
     :param template_sprint_name: string representing the template to be copied
+    :param new_sprint_name: the name of the new sprint (computed by
+        get_new_sprint_name() if not specified)
     :return sprint: the new object
     """
-    new_sprint_name = get_new_sprint_name(template_sprint_name,
-                                          start_date, end_date)
+    if new_sprint_name is None:
+        new_sprint_name = get_new_sprint_name(template_sprint_name,
+                                              start_date, end_date)
     sprint = get_sprint_from_name(new_sprint_name)
     delete_sprint(sprint)
-    time.sleep(1)
 
     try:
         sprint = get_client_instance().version.create(
@@ -344,11 +1665,43 @@ def create_sprint(template_sprint_name, start_date, end_date):
             sprint_start_date=start_date,
             effective_date=end_date)
     except Exception as exc:
-        abort("Unable to save sprint due: ".format(exc))
+        abort("Unable to save sprint due: {}".format(exc))
 
+    get_version_catalogue().add(VersionInfo(sprint.id, sprint.name, 'open',
+                                            str(end_date)))
     return sprint
 
 
+def find_existing_sprint(template_name, end_date, journal=None):
+    """
+    @return the sprint created from the template which ends on `end_date`
+    (e.g. ahead of time by generate_sprints()) or None. The sprint of an
+    interrupted copy is resumed from its `journal` instead.
+    """
+    color = get_template_color(template_name)
+    if color is None or journal is not None and len(journal):
+        return None
+    return get_version_catalogue().find_sprint(color, end_date)
+
+
+def check_sprint_complete(sprint, template):
+    """
+    Abort if the sprint has fewer issues than a copy of the template
+    creates: the copy was interrupted and there is no journal to resume it
+    (skipping the sprint would silently leave the missing issues out).
+    """
+    found = get_client_instance().issue.filter(status_id='*',
+                                               fixed_version_id=sprint.id,
+                                               limit=1)
+    list(found)
+    expected = template.count_copied()
+    if found.total_count < expected:
+        abort("Sprint [{}] has only [{}] of the [{}] issues of the template: "
+              "a copy was interrupted. Please delete the sprint and copy "
+              "the template again.".format(sprint.name, found.total_count,
+                                           expected))
+
+
 def get_sprint_dates(date_ref):
     """
     Compute the date range for the sprint:
@@ -370,32 +1723,26 @@ def get_template_color(template_name):
     return m.group(2).title() if m is not None else None
 
 
-def find_newest_sprint_for_template(template_name):
+def find_newest_sprint_for_template(template_name, relist=False):
     """
     Helper method for get_new_sprint_name().
     If input is "TEMPLATE_SPRINT_GREEN" then the expected output is
         {'color': 'Green', 'visible_id': 'the_number_in_name'}
+
+    :param relist: True to list the versions again if they were not listed
+        during this run (before numbering a new sprint the catalogue must
+        include the sprints created elsewhere)
     @return dict
     """
     color = get_template_color(template_name)
     visible_id = None
-    versions = get_versions()
 
     if color is not None:
-        max_found = 0
-        max_name = ''
-
-        for ver in versions:
-            # check if "Green" is in the "Green Sprint xyz" string
-            if int(ver['id']) > max_found and color in ver['name']:
-                max_found = int(ver['id'])
-                max_name = ver['name']
-
-        # finally extract the "xyz" from the newest "Green Sprint xyz"
-        max_name = max_name.replace('  ', ' ').strip()
-        m = re.match('([a-z].*) (sprint) ([0-9].*)', max_name, re.IGNORECASE)
-        # print "found: {} from {}".format(m.group(3), max_name)
-        visible_id = m.group(3) if m is not None else None
+        catalogue = get_version_catalogue()
+        if relist:
+            catalogue.reload(since=RUN_STARTED)
+        # the "xyz" of the "Green Sprint xyz" with the highest number
+        visible_id = catalogue.find_newest_sprint(color)
 
     data = {'color': color, 'visible_id': visible_id}
     logger.info("For sprint [{}] found data: {}".format(template_name, data))
@@ -431,7 +1778,8 @@ def get_new_sprint_name(template_name, start_date, end_date):
     """
     name = None
 
-    newest_sprint = find_newest_sprint_for_template(template_name)
+    newest_sprint = find_newest_sprint_for_template(template_name,
+                                                    relist=True)
 
     if newest_sprint['color'] is not None:
         # adhere to the historical naming convention "Green Sprint 065"
@@ -456,68 +1804,155 @@ def create_story(story, new_sprint, start_date, end_date):
     """
     Called from copy_stories()
     @see create_sprint()
+
+    @return IssueRecord
     """
     logger.info("using sprint: {} {}"
-                .format(new_sprint.id, new_sprint.created_on,
-                        new_sprint.due_date))
+                .format(new_sprint.id, new_sprint.name))
+    journal = JOURNALS.get(new_sprint.id)
+    key = 'issue:{}'.format(story.id)
+    if journal is not None and journal.get(key) is not None:
+        return IssueRecord(**journal.get(key))
+
     try:
-        new_story = get_client_instance().issue.create(
-            project_id=story.project.id,
-            subject=story.subject,
-            tracker_id=TRACKERS[TRACKER_STORY],
-            description=CREATED_BY,
-            status_id=ISSUE_STATUS_NEW,
-            priority_id=1,
-            # assigned_to_id=
-            start_date=start_date,
-            due_date=end_date,
-            fixed_version_id=new_sprint.id)
+        with trace('copy story', 'copy', template_issue_id=story.id):
+            new_story = get_client_instance().issue.create(
+                project_id=story.project_id,
+                subject=story.subject,
+                tracker_id=TRACKERS[TRACKER_STORY],
+                description=CREATED_BY,
+                status_id=ISSUE_STATUS_NEW,
+                priority_id=1,
+                # assigned_to_id=
+                start_date=start_date,
+                due_date=end_date,
+                fixed_version_id=new_sprint.id)
     except Exception as exc:
-        abort("Unable to save story [{}] due:".format(story.id, exc))
+        abort("Unable to save story [{}] due: {}".format(story.id, exc))
 
     logger.debug("Created story: {}".format(story.subject))
-    return new_story
+    record = IssueRecord(new_story.id, TRACKERS[TRACKER_STORY], story.subject,
+                         version_id=new_sprint.id)
+    if journal is not None:
+        journal.record(key, record.to_dict())
+    return record
 
 
-def create_story_tasks(story, new_story, start_date, end_date):
+def create_story_task(story, taskk, new_story, start_date):
     """
-    Given a template story copy all it's task to the new_story
-    """
-    new_tasks = []
+    Copy one template task of the `story` to the `new_story`.
+    Called from create_story_tasks() and from the parallel copy
 
-    for task_stub in story.children:
-        taskk = get_client_instance().issue.get(task_stub.id)
-        logger.info(to_string(taskk))
+    :param taskk: a TemplateIssue returned by prefetch_template_tasks()
+    :param new_story: the IssueRecord of the story
+    @return IssueRecord
+    """
+    logger.info(taskk)
+    journal = JOURNALS.get(new_story.version_id)
+    key = 'issue:{}'.format(taskk.id)
+    if journal is not None and journal.get(key) is not None:
+        return IssueRecord(**journal.get(key))
 
-        try:
+    try:
+        with trace('copy task', 'copy', template_issue_id=taskk.id,
+                   template_story_id=story.id):
             new_task = get_client_instance().issue.create(
-                project_id=story.project.id,
+                project_id=story.project_id,
                 subject=taskk.subject,
                 tracker_id=TRACKERS[TRACKER_TASK],
                 description=CREATED_BY,
                 status_id=ISSUE_STATUS_NEW,
                 priority_id=2,
-                fixed_version_id=new_story.fixed_version.id,
+                fixed_version_id=new_story.version_id,
                 is_private=False,
-                assigned_to_id=taskk.assigned_to.id
-                if hasattr(taskk, 'assigned_to')
-                else None,
-                estimated_hours=taskk.estimated_hours
-                if hasattr(taskk, 'estimated_hours')
-                else None,
+                assigned_to_id=taskk.assigned_to_id,
+                estimated_hours=taskk.estimated_hours,
                 parent_issue_id=new_story.id,
                 start_date=start_date,
                 done_ratio=0
             )
-            new_tasks.append(new_task)
-        except Exception as exc:
-            abort("Unable to save task [{}] due:"
-                  .format(taskk.id, exc))
+    except Exception as exc:
+        abort("Unable to save task [{}] due: {}"
+              .format(taskk.id, exc))
+    record = IssueRecord(new_task.id, TRACKERS[TRACKER_TASK], taskk.subject,
+                         taskk.assigned_to_name, taskk.estimated_hours,
+                         new_story.id, new_story.version_id)
+    if journal is not None:
+        journal.record(key, record.to_dict())
+    return record
+
+
+def create_story_tasks(story, new_story, start_date, end_date, tasks):
+    """
+    Given a template story copy all it's task to the new_story
+
+    :tasks: the template tasks of the story (@see prefetch_template_tasks())
+    """
+    new_tasks = []
+
+    for taskk in tasks:
+        new_task = create_story_task(story, taskk, new_story, start_date)
+        new_tasks.append(new_task)
     return new_tasks
 
 
+def list_template_issues(old_sprint_id):
+    """ @return the TemplateIssue objects of all the issues (any tracker and
+    status) in the template sprint """
+    return [TemplateIssue.from_resource(issue)
+            for issue in stream_resources('issue',
+                                          status_id='*',
+                                          fixed_version_id=old_sprint_id,
+                                          sort='id')]
+
+
+def prefetch_template_tasks(old_sprint_id, issues=None):
+    """
+    Load all the tasks of the template sprint using paged `issue.filter`
+    calls instead of fetching the children of every story one by one.
+    The children of any tracker are copied as tasks (like the
+    `story.children` loop did) so the listing is not filtered by tracker.
+
+    Note: the backlogs plugin keeps tasks in the same version as their
+    story so filtering by `fixed_version_id` finds all of them.
+
+    :param issues: the issues returned by list_template_issues() (listed
+        if not specified)
+    @return dict {parent_story_id: [TemplateIssue, ...]} with tasks in
+    creation order
+    """
+    if issues is None:
+        issues = list_template_issues(old_sprint_id)
+
+    by_parent = {}
+    for taskk in issues:
+        if taskk.parent_id is None:
+            continue
+        if taskk.tracker_id != TRACKERS[TRACKER_TASK]:
+            logger.info("Copying the child #{} of story #{} as a task "
+                        "(tracker [{}])".format(taskk.id, taskk.parent_id,
+                                                taskk.tracker_id))
+        by_parent.setdefault(taskk.parent_id, []).append(taskk)
+    return by_parent
+
+
+def get_template_stories(old_sprint_id, for_project=None):
+    """
+    @return the stories of the template sprint (optionally only the ones
+    associated with the `for_project` project)
+    """
+    if for_project is not None:
+        return stream_resources('issue',
+                                project_id=for_project,
+                                tracker_id=TRACKERS[TRACKER_STORY],
+                                fixed_version_id=old_sprint_id)
+    return stream_resources('issue',
+                            tracker_id=TRACKERS[TRACKER_STORY],
+                            fixed_version_id=old_sprint_id)
+
+
 def copy_stories(old_sprint_id, new_sprint, start_date, end_date,
-                 for_project=None):
+                 for_project=None, template=None):
     """
     Copy stories with any status form `old_sprint_id` to `new_sprint_id`.
     If `for_project` argument is specified then copy only the stories
@@ -528,36 +1963,540 @@ def copy_stories(old_sprint_id, new_sprint, start_date, end_date,
     :start_date: new sprint start date
     :end_date: new sprint end date
     :for_project: optional name of the project for which to copy the stories
+    :template: the Template to copy (read from the API if not specified)
     """
-    if for_project is not None:
-        stories = get_client_instance().issue.filter(
-            project_id=for_project,
-            tracker_id=TRACKERS[TRACKER_STORY],
-            fixed_version_id=old_sprint_id)
+    if template is None:
+        stories = [TemplateIssue.from_resource(story) for story
+                   in get_template_stories(old_sprint_id, for_project)]
+        tasks_by_story = prefetch_template_tasks(old_sprint_id)
     else:
-        stories = get_client_instance().issue.filter(
-            tracker_id=TRACKERS[TRACKER_STORY],
-            fixed_version_id=old_sprint_id)
+        stories = template.get_stories(for_project)
+        tasks_by_story = template.tasks_by_story
+
+    workers = get_concurrency()
+    if workers > 1:
+        return copy_stories_parallel(stories, tasks_by_story, new_sprint,
+                                     start_date, end_date, workers)
 
     new_stories = []
     new_tasks = []
 
     for story in stories:
+        tasks = tasks_by_story.get(story.id, [])
         logger.info("\n==> Copying {0} tasks from story #{1.id}: {1.subject}"
-                    .format(len(story.children), story))
+                    .format(len(tasks), story))
         new_story = create_story(story, new_sprint, start_date, end_date)
         if new_story is None:
             logger.error("Unable to create story [{}] for sprint [{}]"
                          .format(story, new_sprint.id))
             continue
-        new_tasks = create_story_tasks(story, new_story, start_date, end_date)
+        story_tasks = create_story_tasks(story, new_story,
+                                         start_date, end_date, tasks)
         new_stories.append(new_story)
-        new_tasks.extend(new_tasks)
+        new_tasks.extend(story_tasks)
+
+    return (new_stories, new_tasks)
+
+
+class TemplateIssue(object):
+    """ Data storage object for the fields we copy from a template issue"""
+
+    FIELDS = ('id', 'tracker_id', 'project_id', 'project_name', 'subject',
+              'parent_id', 'assigned_to_id', 'assigned_to_name',
+              'estimated_hours', 'updated_on')
+
+    def __init__(self, **kwargs):
+        """constuctor"""
+        for field in self.FIELDS:
+            setattr(self, field, kwargs.get(field))
+
+    @classmethod
+    def from_resource(cls, issue):
+        """ Keep only the fields we need from a python-redmine issue"""
+        updated_on = None
+        if hasattr(issue, 'updated_on'):
+            updated_on = issue.updated_on.strftime(DATETIME_FORMAT)
+
+        return cls(
+            id=issue.id,
+            tracker_id=issue.tracker.id,
+            project_id=issue.project.id,
+            project_name=issue.project.name,
+            subject=issue.subject,
+            parent_id=issue.parent.id if hasattr(issue, 'parent') else None,
+            assigned_to_id=issue.assigned_to.id
+            if hasattr(issue, 'assigned_to') else None,
+            assigned_to_name=issue.assigned_to.name
+            if hasattr(issue, 'assigned_to') else None,
+            estimated_hours=issue.estimated_hours
+            if hasattr(issue, 'estimated_hours') else None,
+            updated_on=updated_on)
+
+    def to_dict(self):
+        return dict((field, getattr(self, field)) for field in self.FIELDS)
+
+    def __str__(self):
+        issue_type = next((k for k, v in TRACKERS.items()
+                           if v == self.tracker_id), 'issue')
+        text = "  {} #{}: {}".format(issue_type, self.id, self.subject)
+
+        if self.assigned_to_id is not None:
+            text += ', assigned: {}'.format(self.assigned_to_name)
+        if self.estimated_hours is not None:
+            text += ', estimated_hours: {}'.format(self.estimated_hours)
+        return text
+
+
+class IssueRecord(object):
+    """
+    The fields of a created (or synced) issue reported in the summary
+    email. The creation calls fill it from the data they already have so
+    the report needs no request and keeps no python-redmine resource.
+    """
+
+    __slots__ = ('id', 'tracker_id', 'subject', 'assigned_to_name',
+                 'estimated_hours', 'parent_id', 'version_id')
+
+    def __init__(self, id, tracker_id, subject, assigned_to_name=None,
+                 estimated_hours=None, parent_id=None, version_id=None):
+        """constuctor"""
+        self.id = id
+        self.tracker_id = tracker_id
+        self.subject = subject
+        self.assigned_to_name = assigned_to_name
+        self.estimated_hours = estimated_hours
+        self.parent_id = parent_id
+        self.version_id = version_id
+
+    @classmethod
+    def from_resource(cls, issue):
+        """ Keep the fields of an issue returned by a listing"""
+        return cls(
+            issue.id,
+            issue.tracker.id,
+            issue.subject,
+            assigned_to_name=issue.assigned_to.name
+            if hasattr(issue, 'assigned_to') else None,
+            estimated_hours=issue.estimated_hours
+            if hasattr(issue, 'estimated_hours') else None,
+            parent_id=issue.parent.id if hasattr(issue, 'parent') else None,
+            version_id=issue.fixed_version.id
+            if hasattr(issue, 'fixed_version') else None)
+
+    def to_dict(self):
+        return dict((field, getattr(self, field)) for field in self.__slots__)
+
+    def __str__(self):
+        issue_type = next((k for k, v in TRACKERS.items()
+                           if v == self.tracker_id), 'issue')
+        text = "  {} #{}: {}".format(issue_type, self.id, self.subject)
+
+        if self.assigned_to_name is not None:
+            text += ', assigned: {}'.format(self.assigned_to_name)
+        if self.estimated_hours is not None:
+            text += ', estimated_hours: {}'.format(self.estimated_hours)
+        return text
+
+
+class Template(object):
+    """
+    The dividers, stories and tasks of a template sprint.
+    The `watermark` is the newest `updated_on` and the `issue_count` the
+    number of all the issues in the template sprint (@see
+    is_template_updated()).
+    """
+
+    def __init__(self, sprint_id, dividers, stories, tasks_by_story,
+                 taken_on=None, issue_count=None, watermark=None):
+        """constuctor"""
+        self.sprint_id = sprint_id
+        self.dividers = dividers
+        self.stories = stories
+        self.tasks_by_story = tasks_by_story
+        self.taken_on = taken_on or time.time()
+        self.issue_count = issue_count
+
+        dates = [issue.updated_on for issue in self.issues()
+                 if issue.updated_on is not None]
+        self.watermark = watermark or (max(dates) if dates else None)
+
+    def issues(self):
+        """ @return all the template issues"""
+        found = list(self.dividers) + list(self.stories)
+        for tasks in self.tasks_by_story.values():
+            found.extend(tasks)
+        return found
+
+    def count_copied(self):
+        """ @return how many issues a copy of the template creates"""
+        return len(self.dividers) + len(self.stories) + sum(
+            len(self.tasks_by_story.get(story.id, []))
+            for story in self.stories)
+
+    def get_stories(self, for_project=None):
+        """ @return the stories (optionally only for one project)"""
+        if for_project is None:
+            return self.stories
+        return [story for story in self.stories
+                if str(for_project) in (str(story.project_id),
+                                        story.project_name)]
+
+    def to_dict(self):
+        return {
+            'sprint_id': self.sprint_id,
+            'taken_on': self.taken_on,
+            'issue_count': self.issue_count,
+            'watermark': self.watermark,
+            'dividers': [div.to_dict() for div in self.dividers],
+            'stories': [story.to_dict() for story in self.stories],
+            'tasks': [taskk.to_dict()
+                      for story in self.stories
+                      for taskk in self.tasks_by_story.get(story.id, [])]}
+
+    @classmethod
+    def from_dict(cls, data):
+        tasks_by_story = {}
+        for item in data['tasks']:
+            taskk = TemplateIssue(**item)
+            tasks_by_story.setdefault(taskk.parent_id, []).append(taskk)
+
+        return cls(data['sprint_id'],
+                   [TemplateIssue(**item) for item in data['dividers']],
+                   [TemplateIssue(**item) for item in data['stories']],
+                   tasks_by_story,
+                   data['taken_on'],
+                   data.get('issue_count'),
+                   data.get('watermark'))
+
+
+def read_template(old_sprint_id):
+    """ Read the template sprint issues using the API"""
+    issues = list_template_issues(old_sprint_id)
+    dates = [issue.updated_on for issue in issues
+             if issue.updated_on is not None]
+    return Template(
+        old_sprint_id,
+        [TemplateIssue.from_resource(div)
+         for div in get_template_dividers(old_sprint_id)],
+        [TemplateIssue.from_resource(story)
+         for story in get_template_stories(old_sprint_id)],
+        prefetch_template_tasks(old_sprint_id, issues),
+        issue_count=len(issues),
+        watermark=max(dates) if dates else None)
+
+
+def load_template(old_sprint_id):
+    """
+    Use the template already read by this process or the local snapshot
+    of the template when the `template_snapshot_dir` setting is specified
+    if no template issue was updated since it was taken (this needs one
+    request). Otherwise read the template using the API and save a new
+    snapshot.
+
+    Note: the deleted issues are noticed by the issue count (@see
+    is_template_updated()) and the snapshot is also refreshed when older
+    than `template_snapshot_max_age` days.
+
+    @return Template
+    """
+    key = (env.api_url, old_sprint_id)
+    snapshot_dir = env.get('template_snapshot_dir')
+    snapshot_file = get_template_snapshot_file(snapshot_dir, old_sprint_id) \
+        if snapshot_dir else None
+    max_age = float(env.get('template_snapshot_max_age', 7)) * 86400
+    template = TEMPLATES.get(key)
+
+    if template is None and snapshot_file and os.path.isfile(snapshot_file):
+        try:
+            with open(snapshot_file) as fh:
+                template = Template.from_dict(json.load(fh))
+        except (IOError, ValueError, KeyError, TypeError) as exc:
+            logger.warn("Ignoring template snapshot {}: {}"
+                        .format(snapshot_file, exc))
+
+    if template is not None \
+            and time.time() - template.taken_on < max_age \
+            and not is_template_updated(template):
+        logger.info("Using the template snapshot of sprint [{}]"
+                    .format(old_sprint_id))
+        TEMPLATES[key] = template
+        return template
+
+    template = TEMPLATES[key] = read_template(old_sprint_id)
+    if not snapshot_file:
+        return template
+    if not os.path.isdir(snapshot_dir):
+        os.makedirs(snapshot_dir)
+
+    tmp_file = "{}.tmp".format(snapshot_file)
+    with open(tmp_file, 'w') as fh:
+        json.dump(template.to_dict(), fh)
+    os.rename(tmp_file, snapshot_file)
+    logger.info("Saved the template snapshot: {}".format(snapshot_file))
+    return template
+
+
+def get_template_snapshot_file(snapshot_dir, old_sprint_id):
+    """ @return the snapshot file name for the template on this server"""
+    server = re.sub('[^a-z0-9]+', '_', env.api_url.lower()).strip('_')
+    return os.path.join(snapshot_dir, "{}_{}.json"
+                        .format(server, old_sprint_id))
+
+
+def is_template_updated(template):
+    """
+    @return True if any template issue was changed after the `watermark`
+    or if the number of issues changed (updated_on does not reveal the
+    issues deleted or moved to another version)
+    """
+    if template.watermark is None or template.issue_count is None:
+        return True
+
+    newest = get_client_instance().issue.filter(
+        status_id='*',
+        fixed_version_id=template.sprint_id,
+        sort='updated_on:desc',
+        limit=1)
+    updated = [issue for issue in newest
+               if issue.updated_on.strftime(DATETIME_FORMAT)
+               > template.watermark]
+    if newest.total_count != template.issue_count:
+        logger.info("The template sprint [{}] has [{}] issues instead of [{}]"
+                    .format(template.sprint_id, newest.total_count,
+                            template.issue_count))
+        return True
+    return len(updated) > 0
+
+
+def copy_stories_parallel(stories, tasks_by_story, new_sprint,
+                          start_date, end_date, workers):
+    """
+    Same as copy_stories() but using a DagScheduler with `workers` calls
+    in flight. Stories are created in parallel and the tasks of each story
+    start as soon as the new story id is known.
+
+    The returned lists preserve the template order and the first failure
+    cancels the calls which did not start yet and aborts the copy just
+    like the serial version.
+    """
+    stories = list(stories)
+    dag = get_story_scheduler(workers)
+    sprint_key = dag.add('sprint', lambda: new_sprint)
+    add_story_nodes(dag, sprint_key, stories, tasks_by_story,
+                    start_date, end_date)
+    return collect_story_nodes(dag.run(), stories, tasks_by_story)
+
 
+def add_story_nodes(dag, sprint_key, stories, tasks_by_story,
+                    start_date, end_date, prefix=()):
+    """
+    Add one node per story (depending on the sprint node) and one node
+    per task (depending on the story node) to the DagScheduler.
+    The nodes of one project belong to the same group (shard).
+    """
+    def create_story_node(story):
+        def create(new_sprint):
+            logger.info("\n==> Copying {0} tasks from story #{1.id}: "
+                        "{1.subject}"
+                        .format(len(tasks_by_story.get(story.id, [])), story))
+            with METRICS.phase('story_copy'):
+                return create_story(story, new_sprint, start_date, end_date)
+        return create
+
+    def create_task_node(story, taskk):
+        def create(new_story):
+            with METRICS.phase('story_copy'):
+                return create_story_task(story, taskk, new_story, start_date)
+        return create
+
+    for story in stories:
+        story_key = dag.add(prefix + ('story', story.id),
+                            create_story_node(story), [sprint_key],
+                            group=story.project_id)
+        for taskk in tasks_by_story.get(story.id, []):
+            dag.add(prefix + ('task', taskk.id),
+                    create_task_node(story, taskk), [story_key],
+                    group=story.project_id)
+
+
+def get_story_scheduler(workers):
+    """
+    @return a DagScheduler limiting the calls in flight for one project to
+    the `project_concurrency` setting (defaults to an equal share of the
+    `workers` for every project with issues left to copy)
+    """
+    try:
+        quota = int(env.get('project_concurrency') or 0)
+    except (TypeError, ValueError):
+        quota = 0
+    return DagScheduler(workers, group_quota=max(0, quota) or None)
+
+
+def get_shards(stories, tasks_by_story, timings):
+    """
+    @return list of (project name, stories, tasks, seconds) for every
+    project in the template order
+    """
+    shards = OrderedDict()
+    for story in stories:
+        name, story_count, task_count = shards.get(
+            story.project_id, (story.project_name, 0, 0))
+        shards[story.project_id] = (
+            name, story_count + 1,
+            task_count + len(tasks_by_story.get(story.id, [])))
+    return [(project_name, shard_stories, shard_tasks,
+             timings.get(project_id, 0.0))
+            for project_id, (project_name, shard_stories, shard_tasks)
+            in shards.items()]
+
+
+def collect_story_nodes(results, stories, tasks_by_story, prefix=()):
+    """ @return (new_stories, new_tasks) in the template order"""
+    new_stories = []
+    new_tasks = []
+    for story in stories:
+        new_stories.append(results[prefix + ('story', story.id)])
+        new_tasks.extend(results[prefix + ('task', taskk.id)]
+                         for taskk in tasks_by_story.get(story.id, []))
     return (new_stories, new_tasks)
 
 
-def copy_dividers(old_sprint_id, new_sprint, start_date, end_date):
+def get_concurrency():
+    """
+    @return the number of worker threads configured by the `concurrency`
+    setting in the `fabric.py` config file (defaults to serial execution)
+    """
+    try:
+        workers = int(env.get('concurrency', 1))
+    except (TypeError, ValueError):
+        workers = 1
+    return max(1, workers)
+
+
+def _unwrap(outcome):
+    """Re-raise the failure captured by call_safely() or return the value"""
+    ok, value = outcome
+    if not ok:
+        raise value
+    return value
+
+
+def run_parallel(func, items, workers=None):
+    """
+    Call `func(item)` for every item using a pool of `workers` threads
+    (defaults to the `concurrency` setting).
+
+    @return list of results in the same order as the items
+    """
+    items = list(items)
+    workers = min(workers or get_concurrency(), max(1, len(items)))
+
+    if workers == 1:
+        return [func(item) for item in items]
+
+    pool = ThreadPool(workers)
+    try:
+        outcomes = pool.map(lambda item: call_safely(func, item), items)
+    finally:
+        pool.close()
+        pool.join()
+    return [_unwrap(outcome) for outcome in outcomes]
+
+
+def run_in_processes(func, items):
+    """
+    Call `func(*item)` for every item in its own process (all at the
+    same time). A failure of one process -- even a crash -- does not stop
+    the other ones.
+
+    Note: call it before starting other threads (e.g. the outbox sender):
+    a forked process could inherit a lock held by one of them and hang.
+
+    @return list of (True, result) or (False, error message) in the same
+    order as the items
+    """
+    started = []
+    for item in items:
+        reader, writer = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.Process(target=_send_outcome,
+                                          args=(writer, func, item))
+        process.start()
+        writer.close()
+        started.append((process, reader))
+
+    outcomes = []
+    for process, reader in started:
+        try:
+            outcome = reader.recv()
+        except EOFError:
+            outcome = None
+        process.join()
+        if outcome is None:
+            outcome = (False, "The process exited with code [{}]"
+                       .format(process.exitcode))
+        outcomes.append(outcome)
+    return outcomes
+
+
+def _send_outcome(writer, func, item):
+    """ Helper for run_in_processes(): the exceptions are sent as text
+    since they are not always picklable """
+    ok, value = call_safely(func, *item)
+    if not ok:
+        value = "{}: {}".format(type(value).__name__, value)
+    writer.send((ok, value))
+    writer.close()
+
+
+def stream_resources(resource, workers=None, **filters):
+    """
+    Iterate over the resources matching the `filters` using pages of
+    PAGE_SIZE items. The first page tells the total count and the
+    remaining pages are fetched concurrently (`concurrency` setting).
+    Items are yielded in order as soon as their page arrived so the
+    caller can start working before the listing finishes.
+
+    :param resource: the name of the redmine manager ('issue', 'project')
+    :param workers: how many pages to fetch at the same time
+    """
+    client = get_client_instance()
+
+    def fetch(offset):
+        manager = getattr(client, resource)
+        if filters:
+            page = manager.filter(limit=PAGE_SIZE, offset=offset, **filters)
+        else:
+            page = manager.all(limit=PAGE_SIZE, offset=offset)
+        return list(page), page.total_count
+
+    items, total_count = fetch(0)
+    for item in items:
+        yield item
+
+    offsets = list(range(PAGE_SIZE, total_count, PAGE_SIZE))
+    workers = min(workers or get_concurrency(), max(1, len(offsets)))
+
+    if workers == 1:
+        for offset in offsets:
+            for item in fetch(offset)[0]:
+                yield item
+        return
+
+    pool = ThreadPool(workers)
+    try:
+        pages = pool.imap(lambda offset: call_safely(fetch, offset),
+                          offsets)
+        for outcome in pages:
+            for item in _unwrap(outcome)[0]:
+                yield item
+    finally:
+        # the caller could stop iterating before the last page
+        pool.terminate()
+        pool.join()
+
+
+def copy_dividers(old_sprint_id, new_sprint, start_date, end_date,
+                  template=None):
     """
     Copy dividers (aka placeholders) form `old_sprint_id` to `new_sprint_id`.
     Note: Redmine API dows not support filters in which more than one
@@ -567,23 +2506,180 @@ def copy_dividers(old_sprint_id, new_sprint, start_date, end_date):
     :new_sprint_id:
     :start_date: new sprint start date
     :end_date: new sprint end date
+    :template: the Template to copy (read from the API if not specified)
     """
-    dividers = get_client_instance().issue.filter(
-        status_id=ISSUE_STATUS_NEW,
-        tracker_id=TRACKERS[TRACKER_PLACEHOLDER],
-        fixed_version_id=old_sprint_id)
-
+    if template is None:
+        dividers = [TemplateIssue.from_resource(div)
+                    for div in get_template_dividers(old_sprint_id)]
+    else:
+        dividers = template.dividers
     new_divs = []
 
     for div in dividers:
         logger.info("\n==> Copying divider [{}] for project [{}]"
-                    .format(div.subject, div.project.name))
+                    .format(div.subject, div.project_name))
         new_div = create_story(div, new_sprint, start_date, end_date)
         new_divs.append(new_div)
 
     return new_divs
 
 
+def get_template_dividers(old_sprint_id):
+    """ @return the dividers (aka placeholders) of the template sprint"""
+    return stream_resources('issue',
+                            status_id=ISSUE_STATUS_NEW,
+                            tracker_id=TRACKERS[TRACKER_PLACEHOLDER],
+                            fixed_version_id=old_sprint_id)
+
+
+@task
+def sync_sprint_template(color, target_name=None, with_updates=False):
+    """
+    Create only the template issues missing from an existing sprint
+    (e.g. to finish a copy which failed half way), e.g.:
+        fab production sync_sprint_template:green
+        fab production sync_sprint_template:misc,target_name=Misc Sprint 010
+
+    :param color: the template to use (green, brown, misc)
+    :param target_name: the sprint to update (defaults to the newest
+        sprint created from the template)
+    :param with_updates: also copy the assignee and the estimated hours of
+        the template tasks to the existing tasks
+    """
+    require('environment', provided_by=[production, staging])
+    template_name = env['sprint_name_{}'.format(color.lower())]
+    old_sprint = get_template_sprint(template_name)
+    target = get_sync_target(template_name, target_name)
+    get_outbox_sender()
+
+    created, updated = sync_sprint(old_sprint, target,
+                                   to_bool(with_updates))
+    logger.info("\nSynced sprint [{}]: created [{}] and updated [{}] issues"
+                .format(target.name, len(created), len(updated)))
+
+    if created or updated:
+        content = render_content(old_sprint, target, created + updated,
+                                 env.api_url)
+        send_summary(get_email_props(), content)
+
+
+def get_sync_target(template_name, target_name=None):
+    """
+    Helper for sync_sprint_template()
+    @return the sprint to sync (the newest one created from the template
+    when `target_name` is not specified)
+    """
+    if target_name is None:
+        newest = find_newest_sprint_for_template(template_name)
+        if newest['visible_id'] is None:
+            abort("No sprint was created yet from [{}]. Please specify the "
+                  "`target_name`.".format(template_name))
+        target_name = "{} Sprint {}".format(newest['color'],
+                                            newest['visible_id'])
+
+    target = get_sprint_from_name(target_name)
+    if target is None:
+        abort("Sprint [{}] does not exist. Please check the name."
+              .format(target_name))
+    return target
+
+
+def get_sprint_window(sprint):
+    """ @return the (start_date, end_date) of an existing sprint"""
+    version = get_client_instance().version.get(sprint.id)
+    end_date = parse(str(version.due_date)).date()
+
+    if hasattr(version, 'sprint_start_date') and version.sprint_start_date:
+        start_date = parse(str(version.sprint_start_date)).date()
+    else:
+        start_date = end_date + relativedelta(days=-13)
+    return (start_date, end_date)
+
+
+def sync_sprint(old_sprint, new_sprint, with_updates=False):
+    """
+    Compare the template sprint with an existing copy and create only the
+    missing dividers, stories and tasks. Issues are matched by project,
+    parent and subject so the cost is a few listings plus one request for
+    every missing (or updated) issue.
+
+    @return (created, updated) lists of IssueRecord
+    """
+    start_date, end_date = get_sprint_window(new_sprint)
+
+    existing = {}
+    for issue in stream_resources('issue', status_id='*',
+                                  fixed_version_id=new_sprint.id):
+        parent_id = issue.parent.id if hasattr(issue, 'parent') else None
+        key = (issue.project.id, parent_id, issue.subject)
+        existing.setdefault(key, []).append(issue)
+
+    def take(project_id, parent_id, subject):
+        """ @return the first unmatched existing issue with this key"""
+        found = existing.get((project_id, parent_id, subject))
+        return found.pop(0) if found else None
+
+    created = []
+    updated = []
+    template = load_template(old_sprint.id)
+
+    for div in template.dividers:
+        if take(div.project_id, None, div.subject) is None:
+            created.append(create_story(div, new_sprint,
+                                        start_date, end_date))
+
+    for story in template.stories:
+        new_story = take(story.project_id, None, story.subject)
+        if new_story is None:
+            new_story = create_story(story, new_sprint, start_date, end_date)
+            created.append(new_story)
+        else:
+            new_story = IssueRecord.from_resource(new_story)
+
+        missing = []
+        for taskk in template.tasks_by_story.get(story.id, []):
+            new_task = take(story.project_id, new_story.id, taskk.subject)
+            if new_task is None:
+                missing.append(taskk)
+            elif with_updates and update_task(taskk, new_task):
+                updated.append(IssueRecord(
+                    new_task.id, TRACKERS[TRACKER_TASK], new_task.subject,
+                    taskk.assigned_to_name, taskk.estimated_hours,
+                    new_story.id, new_sprint.id))
+
+        created.extend(run_parallel(
+            lambda taskk: create_story_task(story, taskk, new_story,
+                                            start_date), missing))
+    return (created, updated)
+
+
+def update_task(taskk, new_task):
+    """
+    Helper for sync_sprint(): copy the assignee and the estimated hours of
+    the template task
+
+    :param taskk: the TemplateIssue
+    :param new_task: the existing task
+
+    @return True if the task needed an update
+    """
+    changes = {}
+    assigned_to_id = taskk.assigned_to_id
+    estimated_hours = taskk.estimated_hours
+
+    if assigned_to_id != (new_task.assigned_to.id
+                          if hasattr(new_task, 'assigned_to') else None):
+        changes['assigned_to_id'] = assigned_to_id
+    if estimated_hours != (new_task.estimated_hours
+                           if hasattr(new_task, 'estimated_hours') else None):
+        changes['estimated_hours'] = estimated_hours
+
+    if changes:
+        logger.info("Updating {}: {}".format(to_string(new_task), changes))
+        get_client_instance().issue.update(new_task.id, **changes)
+    return bool(changes)
+
+
 def to_string(issue):
     """Helper for debugging issue attributes"""
     # Translate an issue id into a name
@@ -611,7 +2707,14 @@ class EmailProps(object):
         self.email_server = email_server
 
 
-def format_content(old_sprint, new_sprint, issues, api_url):
+def render_content(old_sprint, new_sprint, issues, api_url, shards=None):
+    """
+    Render the summary of the copy one issue at a time
+
+    :param issues: iterable of IssueRecord
+    :param shards: list of (project name, stories, tasks, seconds)
+    @return a generator of html chunks
+    """
     url_old = '<a href="{}/versions/{}">{}</a>'\
         .format(api_url, old_sprint.id, old_sprint.name)
     url_new = '<a href="{}/versions/{}">{}</a>'\
@@ -619,9 +2722,8 @@ def format_content(old_sprint, new_sprint, issues, api_url):
 
     how = "List of issues copied from sprint {} to sprint {}"\
         .format(url_old, url_new)
-    what = "<li>" + "<li>".join([to_string(issue) for issue in issues])
 
-    html = """
+    yield """
     <p>
     Hello Team,
     <br />
@@ -630,37 +2732,92 @@ def format_content(old_sprint, new_sprint, issues, api_url):
     <a href="https://github.com/indera/redman">redman&#8482;</a>.
     </p>
     <p> {} </p>
-    <ul> {} </ul>
-    """.format(how, what)
-    return html
+    """.format(how)
+    if shards:
+        yield """<table>
+    <tr><th>Project</th><th>Stories</th><th>Tasks</th><th>Time</th></tr>
+    """
+        for shard in shards:
+            yield ("<tr><td>{}</td><td>{}</td><td>{}</td><td>{:.1f} s</td>"
+                   "</tr>\n    ".format(*shard))
+        yield """</table>
+    """
+    yield "<ul> "
+    for issue in issues:
+        yield "<li>{}".format(issue)
+    yield """ </ul>
+    """
+
+
+def iter_chunks(content):
+    """ @return a generator of the chunks of a string or an iterable"""
+    if isinstance(content, basestring):
+        content = [content]
+    for chunk in content:
+        yield chunk
+
+
+def join_chunks(separator, contents):
+    """ Like `separator.join(contents)` without building the string"""
+    for idx, content in enumerate(contents):
+        if idx:
+            yield separator
+        for chunk in iter_chunks(content):
+            yield chunk
 
 
 def send_summary(props, content):
-    """Helper for building the email body"""
-    email = """
+    """
+    Helper for building the email body
+
+    :param content: a string or an iterable of html chunks (which are
+        written to the outbox spool one by one)
+    """
+    email = itertools.chain(
+        ["""
     <html>
+    """],
+        iter_chunks(content),
+        ["""
+    <hr />
     {}
     <hr />
     Have a great day!
     </html>
-    """.format(content)
-    send_email(props, email)
+    """.format(METRICS.to_html())])
+    with METRICS.phase('email'):
+        send_email(props, email)
 
 
 def send_email(email_props, content):
-    """ Helper for sending emails"""
+    """ Queue the email in the outbox spool: it is delivered by a
+    background thread so the copy does not wait for the SMTP server"""
     p = email_props
-    mess = Message(charset="utf-8")
-    mess.From = p.email_sender
-    mess.To = p.email_recipient
-    mess.Subject = p.email_subject
-    mess.Html = content
-    mess.Body = "Please enable HTML in your client to view this message."
-    sender = Mailer(p.email_server)
+    sender = get_outbox_sender()
+    sender.outbox.put(p.email_server, p.email_sender, p.email_recipient,
+                      p.email_subject, content)
+    sender.notify()
+    logger.info("Email [{}] to [{}] was queued"
+                .format(p.email_subject, p.email_recipient))
 
-    try:
-        sender.send(mess)
-        logger.info("Email [{}] was sent to: {}".format(mess.Subject, mess.To))
-    except Exception as exc:
-        logger.error("Problem sending email [{}] to [{}]: {}"
-                     .format(p.email_subject, p.email_recipient, exc))
+
+def get_outbox_sender():
+    """
+    Start the thread delivering the emails of the `email_spool_dir` folder
+    (shared by all the environments) with one SMTP connection per server.
+    The tasks start it before copying so the emails left by the previous
+    runs are retried right away.
+
+    Before exiting we wait at most `email_send_timeout` seconds for the
+    delivery; the undelivered emails stay in the spool for the next run.
+    """
+    global OUTBOX_SENDER
+    if OUTBOX_SENDER is None:
+        outbox = Outbox(env.get('email_spool_dir') or 'outbox',
+                        backoff=float(env.get('email_retry_backoff', 300)))
+        OUTBOX_SENDER = OutboxSender(outbox)
+        OUTBOX_SENDER.start()
+        OUTBOX_SENDER.notify()
+        atexit.register(OUTBOX_SENDER.close,
+                        float(env.get('email_send_timeout', 60)))
+    return OUTBOX_SENDER
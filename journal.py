@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Goal: resume a copy which failed half way without creating duplicates
+
+The journal is an append-only file with one json line per entry:
+
+    {"op": "plan", "key": "issue:123"}
+    {"op": "done", "key": "issue:123", "value": {"id": 456, ...}}
+
+The `plan` entries list the operations of the copy (the sprint and one
+entry per template issue) and a `done` entry is written -- and synced
+to the disk -- as soon as an operation completes. A torn line left by a
+crash is ignored when the journal is loaded.
+
+@see fabfile.open_journal()
+"""
+
+import os
+import json
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class Journal(object):
+    """
+    Usage:
+        journal = Journal(path).load()
+        journal.plan(['sprint', 'issue:1', 'issue:2'])
+        if journal.get('issue:1') is None:
+            journal.record('issue:1', {'id': new_issue.id})
+        journal.close(complete=True)
+    """
+
+    def __init__(self, path):
+        """
+        :param path: the journal file (created by the first entry)
+        """
+        self.path = path
+        self.planned = []
+        self.done = {}
+        self._fh = None
+        self._torn = False
+        self._lock = threading.Lock()
+
+    def load(self):
+        """ Replay the entries saved by a previous run"""
+        if not os.path.isfile(self.path):
+            return self
+        planned = set()
+        with open(self.path) as fh:
+            lines = fh.readlines()
+        # the next entry must not be appended to a torn line
+        self._torn = bool(lines) and not lines[-1].endswith('\n')
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                logger.warn("Ignoring a torn journal entry in {}"
+                            .format(self.path))
+                continue
+            if entry['op'] == 'plan' and entry['key'] not in planned:
+                planned.add(entry['key'])
+                self.planned.append(entry['key'])
+            elif entry['op'] == 'done':
+                self.done[entry['key']] = entry['value']
+        return self
+
+    def __len__(self):
+        return len(self.done)
+
+    def remaining(self):
+        """ @return how many planned operations are not done"""
+        return len([key for key in self.planned if key not in self.done])
+
+    def plan(self, keys):
+        """ Add the operations which are not planned yet (one write)"""
+        known = set(self.planned)
+        new_keys = [key for key in keys if key not in known]
+        self.planned.extend(new_keys)
+        self._append([{'op': 'plan', 'key': key} for key in new_keys])
+
+    def get(self, key):
+        """ @return the value recorded when the operation was done"""
+        return self.done.get(key)
+
+    def record(self, key, value):
+        """ Save durably that the operation is done"""
+        self._append([{'op': 'done', 'key': key, 'value': value}])
+        self.done[key] = value
+
+    def close(self, complete=False):
+        """ Close the file and remove it if the copy is `complete`"""
+        with self._lock:
+            if self._fh is not None:
+                self._fh.close()
+                self._fh = None
+        if complete and os.path.isfile(self.path):
+            os.remove(self.path)
+
+    def reset(self):
+        """ Forget the entries and remove the file"""
+        self.close(complete=True)
+        self.planned = []
+        self.done = {}
+        self._torn = False
+
+    def _append(self, entries):
+        if not entries:
+            return
+        data = ''.join(json.dumps(entry) + '\n' for entry in entries)
+        with self._lock:
+            if self._torn:
+                data = '\n' + data
+                self._torn = False
+            if self._fh is None:
+                folder = os.path.dirname(self.path)
+                if folder and not os.path.isdir(folder):
+                    os.makedirs(folder)
+                self._fh = open(self.path, 'a')
+            self._fh.write(data)
+            self._fh.flush()
+            os.fsync(self._fh.fileno())
@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Goal: collect request metrics and phase timings for every copy run
+
+The `Transport` reports every attempt (endpoint, verb, latency, error)
+and the fabfile reports how long each phase of the copy took. The data
+is saved as json and as a Prometheus textfile-collector file and it is
+summarized at the end of the summary email.
+
+@see fabfile.get_transport()
+@see fabfile.save_metrics()
+"""
+
+import os
+import re
+import json
+import time
+import threading
+import contextlib
+from collections import OrderedDict
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# (verb, path pattern, endpoint name) used for grouping the API calls
+ENDPOINTS = [
+    ('GET', r'/projects\.json$', 'project_list'),
+    ('GET', r'/projects/[^/]+/versions\.json$', 'version_list'),
+    ('POST', r'/projects/[^/]+/versions\.json$', 'version_create'),
+    ('GET', r'/versions/\d+\.json$', 'version_get'),
+    ('PUT', r'/versions/\d+\.json$', 'version_update'),
+    ('DELETE', r'/versions/\d+\.json$', 'version_delete'),
+    ('GET', r'/issues\.json$', 'issue_filter'),
+    ('POST', r'/issues\.json$', 'issue_create'),
+    ('PUT', r'/issues\.json$', 'issue_create'),
+    ('GET', r'/issues/\d+\.json$', 'issue_get'),
+    ('PUT', r'/issues/\d+\.json$', 'issue_update'),
+    ('DELETE', r'/issues/\d+\.json$', 'issue_delete'),
+]
+
+
+def get_endpoint(method, url):
+    """ @return the endpoint name of a request url (or 'other')"""
+    path = url.split('?')[0]
+    for verb, pattern, name in ENDPOINTS:
+        if verb == method.upper() and re.search(pattern, path):
+            return name
+    return 'other'
+
+
+class Histogram(object):
+    """ Count the observed values by bucket"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        """constuctor"""
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for idx, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[idx] += 1
+                break
+
+    def merge(self, data):
+        """ Add the observations of a histogram saved with to_dict()"""
+        previous = 0
+        for idx, bound in enumerate(self.buckets):
+            cumulative = data['buckets'][str(bound)]
+            self.counts[idx] += cumulative - previous
+            previous = cumulative
+        self.count += data['count']
+        self.sum += data['sum']
+
+    def cumulative(self):
+        """ @return list of (upper bound, observations <= bound)"""
+        total, result = 0, []
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def to_dict(self):
+        return {'count': self.count,
+                'sum': round(self.sum, 6),
+                'buckets': OrderedDict((str(bound), count)
+                                       for bound, count in self.cumulative())}
+
+
+class RequestStats(object):
+    """ Data storage object for one (endpoint, verb) pair"""
+
+    def __init__(self):
+        """constuctor"""
+        self.count = 0
+        self.errors = 0
+        self.latency = Histogram()
+
+
+class Metrics(object):
+    """
+    Thread-safe registry of the request statistics and phase timings.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.requests = {}
+        self.phases = OrderedDict()
+
+    def record_request(self, method, url, latency, error=False):
+        """
+        :param latency: how many seconds the attempt took
+        :param error: True if the attempt failed or returned a 4xx/5xx
+        """
+        key = (get_endpoint(method, url), method.upper())
+        with self._lock:
+            stats = self.requests.setdefault(key, RequestStats())
+            stats.count += 1
+            stats.errors += 1 if error else 0
+            stats.latency.observe(latency)
+
+    def add_phase(self, name, seconds):
+        """ Phases executed several times (one per template) add up"""
+        with self._lock:
+            total, count = self.phases.get(name, (0.0, 0))
+            self.phases[name] = (total + seconds, count + 1)
+
+    def merge(self, data):
+        """ Add the metrics collected by another process (the result of
+        its to_dict() call) """
+        with self._lock:
+            for item in data['requests']:
+                stats = self.requests.setdefault(
+                    (item['endpoint'], item['method']), RequestStats())
+                stats.count += item['count']
+                stats.errors += item['errors']
+                stats.latency.merge(item['latency'])
+            for name, phase in data['phases'].items():
+                total, count = self.phases.get(name, (0.0, 0))
+                self.phases[name] = (total + phase['seconds'],
+                                     count + phase['count'])
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """ Time the block of code executed `with metrics.phase(name):`"""
+        started = time.time()
+        try:
+            yield
+        finally:
+            self.add_phase(name, time.time() - started)
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'started': self.started,
+                'requests': [
+                    {'endpoint': endpoint,
+                     'method': method,
+                     'count': stats.count,
+                     'errors': stats.errors,
+                     'latency': stats.latency.to_dict()}
+                    for (endpoint, method), stats
+                    in sorted(self.requests.items())],
+                'phases': OrderedDict(
+                    (name, {'seconds': round(total, 6), 'count': count})
+                    for name, (total, count) in self.phases.items())}
+
+    def to_prometheus(self):
+        """ @return the metrics in the Prometheus text exposition format"""
+        data = self.to_dict()
+        lines = [
+            '# HELP redman_api_requests_total Redmine API calls (attempts).',
+            '# TYPE redman_api_requests_total counter']
+        lines.extend('redman_api_requests_total{{{}}} {}'
+                     .format(labels(item), item['count'])
+                     for item in data['requests'])
+        lines.extend([
+            '# HELP redman_api_errors_total Failed Redmine API calls.',
+            '# TYPE redman_api_errors_total counter'])
+        lines.extend('redman_api_errors_total{{{}}} {}'
+                     .format(labels(item), item['errors'])
+                     for item in data['requests'])
+        lines.extend([
+            '# HELP redman_api_request_seconds Redmine API call latency.',
+            '# TYPE redman_api_request_seconds histogram'])
+        for item in data['requests']:
+            latency = item['latency']
+            buckets = list(latency['buckets'].items())
+            buckets.append(('+Inf', latency['count']))
+            for bound, count in buckets:
+                lines.append('redman_api_request_seconds_bucket'
+                             '{{{},le="{}"}} {}'
+                             .format(labels(item), bound, count))
+            lines.append('redman_api_request_seconds_sum{{{}}} {}'
+                         .format(labels(item), latency['sum']))
+            lines.append('redman_api_request_seconds_count{{{}}} {}'
+                         .format(labels(item), latency['count']))
+        lines.extend([
+            '# HELP redman_phase_seconds Time spent in each copy phase.',
+            '# TYPE redman_phase_seconds gauge'])
+        lines.extend('redman_phase_seconds{{phase="{}"}} {}'
+                     .format(name, phase['seconds'])
+                     for name, phase in data['phases'].items())
+        lines.extend([
+            '# HELP redman_last_run_timestamp_seconds When the run started.',
+            '# TYPE redman_last_run_timestamp_seconds gauge',
+            'redman_last_run_timestamp_seconds {:.0f}'.format(self.started)])
+        return '\n'.join(lines) + '\n'
+
+    def to_html(self):
+        """ @return the summary table appended to the email"""
+        data = self.to_dict()
+        rows = ["<tr><td>{method} {endpoint}</td><td>{count}</td>"
+                "<td>{errors}</td><td>{avg:.0f} ms</td></tr>"
+                .format(avg=1000 * item['latency']['sum'] / item['count'],
+                        **item)
+                for item in data['requests'] if item['count']]
+        phases = ["<tr><td>{}</td><td>{:.1f} s</td></tr>"
+                  .format(name, phase['seconds'])
+                  for name, phase in data['phases'].items()]
+        return """
+    <p> API calls </p>
+    <table>
+    <tr><th>Endpoint</th><th>Calls</th><th>Errors</th><th>Average</th></tr>
+    {}
+    </table>
+    <p> Phases </p>
+    <table> {} </table>
+    """.format("\n    ".join(rows), "\n    ".join(phases))
+
+    def save(self, json_file=None, textfile=None):
+        """ Write the json and/or the Prometheus textfile"""
+        if json_file:
+            write_atomically(json_file,
+                             json.dumps(self.to_dict(), indent=2))
+        if textfile:
+            write_atomically(textfile, self.to_prometheus())
+
+
+def labels(item):
+    return 'endpoint="{}",method="{}"'.format(item['endpoint'],
+                                              item['method'])
+
+
+def write_atomically(path, content):
+    """ The textfile collector could read a partially written file"""
+    tmp_path = '{}.tmp'.format(path)
+    with open(tmp_path, 'w') as fh:
+        fh.write(content)
+    os.rename(tmp_path, path)
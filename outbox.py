@@ -0,0 +1,328 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Goal: deliver the summary emails without blocking the copy
+
+The summaries are written to a local spool folder (one json file per
+email and the html body streamed to a separate file) and delivered by a
+background thread which keeps one SMTP connection per server for the
+whole run. An email which cannot be delivered stays in the spool and is
+retried with an exponential backoff by the next runs.
+
+@see fabfile.send_summary()
+"""
+
+import os
+import json
+import time
+import uuid
+import socket
+import logging
+import smtplib
+import threading
+
+from mailer import Message
+
+logger = logging.getLogger(__name__)
+
+# After this many failed attempts the email is moved to the `failed` folder
+MAX_ATTEMPTS = 10
+
+# Suffix of the spool files claimed by a sender (thread or process)
+CLAIMED_SUFFIX = '.sending'
+
+
+class Outbox(object):
+    """
+    The spool folder of the emails waiting to be delivered.
+    """
+
+    def __init__(self, spool_dir, backoff=300, max_backoff=86400,
+                 claim_timeout=3600):
+        """
+        :param spool_dir: where to save the emails
+        :param backoff: seconds to wait before retrying a failed email
+            (doubles after every failure)
+        :param max_backoff: the maximum delay between two attempts
+        :param claim_timeout: seconds after which the email claimed by a
+            sender which died is put back in the spool
+        """
+        self.spool_dir = spool_dir
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.claim_timeout = claim_timeout
+        for path in (spool_dir, self.failed_dir):
+            if not os.path.isdir(path):
+                os.makedirs(path)
+
+    @property
+    def failed_dir(self):
+        return os.path.join(self.spool_dir, 'failed')
+
+    def put(self, server, sender, recipient, subject, html, cc=None,
+            bcc=None):
+        """ Save an email to be delivered as soon as possible
+
+        :param recipient: one address or a sequence of addresses (also
+            accepted by `cc` and `bcc`)
+        :param html: the body as a string or as an iterable of strings
+            (written to the spool one by one)
+        @return the path of the spool file
+        """
+        now = time.time()
+        name = '{:.6f}_{}'.format(now, uuid.uuid4().hex)
+        html_file = '{}.html'.format(name)
+        self._write_html(os.path.join(self.spool_dir, html_file), html)
+
+        entry = {'server': server,
+                 'sender': sender,
+                 'recipient': recipient,
+                 'cc': cc,
+                 'bcc': bcc,
+                 'subject': subject,
+                 'html_file': html_file,
+                 'created_on': now,
+                 'attempts': 0,
+                 'next_attempt': now,
+                 'last_error': None}
+        path = os.path.join(self.spool_dir, '{}.json'.format(name))
+        self._write(path, entry)
+        return path
+
+    def read_html(self, entry):
+        """ @return the body of a spooled email"""
+        if 'html_file' not in entry:
+            # spooled by an older version
+            return entry['html']
+        with open(os.path.join(self.spool_dir, entry['html_file']),
+                  'rb') as fh:
+            return fh.read().decode('utf-8')
+
+    def due(self, now=None):
+        """ @return list of (path, entry) ready to be sent (oldest first)"""
+        now = now or time.time()
+        found = []
+        for name in sorted(os.listdir(self.spool_dir)):
+            path = os.path.join(self.spool_dir, name)
+            if name.endswith(CLAIMED_SUFFIX):
+                self._release_stale(path, now)
+                continue
+            if not name.endswith('.json'):
+                continue
+            entry = self.read(path)
+            if entry is not None and entry['next_attempt'] <= now:
+                found.append((path, entry))
+        return found
+
+    def read(self, path):
+        """ @return the entry of a spool file or None"""
+        try:
+            with open(path) as fh:
+                return json.load(fh)
+        except (IOError, ValueError):
+            # removed by another sender or still being written
+            return None
+
+    def claim(self, path):
+        """
+        Take an email so no other sender delivers it too (the rename is
+        atomic)
+
+        @return the path of the claimed file or None if another sender
+        was faster
+        """
+        claimed = path + CLAIMED_SUFFIX
+        try:
+            os.rename(path, claimed)
+        except OSError:
+            return None
+        # the age of the claim tells if its sender died
+        os.utime(claimed, None)
+        return claimed
+
+    def release(self, claimed):
+        """ Put a claimed email back in the spool"""
+        try:
+            os.rename(claimed, claimed[:-len(CLAIMED_SUFFIX)])
+        except OSError:
+            pass
+
+    def _release_stale(self, claimed, now):
+        try:
+            stale = now - os.path.getmtime(claimed) > self.claim_timeout
+        except OSError:
+            return
+        if stale:
+            logger.warn("Releasing the email claimed by a dead sender: {}"
+                        .format(claimed))
+            self.release(claimed)
+
+    def mark_sent(self, path, entry=None):
+        paths = [path]
+        if entry and 'html_file' in entry:
+            paths.append(os.path.join(self.spool_dir, entry['html_file']))
+        for name in paths:
+            try:
+                os.remove(name)
+            except OSError:
+                pass
+
+    def mark_failed(self, path, entry, error):
+        """ Schedule the next attempt or give up after MAX_ATTEMPTS
+
+        :param path: the spool file or the claimed file of the email
+        """
+        spool_path = path[:-len(CLAIMED_SUFFIX)] \
+            if path.endswith(CLAIMED_SUFFIX) else path
+        entry['attempts'] += 1
+        entry['last_error'] = str(error)
+        if entry['attempts'] >= MAX_ATTEMPTS:
+            logger.error("Giving up on email [{}] after [{}] attempts: {}"
+                         .format(entry['subject'], entry['attempts'], error))
+            if 'html_file' in entry:
+                os.rename(os.path.join(self.spool_dir, entry['html_file']),
+                          os.path.join(self.failed_dir, entry['html_file']))
+            os.rename(path, os.path.join(self.failed_dir,
+                                         os.path.basename(spool_path)))
+            return
+        delay = min(self.max_backoff,
+                    self.backoff * 2 ** (entry['attempts'] - 1))
+        entry['next_attempt'] = time.time() + delay
+        self._write(spool_path, entry)
+        if path != spool_path:
+            os.remove(path)
+        logger.warn("Email [{}] will be retried in [{:.0f}] seconds: {}"
+                    .format(entry['subject'], delay, error))
+
+    def _write_html(self, path, html):
+        if isinstance(html, basestring):
+            html = [html]
+        tmp_path = '{}.tmp'.format(path)
+        with open(tmp_path, 'wb') as fh:
+            for chunk in html:
+                if isinstance(chunk, unicode):
+                    chunk = chunk.encode('utf-8')
+                fh.write(chunk)
+        os.rename(tmp_path, path)
+
+    def _write(self, path, entry):
+        tmp_path = '{}.tmp'.format(path)
+        with open(tmp_path, 'w') as fh:
+            json.dump(entry, fh)
+        os.rename(tmp_path, path)
+
+
+class OutboxSender(threading.Thread):
+    """
+    Background thread delivering the due emails of an Outbox.
+    Call notify() after adding emails and close() before exiting.
+    Several senders (threads or processes) can share the spool folder.
+    """
+
+    def __init__(self, outbox, timeout=30, poll_interval=300):
+        """
+        :param timeout: seconds to wait for the SMTP server
+        :param poll_interval: seconds between the checks for the emails
+            due for a retry (for long-running processes)
+        """
+        threading.Thread.__init__(self, name='outbox-sender')
+        self.daemon = True
+        self.outbox = outbox
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.connections = {}
+        self.sent = 0
+        self._wakeup = threading.Event()
+        self._closing = False
+
+    def notify(self):
+        self._wakeup.set()
+
+    def close(self, timeout=None):
+        """ Deliver the due emails (waiting at most `timeout` seconds) and
+        stop the thread. Undelivered emails stay in the spool. """
+        self._closing = True
+        self._wakeup.set()
+        self.join(timeout)
+        if self.is_alive():
+            logger.warn("The email delivery is still running, the pending "
+                        "emails will be sent by the next run")
+
+    def run(self):
+        while True:
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+            closing = self._closing
+            try:
+                self.deliver()
+            except Exception as exc:
+                logger.error("Unable to deliver the emails: {}".format(exc))
+            if closing:
+                break
+        for connection in self.connections.values():
+            try:
+                connection.quit()
+            except (smtplib.SMTPException, socket.error):
+                pass
+
+    def deliver(self):
+        """ Send all the due emails reusing one connection per server"""
+        for path, _ in self.outbox.due():
+            claimed = self.outbox.claim(path)
+            if claimed is None:
+                continue
+            # another sender could have updated the entry before our claim
+            entry = self.outbox.read(claimed)
+            if entry is None or entry['next_attempt'] > time.time():
+                self.outbox.release(claimed)
+                continue
+            try:
+                self.send(entry)
+            except (smtplib.SMTPException, socket.error) as exc:
+                self.connections.pop(entry['server'], None)
+                self.outbox.mark_failed(claimed, entry, exc)
+                continue
+            self.outbox.mark_sent(claimed, entry)
+            self.sent += 1
+            logger.info("Email [{}] was sent to: {}"
+                        .format(entry['subject'], entry['recipient']))
+
+    def send(self, entry):
+        mess = Message(charset="utf-8")
+        mess.From = entry['sender']
+        mess.To = entry['recipient']
+        mess.CC = entry.get('cc')
+        mess.BCC = entry.get('bcc')
+        mess.Subject = entry['subject']
+        mess.Html = self.outbox.read_html(entry)
+        mess.Body = "Please enable HTML in your client to view this message."
+        recipients = get_recipients(mess)
+
+        try:
+            connection = self.get_connection(entry['server'])
+            connection.sendmail(mess.From, recipients, mess.as_string())
+        except smtplib.SMTPServerDisconnected:
+            # the server closed the idle connection: reconnect once
+            self.connections.pop(entry['server'], None)
+            connection = self.get_connection(entry['server'])
+            connection.sendmail(mess.From, recipients, mess.as_string())
+
+    def get_connection(self, server):
+        if server not in self.connections:
+            self.connections[server] = smtplib.SMTP(server,
+                                                    timeout=self.timeout)
+        return self.connections[server]
+
+
+def get_recipients(mess):
+    """ @return the To, CC and BCC addresses of a mailer.Message (each one
+    a string or a sequence) like `Mailer.send()` does """
+    recipients = []
+    for addresses in (mess.To, mess.CC, mess.BCC):
+        if not addresses:
+            continue
+        if isinstance(addresses, basestring):
+            recipients.append(addresses)
+        else:
+            recipients.extend(addresses)
+    return recipients
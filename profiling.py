@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Goal: profile one copy run
+
+`Profiler` collects cProfile statistics from the main thread and from
+every worker thread started while it runs. `Tracer` records a timeline
+of spans (one per API call and per story/task copy) in the Chrome trace
+event format which can be opened with chrome://tracing or
+https://ui.perfetto.dev
+
+@see fabfile.copy_template_profiled()
+"""
+
+import os
+import json
+import time
+import pstats
+import cProfile
+import threading
+import contextlib
+
+
+class NullSpan(object):
+    """ The span used when the tracer is disabled"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class Tracer(object):
+    """
+    Thread-safe recorder of "complete" trace events.
+
+    The arguments of a span are inherited by the spans nested in it
+    (e.g. the API calls made while copying a task are tagged with the
+    template issue id of the task).
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.events = []
+        self._threads = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextlib.contextmanager
+    def span(self, name, category, **args):
+        """ Record the block executed `with tracer.span(...):`"""
+        stack = self._stack()
+        tags = dict(stack[-1]) if stack else {}
+        tags.update(args)
+        stack.append(tags)
+        started = time.time()
+        try:
+            yield
+        finally:
+            stack.pop()
+            self.add_span(name, category, started, time.time(), **tags)
+
+    def add_span(self, name, category, started, finished, **args):
+        """ Record a span which already ended """
+        stack = self._stack()
+        tags = dict(stack[-1]) if stack else {}
+        tags.update(args)
+        thread = threading.current_thread()
+
+        with self._lock:
+            self._threads.setdefault(thread.ident, thread.name)
+            self.events.append({
+                'name': name,
+                'cat': category,
+                'ph': 'X',
+                'ts': to_micros(started - self.started),
+                'dur': to_micros(finished - started),
+                'pid': os.getpid(),
+                'tid': thread.ident,
+                'args': tags})
+
+    def to_dict(self):
+        with self._lock:
+            names = [{'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(),
+                      'tid': ident, 'args': {'name': name}}
+                     for ident, name in self._threads.items()]
+            return {'traceEvents': names + list(self.events),
+                    'displayTimeUnit': 'ms'}
+
+    def save(self, path):
+        with open(path, 'w') as fh:
+            json.dump(self.to_dict(), fh)
+
+
+class Profiler(object):
+    """
+    cProfile only sees the thread which enabled it so one profile is
+    started in every thread created between start() and stop().
+    """
+
+    def __init__(self):
+        self.profiles = []
+        self.stats = None
+        self._lock = threading.Lock()
+
+    def _enable(self):
+        profile = cProfile.Profile()
+        with self._lock:
+            if self.stats is not None:
+                # the thread started while stop() was running
+                return
+            self.profiles.append(profile)
+        profile.enable()
+
+    def _enable_in_thread(self, *args):
+        # called by the new thread instead of the regular profile function
+        self._enable()
+
+    def start(self):
+        threading.setprofile(self._enable_in_thread)
+        self._enable()
+
+    def stop(self):
+        """
+        Disable the profiles of all the threads and take their statistics.
+        A running thread keeps collecting until it disables its own profile,
+        so the statistics are taken here and later calls are left out.
+        """
+        threading.setprofile(None)
+        with self._lock:
+            for profile in self.profiles:
+                profile.disable()
+            self.stats = pstats.Stats(*self.profiles)
+
+    def save(self, path):
+        """ Write the statistics of all the threads as one pstats file"""
+        if self.stats is None:
+            self.stop()
+        self.stats.dump_stats(path)
+        return self.stats
+
+
+def to_micros(seconds):
+    return int(round(seconds * 1000000))
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Goal: implement the fast-start `redman` command
+
+On most days the cron job only finds out that no sprint needs to be
+copied. This module checks the schedule using only the standard library
+and imports the fabfile (Fabric, python-redmine, mailer, dateutil...)
+only when a copy is due.
+
+Usage:
+    ./redman check staging.green+production.misc+production.brown
+    ./redman copy staging.green+production.misc+production.brown --no-dry-run
+    ./redman daemon --no-dry-run
+
+@see bench_startup.py
+"""
+
+import os
+import sys
+import imp
+import argparse
+from datetime import date, datetime, timedelta
+
+ISO_DATE_FORMAT = '%Y-%m-%d'
+
+
+def needs_to_run(date_ref, date_test, repeat_after):
+    """
+    :param date_ref: the day we enabled the cron (used as a reference)
+    :param date_test: usually this is today's date
+    :param repeat_after: after how many days the cron needs to re-run
+
+    @return true if we are in on the day when the cron job needs to run
+    """
+    needs = False
+
+    if date_ref is not None \
+            and date_test is not None \
+            and repeat_after is not None:
+        diff = date_test - date_ref
+
+        # logger.info("Diff days: {}".format(diff))
+
+        if 0 == (diff.days % repeat_after):
+            needs = True
+
+    return needs
+
+
+def get_next_due_date(cron_start_date, cron_repeat_after, date_ref):
+    """ @return the first day starting with `date_ref` when the cron job
+    needs to run """
+    start = parse_date(cron_start_date)
+    if date_ref <= start:
+        return start
+    days_left = -(date_ref - start).days % int(cron_repeat_after)
+    return date_ref + timedelta(days=days_left)
+
+
+def parse_date(text):
+    """ Parse the `start_date` setting (dateutil is imported only for the
+    formats other than YYYY-MM-DD) """
+    try:
+        return datetime.strptime(text, ISO_DATE_FORMAT).date()
+    except ValueError:
+        from dateutil.parser import parse
+        return parse(text).date()
+
+
+def get_skip_reason(cron_start_date, cron_repeat_after, date_ref):
+    """
+    @return a message explaining why the copy should not run on `date_ref`
+    or None if the copy needs to run
+    """
+    cron_start_date = parse_date(cron_start_date)
+
+    if needs_to_run(cron_start_date, date_ref, cron_repeat_after):
+        return None
+
+    diff = date_ref - cron_start_date
+    return ("No need to copy the sprint since days passed [{}] is not a "
+            " multiple of [{}] specified in the `fabric.py` config file."
+            .format(diff.days, cron_repeat_after))
+
+
+def parse_template_list(templates):
+    """
+    Helper for copy_sprint_templates().
+    Templates which use the same color in one environment are copied once.
+
+    @return list of (environment or None, [color, ...]) in the input order
+    """
+    groups = []
+    for item in templates.split('+'):
+        item = item.strip().lower()
+        if not item:
+            continue
+        target, _, color = item.rpartition('.')
+        target = target or None
+
+        if not groups or groups[-1][0] != target:
+            groups.append((target, []))
+        if color not in groups[-1][1]:
+            groups[-1][1].append(color)
+    return groups
+
+
+def find_templates(root='.'):
+    """
+    @return the '+' separated list of all the templates configured in the
+    `<environment>/fabric.py` files found in the `root` folder
+    """
+    found = []
+    for target in sorted(os.listdir(root)):
+        if not os.path.isfile(os.path.join(root, target, 'fabric.py')):
+            continue
+        settings = load_settings(os.path.join(root, target))
+        found.extend('{}.{}'.format(target, key[len('sprint_name_'):])
+                     for key in sorted(settings)
+                     if key.startswith('sprint_name_'))
+    return '+'.join(found)
+
+
+def load_settings(target):
+    """ @return the settings dictionary from the 'target/fabric.py' file"""
+    fab_conf_file = os.path.join(target, 'fabric.py')
+    if not os.path.isfile(fab_conf_file):
+        raise IOError("Please create the '{}' file".format(fab_conf_file))
+
+    module = imp.load_source('redman_settings_{}'.format(
+        os.path.basename(os.path.normpath(target))), fab_conf_file)
+    return module.get_settings()
+
+
+def get_due_templates(templates, date_ref):
+    """
+    @return the '+' separated list of the `templates` whose environment
+    is scheduled to run on `date_ref` (an empty string if none is due)
+    """
+    due = []
+    for target, colors in parse_template_list(templates):
+        if target is None:
+            raise ValueError("Please specify the environment of [{}], "
+                             "e.g. production.{}".format(colors[0], colors[0]))
+        settings = load_settings(target)
+        skip_reason = get_skip_reason(settings['start_date'],
+                                      settings['repeat_after'], date_ref)
+        if skip_reason is None:
+            due.extend('{}.{}'.format(target, color) for color in colors)
+        else:
+            print("[{}] {}".format(target, skip_reason))
+    return '+'.join(due)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='redman', description='Copy the Redmine sprint templates')
+    parser.add_argument('command', choices=['check', 'copy', 'daemon'],
+                        help='only check the schedule, copy the due '
+                             'templates or keep running and copy them when '
+                             'they are due')
+    parser.add_argument('templates', nargs='?',
+                        help="'+' separated list of environment.color "
+                             "items, e.g. staging.green+production.misc "
+                             "(defaults to all the configured templates)")
+    parser.add_argument('--no-dry-run', action='store_true',
+                        help='create the sprints (dry-run by default)')
+    parser.add_argument('--processes', action='store_true',
+                        help='copy every environment in its own process '
+                             '(at the same time)')
+    parser.add_argument('--run-at', default='15:59',
+                        help='daemon: the time of the day (HH:MM) when the '
+                             'due templates are copied')
+    parser.add_argument('--refresh-every', type=int, default=900,
+                        help='daemon: seconds between the refreshes of the '
+                             'cached versions and templates')
+    args = parser.parse_args(argv)
+    templates = args.templates or find_templates()
+
+    if args.command == 'daemon':
+        # the daemon keeps the heavy modules (and the caches) loaded
+        from redman_daemon import Daemon
+        Daemon(templates, is_dry_run=not args.no_dry_run,
+               run_at=args.run_at,
+               refresh_every=args.refresh_every).run_forever()
+        return 0
+
+    try:
+        due = get_due_templates(templates, date.today())
+    except (IOError, ValueError) as exc:
+        print(exc)
+        return 2
+
+    if not due:
+        return 0
+    print("Due today: {}".format(due))
+    if args.command == 'check':
+        return 0
+
+    # the heavy imports happen only when a copy is due
+    import fabfile
+    try:
+        fabfile.copy_sprint_templates(due, is_dry_run=not args.no_dry_run,
+                                      processes=args.processes)
+    except SystemExit:
+        # abort() already printed the failed templates
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
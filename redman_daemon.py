@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Goal: keep redman running and copy the templates when they are due
+
+The daemon computes the next due time of every environment from its
+`start_date`/`repeat_after` settings. Between the runs it keeps the
+redmine client (and its keep-alive connections), the version catalogue
+and the templates in memory and refreshes them in the background so a
+scheduled copy starts warm.
+
+Usage:
+    ./redman daemon --no-dry-run --run-at 15:59
+
+@see redman_cli.main()
+"""
+
+import time
+import logging
+import threading
+from datetime import date, datetime, timedelta
+
+import fabfile
+from fabfile import env
+from redman_cli import parse_template_list, load_settings, \
+    get_next_due_date
+
+logger = logging.getLogger('fabfile')
+
+
+class EnvironmentState(object):
+    """ Data storage object for the warm objects of one environment"""
+
+    def __init__(self, target, colors):
+        """constuctor"""
+        self.target = target
+        self.colors = colors
+        self.instance = None
+        self.catalogue = None
+        self.refreshed_on = None
+
+
+class Daemon(object):
+    """
+    Run the copies on schedule in one long-running process.
+
+    The fabfile keeps one client and one catalogue (module globals) for
+    the current environment so every operation switches the environment
+    under a lock and saves the warm objects in an EnvironmentState.
+    """
+
+    def __init__(self, templates, is_dry_run=True, run_at='15:59',
+                 refresh_every=900):
+        """
+        :param templates: '+' separated list of environment.color items
+        :param run_at: the time of the day (HH:MM) for the copies
+        :param refresh_every: seconds between the background refreshes
+        """
+        self.is_dry_run = is_dry_run
+        self.run_at = datetime.strptime(run_at, '%H:%M').time()
+        self.refresh_every = refresh_every
+        self.states = [EnvironmentState(target, colors)
+                       for target, colors in parse_template_list(templates)]
+        if not self.states or any(state.target is None
+                                  for state in self.states):
+            raise ValueError("Please specify the environment of every "
+                             "template, e.g. production.green")
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+
+    def get_next_run(self, state, now):
+        """ @return the datetime of the next copy for the environment"""
+        settings = load_settings(state.target)
+        day = get_next_due_date(settings['start_date'],
+                                settings['repeat_after'], now.date())
+        when = datetime.combine(day, self.run_at)
+        if when <= now:
+            # the time passed today: wait for the next cycle
+            day = get_next_due_date(settings['start_date'],
+                                    settings['repeat_after'],
+                                    day + timedelta(days=1))
+            when = datetime.combine(day, self.run_at)
+        return when
+
+    def get_schedule(self, now):
+        """ @return sorted list of (datetime, EnvironmentState)"""
+        return sorted([(self.get_next_run(state, now), state)
+                       for state in self.states],
+                      key=lambda item: (item[0], item[1].target))
+
+    def get_next_tick(self, now):
+        """ @return (datetime, list of the EnvironmentState objects due at
+        that time) so the environments sharing a schedule run together """
+        schedule = self.get_schedule(now)
+        when = schedule[0][0]
+        return when, [state for tick, state in schedule if tick == when]
+
+    def activate(self, state):
+        """ Load the settings and the warm objects of the environment.
+        Called with the lock acquired. """
+        fabfile.load_environ(state.target)
+        fabfile.INSTANCE = state.instance
+        fabfile.CATALOGUE = state.catalogue
+
+    def deactivate(self, state):
+        """ Save the (possibly re-created) warm objects"""
+        state.instance = fabfile.INSTANCE
+        state.catalogue = fabfile.CATALOGUE
+
+    def refresh(self, state):
+        """ List the versions again and check the templates for updates
+        (one request per template when nothing changed) """
+        with self._lock:
+            self.activate(state)
+            try:
+                fabfile.CATALOGUE = None
+                catalogue = fabfile.get_version_catalogue()
+                for color in state.colors:
+                    sprint_name = env['sprint_name_{}'.format(color)]
+                    template_sprint = catalogue.find_by_name(sprint_name)
+                    if template_sprint is None:
+                        logger.warn("[{}] missing template sprint: {}"
+                                    .format(state.target, sprint_name))
+                        continue
+                    fabfile.load_template(template_sprint.id)
+                state.refreshed_on = time.time()
+            except (Exception, SystemExit) as exc:
+                logger.error("[{}] unable to refresh the caches: {}"
+                             .format(state.target, exc))
+            finally:
+                self.deactivate(state)
+
+    def refresh_forever(self):
+        """ Background thread keeping every environment warm"""
+        while not self._stop.is_set():
+            for state in self.states:
+                if self._stop.is_set():
+                    break
+                self.refresh(state)
+            self._stop.wait(self.refresh_every)
+
+    def run(self, state):
+        """ Copy the templates of the environment"""
+        templates = '+'.join('{}.{}'.format(state.target, color)
+                             for color in state.colors)
+        logger.info("Running the scheduled copy: {}".format(templates))
+        with self._lock:
+            self.activate(state)
+            try:
+                # the summary reports only the requests of this copy
+                fabfile.reset_metrics()
+                fabfile.copy_sprint_templates(templates, self.is_dry_run)
+            except (Exception, SystemExit) as exc:
+                logger.error("[{}] the scheduled copy failed: {}"
+                             .format(state.target, exc))
+            finally:
+                self.deactivate(state)
+
+    def run_forever(self):
+        refresher = threading.Thread(target=self.refresh_forever,
+                                     name='redman-refresh')
+        refresher.daemon = True
+        refresher.start()
+        self.start_outbox()
+
+        try:
+            while not self._stop.is_set():
+                when, states = self.get_next_tick(datetime.now())
+                for state in states:
+                    logger.info("Next copy: [{}] {} on {}".format(
+                        state.target, '+'.join(state.colors), when))
+                # wake up at least hourly to follow clock changes
+                while not self._stop.is_set() and datetime.now() < when:
+                    delay = (when - datetime.now()).total_seconds()
+                    self._stop.wait(min(max(delay, 0), 3600))
+                for state in states:
+                    if not self._stop.is_set() \
+                            and date.today() == when.date():
+                        self.run(state)
+        except KeyboardInterrupt:
+            logger.info("Stopping the daemon")
+        finally:
+            self.stop()
+
+    def start_outbox(self):
+        """ Deliver the emails left in the spool by the previous runs (and
+        retry the failed ones while we wait) """
+        with self._lock:
+            self.activate(self.states[0])
+            try:
+                fabfile.get_outbox_sender()
+            finally:
+                self.deactivate(self.states[0])
+
+    def stop(self):
+        self._stop.set()
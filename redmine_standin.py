@@ -0,0 +1,399 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Goal: provide an in-process stand-in for the Redmine REST API
+
+Only the endpoints used by the fabfile are implemented (projects,
+versions, issues with filters, pagination and children, create, update
+and delete). The latency and the error rate can be injected in order to
+benchmark and test the copy without a real Redmine server.
+
+Usage:
+    server = RedmineStandin(latency=0.01).start()
+    ... use server.url as the `api_url` ...
+    server.stop()
+
+@see bench_copy.py
+"""
+
+import re
+import json
+import time
+import random
+import threading
+from datetime import datetime
+
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+
+DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+# Issue statuses considered "closed" by the `status_id` filter
+CLOSED_STATUSES = (5, 6)
+
+# Redmine returns at most this many items per page
+MAX_LIMIT = 100
+
+
+class StandinData(object):
+    """ The projects, versions and issues known by the stand-in"""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.projects = {}
+        self.versions = {}
+        self.issues = {}
+        self._next_id = 1
+
+    def next_id(self):
+        with self.lock:
+            self._next_id += 1
+            return self._next_id
+
+    def add_project(self, name, identifier=None):
+        project = {'id': self.next_id(), 'name': name,
+                   'identifier': identifier or name}
+        self.projects[project['id']] = project
+        return project
+
+    def find_project(self, project_id):
+        """ @return the project matching an id or an identifier"""
+        for project in self.projects.values():
+            if str(project_id) in (str(project['id']),
+                                   project['identifier']):
+                return project
+        return None
+
+    def add_version(self, project_id, **fields):
+        project = self.find_project(project_id)
+        with self.lock:
+            version = {
+                'id': self.next_id(),
+                'project': {'id': project['id'], 'name': project['name']},
+                'name': fields.get('name'),
+                'description': fields.get('description', ''),
+                'status': fields.get('status', 'open'),
+                'sharing': fields.get('sharing', 'none'),
+                'due_date': fields.get('effective_date'),
+                'sprint_start_date': fields.get('sprint_start_date'),
+                'created_on': now(),
+                'updated_on': now()}
+            self.versions[version['id']] = version
+        return version
+
+    def add_issue(self, **fields):
+        project = self.find_project(fields['project_id'])
+        with self.lock:
+            issue = {
+                'id': self.next_id(),
+                'project': {'id': project['id'], 'name': project['name']},
+                'tracker': {'id': int(fields.get('tracker_id', 1))},
+                'status': {'id': int(fields.get('status_id', 1))},
+                'priority': {'id': int(fields.get('priority_id', 2))},
+                'subject': fields.get('subject', ''),
+                'description': fields.get('description', ''),
+                'start_date': fields.get('start_date'),
+                'due_date': fields.get('due_date'),
+                'done_ratio': int(fields.get('done_ratio') or 0),
+                'created_on': now(),
+                'updated_on': now()}
+            self._update_issue(issue, fields)
+            self.issues[issue['id']] = issue
+        return issue
+
+    def update_issue(self, issue_id, **fields):
+        with self.lock:
+            issue = self.issues[issue_id]
+            self._update_issue(issue, fields)
+            issue['updated_on'] = now()
+        return issue
+
+    def _update_issue(self, issue, fields):
+        for name in ('subject', 'description', 'start_date', 'due_date'):
+            if name in fields:
+                issue[name] = fields[name]
+        if fields.get('estimated_hours') is not None:
+            issue['estimated_hours'] = float(fields['estimated_hours'])
+        if 'assigned_to_id' in fields:
+            issue.pop('assigned_to', None)
+            if fields['assigned_to_id']:
+                user_id = int(fields['assigned_to_id'])
+                issue['assigned_to'] = {'id': user_id,
+                                        'name': 'User {}'.format(user_id)}
+        if fields.get('fixed_version_id'):
+            version = self.versions[int(fields['fixed_version_id'])]
+            issue['fixed_version'] = {'id': version['id'],
+                                      'name': version['name']}
+        if fields.get('parent_issue_id'):
+            issue['parent'] = {'id': int(fields['parent_issue_id'])}
+
+    def delete_issue(self, issue_id):
+        """ Redmine deletes the descendants of an issue too"""
+        with self.lock:
+            self.issues.pop(issue_id)
+            for child in [issue for issue in self.issues.values()
+                          if issue.get('parent', {}).get('id') == issue_id]:
+                self.delete_issue(child['id'])
+
+    def filter_issues(self, params):
+        """ @return the issues matching the query string parameters"""
+        status = params.get('status_id', 'open')
+        updated_since = params.get('updated_on', '').lstrip('>=')
+        sort = params.get('sort', 'id:desc')
+        id_filters = dict((name, int(params[name]))
+                          for name in ('tracker_id', 'fixed_version_id',
+                                       'parent_id', 'assigned_to_id')
+                          if name in params)
+        project = self.find_project(params['project_id']) \
+            if 'project_id' in params else None
+
+        def matches(issue):
+            closed = issue['status']['id'] in CLOSED_STATUSES
+            if status == 'open' and closed \
+                    or status == 'closed' and not closed \
+                    or status not in ('*', 'open', 'closed') \
+                    and issue['status']['id'] != int(status):
+                return False
+            if project is not None and issue['project']['id'] != project['id']:
+                return False
+            if updated_since and issue['updated_on'] < updated_since:
+                return False
+            for name, value in id_filters.items():
+                attr = {'tracker_id': 'tracker',
+                        'fixed_version_id': 'fixed_version',
+                        'parent_id': 'parent',
+                        'assigned_to_id': 'assigned_to'}[name]
+                if issue.get(attr, {}).get('id') != value:
+                    return False
+            return True
+
+        with self.lock:
+            found = [issue for issue in self.issues.values() if matches(issue)]
+        field = sort.split(':')[0]
+        return sorted(found, key=lambda issue: (issue[field], issue['id']),
+                      reverse=sort.endswith(':desc'))
+
+    def children(self, issue_id):
+        with self.lock:
+            return [{'id': issue['id'], 'tracker': issue['tracker'],
+                     'subject': issue['subject']}
+                    for issue in sorted(self.issues.values(),
+                                        key=lambda issue: issue['id'])
+                    if issue.get('parent', {}).get('id') == issue_id]
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """ Translate the http requests into StandinData calls"""
+
+    protocol_version = 'HTTP/1.1'
+
+    # send the headers and the body in one packet (avoids the delayed ack)
+    wbufsize = -1
+
+    ROUTES = [
+        ('GET', r'^/projects\.json$', 'list_projects'),
+        ('GET', r'^/projects/(?P<project_id>[^/]+)/versions\.json$',
+         'list_versions'),
+        ('POST', r'^/projects/(?P<project_id>[^/]+)/versions\.json$',
+         'create_version'),
+        ('GET', r'^/versions/(?P<version_id>\d+)\.json$', 'get_version'),
+        ('PUT', r'^/versions/(?P<version_id>\d+)\.json$', 'update_version'),
+        ('DELETE', r'^/versions/(?P<version_id>\d+)\.json$',
+         'delete_version'),
+        ('GET', r'^/issues\.json$', 'list_issues'),
+        ('POST', r'^/projects/(?P<project_id>[^/]+)/issues\.json$',
+         'create_issue'),
+        ('GET', r'^/issues/(?P<issue_id>\d+)\.json$', 'get_issue'),
+        ('PUT', r'^/issues/(?P<issue_id>\d+)\.json$', 'update_issue'),
+        ('DELETE', r'^/issues/(?P<issue_id>\d+)\.json$', 'delete_issue'),
+    ]
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def do_PUT(self):
+        self.dispatch('PUT')
+
+    def do_DELETE(self):
+        self.dispatch('DELETE')
+
+    def dispatch(self, verb):
+        url = urlparse(self.path)
+        params = dict((key, values[-1])
+                      for key, values in parse_qs(url.query).items())
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        server = self.server.standin
+
+        for route_verb, pattern, name in self.ROUTES:
+            match = re.match(pattern, url.path)
+            if route_verb != verb or match is None:
+                continue
+
+            server.count(verb, name)
+            if server.latency:
+                time.sleep(server.latency)
+            if server.error_rate and random.random() < server.error_rate:
+                return self.respond(503, {'errors': ['Injected error']})
+
+            payload = json.loads(body.decode('utf-8')) if body else {}
+            try:
+                status, data = getattr(self, name)(params, payload,
+                                                   **match.groupdict())
+            except KeyError:
+                status, data = 404, None
+            return self.respond(status, data)
+
+        server.count(verb, 'unknown')
+        self.respond(404, None)
+
+    def respond(self, status, data):
+        body = json.dumps(data).encode('utf-8') if data is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    @property
+    def data(self):
+        return self.server.standin.data
+
+    def list_projects(self, params, payload):
+        projects = sorted(self.data.projects.values(),
+                          key=lambda project: project['id'])
+        return 200, page('projects', projects, params)
+
+    def list_versions(self, params, payload, project_id):
+        project = self.data.find_project(project_id)
+        versions = sorted([ver for ver in self.data.versions.values()
+                           if ver['project']['id'] == project['id']
+                           or ver['sharing'] == 'system'],
+                          key=lambda ver: ver['id'])
+        # Redmine does not paginate the versions
+        return 200, {'versions': versions, 'total_count': len(versions)}
+
+    def create_version(self, params, payload, project_id):
+        version = self.data.add_version(project_id, **payload['version'])
+        return 201, {'version': version}
+
+    def get_version(self, params, payload, version_id):
+        return 200, {'version': self.data.versions[int(version_id)]}
+
+    def update_version(self, params, payload, version_id):
+        version = self.data.versions[int(version_id)]
+        fields = payload['version']
+        for name in ('name', 'status', 'description', 'sharing'):
+            if name in fields:
+                version[name] = fields[name]
+        if 'effective_date' in fields:
+            version['due_date'] = fields['effective_date']
+        version['updated_on'] = now()
+        return 200, None
+
+    def delete_version(self, params, payload, version_id):
+        version_id = int(version_id)
+        if any(issue.get('fixed_version', {}).get('id') == version_id
+               for issue in self.data.issues.values()):
+            return 422, {'errors': ['Unable to delete version']}
+        self.data.versions.pop(version_id)
+        return 200, None
+
+    def list_issues(self, params, payload):
+        return 200, page('issues', self.data.filter_issues(params), params)
+
+    def create_issue(self, params, payload, project_id):
+        fields = dict(payload['issue'], project_id=project_id)
+        return 201, {'issue': self.data.add_issue(**fields)}
+
+    def get_issue(self, params, payload, issue_id):
+        issue = dict(self.data.issues[int(issue_id)])
+        if 'children' in params.get('include', ''):
+            issue['children'] = self.data.children(issue['id'])
+        return 200, {'issue': issue}
+
+    def update_issue(self, params, payload, issue_id):
+        self.data.update_issue(int(issue_id), **payload['issue'])
+        return 200, None
+
+    def delete_issue(self, params, payload, issue_id):
+        self.data.delete_issue(int(issue_id))
+        return 200, None
+
+
+class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class RedmineStandin(object):
+    """
+    Run the stand-in server on a background thread.
+    """
+
+    def __init__(self, latency=0, error_rate=0, port=0):
+        """
+        :param latency: seconds to wait before answering every request
+        :param error_rate: fraction of the requests answered with a 503
+        :param port: the port to listen on (a free one by default)
+        """
+        self.latency = latency
+        self.error_rate = error_rate
+        self.data = StandinData()
+        self.counts = {}
+        self._lock = threading.Lock()
+        self._httpd = ThreadedHTTPServer(('127.0.0.1', port), RequestHandler)
+        self._httpd.standin = self
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self._httpd.server_address[1])
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def count(self, verb, endpoint):
+        with self._lock:
+            key = '{} {}'.format(verb, endpoint)
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def reset_counts(self):
+        with self._lock:
+            counts, self.counts = self.counts, {}
+        return counts
+
+    def total_requests(self):
+        return sum(self.counts.values())
+
+
+def page(container, items, params):
+    """ Apply the `limit` and `offset` parameters like Redmine does"""
+    limit = min(int(params.get('limit', 25)), MAX_LIMIT)
+    offset = int(params.get('offset', 0))
+    return {container: items[offset:offset + limit],
+            'total_count': len(items),
+            'limit': limit,
+            'offset': offset}
+
+
+def now():
+    return datetime.utcnow().strftime(DATETIME_FORMAT)
@@ -20,6 +20,45 @@ def get_settings(overrides={}):
     SETTINGS['start_date'] = overrides.get('start_date', '2015-09-21')
     SETTINGS['repeat_after'] = overrides.get('repeat_after', 14)
 
+    # How many Redmine API calls can run in parallel when copying stories
+    # and tasks (use 1 for the serial behavior)
+    SETTINGS['concurrency'] = int(overrides.get('concurrency', 4))
+
+    # How many of these calls can copy the issues of one project (by
+    # default the projects with issues left share the calls equally)
+    SETTINGS['project_concurrency'] = overrides.get('project_concurrency',
+                                                    None)
+
+    # HTTP settings: the number of keep-alive connections (defaults to the
+    # `concurrency`), timeouts in seconds and how many times to retry a
+    # failed call (the delay between retries doubles starting at `backoff`)
+    SETTINGS['http_pool_size'] = overrides.get('http_pool_size', None)
+    SETTINGS['http_connect_timeout'] = overrides.get('http_connect_timeout', 5)
+    SETTINGS['http_read_timeout'] = overrides.get('http_read_timeout', 60)
+    SETTINGS['http_max_retries'] = overrides.get('http_max_retries', 3)
+    SETTINGS['http_backoff'] = overrides.get('http_backoff', 0.5)
+
+    # Record the API traffic of a run in a json cassette (api keys removed)
+    # with `http_cassette_mode='record'` and replay it offline with 'replay'
+    # at the recorded latency multiplied by `http_cassette_latency_scale`.
+    # A strict replay fails when the requests come in a different order.
+    SETTINGS['http_cassette'] = overrides.get('http_cassette', None)
+    SETTINGS['http_cassette_mode'] = overrides.get('http_cassette_mode',
+                                                   'replay')
+    SETTINGS['http_cassette_latency_scale'] = overrides.get(
+        'http_cassette_latency_scale', 1.0)
+    SETTINGS['http_cassette_strict'] = overrides.get('http_cassette_strict',
+                                                     False)
+
+    # Pace the API calls: the number of calls in flight grows while the
+    # latency is flat and is cut in half when the server returns 429/503
+    # (the ceiling defaults to the `http_pool_size`)
+    SETTINGS['rate_limit'] = overrides.get('rate_limit', True)
+    SETTINGS['rate_limit_ceiling'] = overrides.get('rate_limit_ceiling', None)
+
+    # How many seconds to wait for Redmine to confirm a sprint was deleted
+    SETTINGS['delete_poll_timeout'] = overrides.get('delete_poll_timeout', 10)
+
     # Email settings
     SETTINGS['email_sender'] = overrides.get(
         'email_sender',
@@ -34,6 +73,14 @@ def get_settings(overrides={}):
         'email_server',
         'smtp.example.com:25')
 
+    # The emails are saved in this folder and delivered by a background
+    # thread (one SMTP connection per run). Failed emails are retried by the
+    # next runs after `email_retry_backoff` seconds (doubled every time).
+    # Before exiting we wait at most `email_send_timeout` seconds.
+    SETTINGS['email_spool_dir'] = overrides.get('email_spool_dir', 'outbox')
+    SETTINGS['email_retry_backoff'] = overrides.get('email_retry_backoff', 300)
+    SETTINGS['email_send_timeout'] = overrides.get('email_send_timeout', 60)
+
     # Redmine settings
     SETTINGS['api_url'] = overrides.get(
         'api_url',
@@ -42,6 +89,37 @@ def get_settings(overrides={}):
         'api_key',
         'long_secure_key')
 
+    # Optional file used to remember the list of versions between runs
+    # which are less than `version_cache_ttl` seconds apart (the versions
+    # are always listed again before numbering a new sprint)
+    SETTINGS['version_cache_file'] = overrides.get('version_cache_file', None)
+    SETTINGS['version_cache_ttl'] = int(overrides.get('version_cache_ttl',
+                                                      600))
+
+    # Optional folder for the local copy of the template sprints which is
+    # used as long as no template issue changes (and the number of issues
+    # stays the same). It is refreshed every `template_snapshot_max_age` days.
+    SETTINGS['template_snapshot_dir'] = overrides.get('template_snapshot_dir',
+                                                      None)
+    SETTINGS['template_snapshot_max_age'] = overrides.get(
+        'template_snapshot_max_age', 7)
+
+    # Folder of the journals which record every issue created by a copy:
+    # running a copy which failed again for the same date creates only the
+    # missing issues. With None the sprint of a failed copy must be deleted
+    # before copying the template again for the same dates.
+    SETTINGS['journal_dir'] = overrides.get('journal_dir', 'journal')
+
+    # Where to save the request metrics and the phase timings of every run
+    # (json file and Prometheus textfile-collector file, e.g.
+    # '/var/lib/node_exporter/textfile/redman.prom')
+    SETTINGS['metrics_file'] = overrides.get('metrics_file',
+                                             'redman_metrics.json')
+    SETTINGS['metrics_textfile'] = overrides.get('metrics_textfile', None)
+
+    # Where to save the files produced by `copy_sprint_template_*:profile=True`
+    SETTINGS['profile_dir'] = overrides.get('profile_dir', 'profiles')
+
     # Template names
     SETTINGS['sprint_name_brown'] = 'TEMPLATE_SPRINT_BROWN'
     SETTINGS['sprint_name_green'] = 'TEMPLATE_SPRINT_GREEN'
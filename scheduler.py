@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Goal: run a graph of dependent API calls on a bounded pool of threads
+
+The copy of a template is a graph: the new sprint must exist before the
+dividers and the stories are created and every story must exist before
+its tasks. Each node runs as soon as all its dependencies finished so
+the total time gets close to the critical path of the graph instead of
+the sum of all the calls.
+
+Note: python 2 has no asyncio so the nodes run on a ThreadPool which
+also matches the blocking python-redmine client.
+
+@see fabfile.copy_template()
+"""
+
+import math
+import time
+import heapq
+import logging
+import threading
+from multiprocessing.pool import ThreadPool
+
+logger = logging.getLogger(__name__)
+
+
+class DagScheduler(object):
+    """
+    Usage:
+        dag = DagScheduler(max_in_flight=4)
+        dag.add('sprint', create_sprint)
+        dag.add('story', lambda sprint: create_story(sprint), ['sprint'])
+        results = dag.run()
+
+    Every node function receives the results of its dependencies as
+    positional arguments (in the order of `deps`). When a node fails the
+    nodes which did not start yet are cancelled, the running ones are
+    allowed to finish and the failure is re-raised by run().
+
+    Nodes can belong to a `group` (e.g. the project of a story) which is
+    limited to `group_quota` nodes in flight so a large group does not
+    starve the other ones. Without a fixed quota every group with work
+    left gets an equal share of `max_in_flight`. The wall time of every
+    group is saved in `timings`.
+    """
+
+    def __init__(self, max_in_flight, group_quota=None):
+        """
+        :param max_in_flight: how many nodes can run at the same time
+        :param group_quota: how many nodes of one group can run at the
+            same time (defaults to a fair share)
+        """
+        self.max_in_flight = max(1, max_in_flight)
+        self.group_quota = group_quota
+        self.timings = {}
+        self._order = []
+        self._funcs = {}
+        self._deps = {}
+        self._children = {}
+        self._groups = {}
+        self._cond = threading.Condition()
+
+    def add(self, key, func, deps=(), group=None):
+        """ Add a node; the dependencies must be added first"""
+        if key in self._funcs:
+            raise ValueError("Duplicate node: {}".format(key))
+        for dep in deps:
+            if dep not in self._funcs:
+                raise ValueError("Unknown dependency {} of {}"
+                                 .format(dep, key))
+            self._children[dep].append(key)
+        self._order.append(key)
+        self._funcs[key] = func
+        self._deps[key] = list(deps)
+        self._children[key] = []
+        self._groups[key] = group
+        return key
+
+    def __len__(self):
+        return len(self._order)
+
+    def get_weights(self):
+        """ @return the number of nodes waiting for each node (including
+        itself) used to start the longest branches first """
+        weights = {}
+        for key in reversed(self._order):
+            weights[key] = 1 + sum(weights[child]
+                                   for child in self._children[key])
+        return weights
+
+    def run(self):
+        """ @return dictionary with the result of every node"""
+        self._weights = self.get_weights()
+        self._index = dict((key, idx) for idx, key in enumerate(self._order))
+        self._waiting = dict((key, len(self._deps[key]))
+                             for key in self._order)
+        self._ready = []
+        self._results = {}
+        self._running = 0
+        self._failure = None
+        self._failed = 0
+        self._started = {}
+        self._left = {}
+        self._running_by_group = {}
+        for key in self._order:
+            group = self._groups[key]
+            if group is not None:
+                self._left[group] = self._left.get(group, 0) + 1
+                self._running_by_group[group] = 0
+
+        for key in self._order:
+            if not self._deps[key]:
+                self._push(key)
+
+        pool = ThreadPool(min(self.max_in_flight, max(1, len(self))))
+        try:
+            with self._cond:
+                self._dispatch(pool)
+                while self._running:
+                    # a timeout keeps the main thread responsive to Ctrl-C
+                    self._cond.wait(1)
+        finally:
+            pool.close()
+            pool.join()
+
+        if self._failure is not None:
+            key, exc = self._failure
+            cancelled = len(self) - len(self._results) - self._failed
+            logger.error("Node {} failed ([{}] failed nodes), cancelled [{}] "
+                         "of [{}] nodes".format(key, self._failed, cancelled,
+                                                len(self)))
+            raise exc
+        return self._results
+
+    def _push(self, key):
+        heapq.heappush(self._ready,
+                       (-self._weights[key], self._index[key], key))
+
+    def get_quota(self):
+        """ @return how many nodes of one group can run at the same time"""
+        if self.group_quota:
+            return self.group_quota
+        active = len([left for left in self._left.values() if left])
+        return int(math.ceil(self.max_in_flight / float(max(1, active))))
+
+    def _dispatch(self, pool):
+        """ Start the ready nodes while below the in-flight limits.
+        Called with the condition acquired. """
+        quota = self.get_quota()
+        deferred = []
+        while self._failure is None and self._ready \
+                and self._running < self.max_in_flight:
+            item = heapq.heappop(self._ready)
+            key = item[2]
+            group = self._groups[key]
+            if group is not None:
+                if self._running_by_group[group] >= quota:
+                    deferred.append(item)
+                    continue
+                self._running_by_group[group] += 1
+                self._started.setdefault(group, time.time())
+            args = tuple(self._results[dep] for dep in self._deps[key])
+            self._running += 1
+            pool.apply_async(call_safely, (self._funcs[key],) + args,
+                             callback=self._on_done(key, pool))
+        for item in deferred:
+            heapq.heappush(self._ready, item)
+
+    def _on_done(self, key, pool):
+        def callback(outcome):
+            ok, value = outcome
+            with self._cond:
+                self._running -= 1
+                group = self._groups[key]
+                if group is not None:
+                    self._running_by_group[group] -= 1
+                    self._left[group] -= 1
+                    if not self._left[group]:
+                        self.timings[group] = \
+                            time.time() - self._started[group]
+                if not ok:
+                    self._failed += 1
+                    if self._failure is None:
+                        self._failure = (key, value)
+                else:
+                    self._results[key] = value
+                    for child in self._children[key]:
+                        self._waiting[child] -= 1
+                        if not self._waiting[child]:
+                            self._push(child)
+                self._dispatch(pool)
+                self._cond.notify_all()
+        return callback
+
+
+def call_safely(func, *args):
+    """
+    Run `func` on a worker thread and capture any failure -- including the
+    SystemExit raised by fabric's `abort()` -- so the main thread can
+    re-raise it.
+
+    @return (True, result) or (False, exception)
+    """
+    try:
+        return (True, func(*args))
+    except BaseException as exc:
+        return (False, exc)
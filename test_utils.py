@@ -4,13 +4,94 @@
 Goal: test functions in fabfile_utils.py
 """
 
+import itertools
+import json
+import os
+import pstats
+import shutil
+import smtplib
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
 import fabfile as utils
-from datetime import date
+from transport import Transport, AimdLimiter
+from metrics import Metrics, get_endpoint
+from profiling import Profiler, Tracer
+from scheduler import DagScheduler
+import redman_cli
+from outbox import Outbox, OutboxSender
+from cassette import Cassette, CassetteError
+from redmine_standin import RedmineStandin
+import bench_copy
+from datetime import date, datetime
 from dateutil.parser import parse
 from dateutil.relativedelta import relativedelta
 from mock import patch
-from mock import create_autospec
+from mock import Mock
+from requests.exceptions import ConnectionError
+
+
+class FakePage(list):
+    """ One page of results with the `total_count` of the ResourceSet"""
+
+    def __init__(self, items, total_count):
+        list.__init__(self, items)
+        self.total_count = total_count
+
+
+class FakeIssueManager(object):
+    """ Minimal stand-in for `Redmine.issue` which records the requests
+    python-redmine would send (one GET per page of 100 results)"""
+
+    def __init__(self, stories=None, tasks=None):
+        self.stories = stories or []
+        self.tasks = tasks or []
+        self.calls = []
+        self._ids = itertools.count(10000)
+        self._lock = threading.Lock()
+
+    def requests(self, verb):
+        return len([call for call in self.calls if call[0] == verb])
+
+    def filter(self, limit=utils.PAGE_SIZE, offset=0, **kwargs):
+        found = [issue for issue in self.stories + self.tasks
+                 if kwargs.get('tracker_id') in (None, issue.tracker.id)]
+        self.calls.append(('GET', 'issues'))
+        return FakePage(found[offset:offset + limit], len(found))
+
+    def get(self, issue_id, **kwargs):
+        self.calls.append(('GET', issue_id))
+        return next(taskk for taskk in self.tasks if taskk.id == issue_id)
+
+    def create(self, **kwargs):
+        with self._lock:
+            self.calls.append(('POST', kwargs['subject']))
+            issue = Mock(id=next(self._ids), subject=kwargs['subject'],
+                         spec=['id', 'subject', 'fixed_version'])
+        issue.fixed_version = Mock(id=kwargs['fixed_version_id'])
+        return issue
+
+
+def make_story(story_id, subject):
+    story = Mock(id=story_id, subject=subject,
+                 spec=['id', 'subject', 'project', 'tracker'],
+                 tracker=Mock(id=utils.TRACKERS[utils.TRACKER_STORY]))
+    story.project = Mock(id=1)
+    story.project.name = 'project'
+    return story
+
+
+def make_task(task_id, subject, parent_id):
+    taskk = Mock(id=task_id, subject=subject,
+                 spec=['id', 'subject', 'tracker', 'parent', 'project'],
+                 tracker=Mock(id=utils.TRACKERS[utils.TRACKER_TASK]),
+                 project=Mock(id=1))
+    # `parent` is a reserved Mock() keyword
+    taskk.parent = Mock(id=parent_id)
+    return taskk
 
 
 class UtilsTests(unittest.TestCase):
@@ -31,46 +112,1361 @@ class UtilsTests(unittest.TestCase):
         """ @TODO """
         pass
 
-    # def mock_get_versions(*args, **kwargs):
-    mock_get_versions = create_autospec(
-        utils.get_versions,
-        return_value=[{'id': '10', 'name': 'Green Sprint A'},
-                      {'id': '7', 'name': 'Green Sprint 0123'},
-                      {'id': '800', 'name': ' Green  Sprint  123 '},
-                      {'id': '200', 'name': 'Brown Sprnt xYz'},
-                      {'id': '100', 'name': 'Green Sprint 065'},
-                      {'id': '200', 'name': 'Brown Spr xYz'},
-                      ])
-
-    mock_get_versions2 = create_autospec(
-        utils.get_versions,
-        return_value=[{'id': '1', 'name': 'Green Sprint 063'},
-                      {'id': '2', 'name': 'Green Sprint 064'},
-                      ])
-
-    @patch.multiple(utils, get_versions=mock_get_versions)
+    @staticmethod
+    def catalogue(*versions):
+        return Mock(return_value=utils.VersionCatalogue(
+            'https://redmine.test',
+            [utils.VersionInfo(ver_id, name) for ver_id, name in versions]))
+
     def test_find_newest_sprint_for_template(self):
         """
         Verify that we can properly find the newest sprint of a
         specific "color"
         """
-        template_name = 'TEMPLATE_SPRINT_GREEN'
-        actual = utils.find_newest_sprint_for_template(template_name)
+        catalogue = self.catalogue((10, 'Green Sprint A'),
+                                   (7, 'Green Sprint 0123'),
+                                   (800, ' Green  Sprint  123 '),
+                                   (200, 'Brown Sprnt xYz'),
+                                   (100, 'Green Sprint 065'),
+                                   (201, 'Brown Spr xYz'))
+        with patch.multiple(utils, get_version_catalogue=catalogue):
+            template_name = 'TEMPLATE_SPRINT_GREEN'
+            actual = utils.find_newest_sprint_for_template(template_name)
         expected = {'color': 'Green', 'visible_id': '123'}
         self.assertEquals(actual, expected)
 
-    @patch.multiple(utils, get_versions=mock_get_versions2)
     def test_get_new_sprint_name_use_date(self):
         """ The expected sprint name should not contain dates"""
+        catalogue = self.catalogue((1, 'Green Sprint 063'),
+                                   (2, 'Green Sprint 064'))
         template_name = 'TEMPLATE_SPRINT_GREEN'
-        last_sprint_found = utils.find_newest_sprint_for_template(template_name)
         start_date = date.today()
         end_date = start_date + relativedelta(days=+13)
 
-        expected = 'Green Sprint 065'
-        actual = utils.get_new_sprint_name(template_name, last_sprint_found,
-                                           start_date, end_date)
-        self.assertEquals(actual, expected)
+        listing = Mock(return_value=[utils.VersionInfo(3, 'Green Sprint 065')])
+
+        with patch.multiple(utils, get_version_catalogue=catalogue,
+                            list_project_versions=listing):
+            actual = utils.get_new_sprint_name(template_name,
+                                               start_date, end_date)
+        self.assertEquals('Green Sprint 066', actual)
+
+    def test_parse_template_list(self):
+        """ Consecutive templates of one environment are grouped """
+        self.assertEquals(
+            [('staging', ['green']), ('production', ['misc', 'brown'])],
+            utils.parse_template_list(
+                'staging.green+production.misc+production.brown'))
+        self.assertEquals([(None, ['green', 'misc'])],
+                          utils.parse_template_list('Green+misc+green'))
+
+
+class RedmanCliTests(unittest.TestCase):
+
+    SETTINGS = ("def get_settings(overrides={{}}):\n"
+                "    return {{'start_date': '{}', 'repeat_after': 14}}\n")
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.work_dir = tempfile.mkdtemp()
+        os.chdir(self.work_dir)
+        for target, start_date in [('due', '2016-01-04'),
+                                   ('idle', '2016-01-05')]:
+            os.mkdir(target)
+            with open(os.path.join(target, 'fabric.py'), 'w') as fh:
+                fh.write(self.SETTINGS.format(start_date))
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.work_dir)
+
+    def test_get_due_templates(self):
+        self.assertEquals('due.green+due.misc', redman_cli.get_due_templates(
+            'due.green+idle.green+due.misc', date(2016, 1, 18)))
+        self.assertEquals('', redman_cli.get_due_templates(
+            'idle.green', date(2016, 1, 18)))
+        self.assertRaises(ValueError, redman_cli.get_due_templates,
+                          'green', date(2016, 1, 18))
+
+    def test_get_next_due_date(self):
+        self.assertEquals(date(2016, 1, 4), redman_cli.get_next_due_date(
+            '2016-01-04', 14, date(2016, 1, 1)))
+        self.assertEquals(date(2016, 1, 18), redman_cli.get_next_due_date(
+            '2016-01-04', 14, date(2016, 1, 18)))
+        self.assertEquals(date(2016, 2, 1), redman_cli.get_next_due_date(
+            '2016-01-04', 14, date(2016, 1, 19)))
+
+    def test_find_templates(self):
+        with open(os.path.join('due', 'fabric.py'), 'a') as fh:
+            fh.write("def get_settings(overrides={}):\n"
+                     "    return {'start_date': '2016-01-04',\n"
+                     "            'sprint_name_misc': 'T1',\n"
+                     "            'sprint_name_green': 'T2'}\n")
+        self.assertEquals('due.green+due.misc', redman_cli.find_templates())
+
+    def test_daemon_schedule(self):
+        from redman_daemon import Daemon
+        daemon = Daemon('idle.green+due.misc', run_at='15:59')
+        schedule = daemon.get_schedule(datetime(2016, 1, 18, 10, 0))
+        self.assertEquals([(datetime(2016, 1, 18, 15, 59), 'due'),
+                           (datetime(2016, 1, 19, 15, 59), 'idle')],
+                          [(when, state.target) for when, state in schedule])
+
+        # the time of the copy passed: wait for the next cycle
+        when, state = daemon.get_schedule(datetime(2016, 1, 18, 16, 0))[0]
+        self.assertEquals((datetime(2016, 1, 19, 15, 59), 'idle'),
+                          (when, state.target))
+        self.assertEquals(datetime(2016, 2, 1, 15, 59), daemon.get_next_run(
+            daemon.states[1], datetime(2016, 1, 18, 16, 0)))
+
+    def test_daemon_runs_the_environments_due_together(self):
+        """ Two environments with the same schedule are both copied """
+        import redman_daemon
+        os.mkdir('twin')
+        with open(os.path.join('twin', 'fabric.py'), 'w') as fh:
+            fh.write(self.SETTINGS.format('2016-01-04'))
+        daemon = redman_daemon.Daemon('due.green+twin.misc+idle.green',
+                                      run_at='15:59')
+        when, states = daemon.get_next_tick(datetime(2016, 1, 18, 10, 0))
+        self.assertEquals(datetime(2016, 1, 18, 15, 59), when)
+        self.assertEquals(['due', 'twin'], [state.target for state in states])
+
+        ticks = [datetime(2016, 1, 18, 15, 58), datetime(2016, 1, 18, 15, 59)]
+
+        class FakeDatetime(datetime):
+            @classmethod
+            def now(cls):
+                return ticks.pop(0) if len(ticks) > 1 else ticks[0]
+
+        class FakeDate(date):
+            @classmethod
+            def today(cls):
+                return date(2016, 1, 18)
+
+        copied = []
+
+        def run(state):
+            copied.append(state.target)
+            if len(copied) == 2:
+                daemon.stop()
+
+        with patch.multiple(redman_daemon, datetime=FakeDatetime,
+                            date=FakeDate):
+            with patch.multiple(daemon, run=run, refresh_forever=Mock(),
+                                start_outbox=Mock()):
+                daemon.run_forever()
+        self.assertEquals(['due', 'twin'], copied)
+
+    def test_daemon_run_starts_new_metrics(self):
+        """ The summary of a scheduled copy does not include the requests
+        of the refreshes and of the previous copies """
+        from redman_daemon import Daemon
+        daemon = Daemon('due.green', run_at='15:59')
+        old_metrics = utils.METRICS
+        old_metrics.record_request('get', '/projects.json', 0.1)
+        transport = Mock(metrics=old_metrics)
+        seen = []
+        copy = Mock(side_effect=lambda *args: seen.append(
+            dict(utils.METRICS.requests)))
+
+        with patch.multiple(utils, TRANSPORT=transport,
+                            copy_sprint_templates=copy, METRICS=old_metrics,
+                            RUN_STARTED=utils.RUN_STARTED):
+            with patch.multiple(daemon, activate=Mock(), deactivate=Mock()):
+                daemon.run(daemon.states[0])
+            self.assertIs(utils.METRICS, transport.metrics)
+            self.assertIsNot(old_metrics, utils.METRICS)
+        self.assertEquals([{}], seen)
+        self.assertIs(old_metrics, utils.METRICS)
+
+    def test_copy_failure_exit_status(self):
+        """ A failed template is reported by the exit status of the
+        `redman copy` command """
+        copy = Mock(side_effect=SystemExit(1))
+        with patch.multiple(utils, copy_sprint_templates=copy), \
+                patch.object(redman_cli, 'get_due_templates',
+                             Mock(return_value='due.green')):
+            self.assertEquals(1, redman_cli.main(['copy', 'due.green']))
+            copy.side_effect = None
+            self.assertEquals(0, redman_cli.main(['copy', 'due.green']))
+
+    def test_check_uses_only_the_standard_library(self):
+        script = ("import sys, redman_cli\n"
+                  "redman_cli.main(['check', 'idle.green'])\n"
+                  "heavy = ['fabric', 'fabfile', 'redmine', 'mailer', "
+                  "'dateutil', 'requests']\n"
+                  "print([name for name in heavy if name in sys.modules])\n")
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+            [self.cwd] + os.environ.get('PYTHONPATH', '').split(os.pathsep)))
+        output = subprocess.check_output([sys.executable, '-c', script],
+                                         env=env)
+        last_line = output.decode('utf-8').strip().split('\n')[-1]
+        self.assertEquals('[]', last_line)
+
+
+class VersionCatalogueTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache_file = os.path.join(self.tmp_dir, 'versions.json')
+        self.listed = [utils.VersionInfo(1, 'TEMPLATE_SPRINT_GREEN'),
+                       utils.VersionInfo(2, 'Green Sprint 064')]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def load(self, ttl=60):
+        catalogue = utils.VersionCatalogue('https://redmine.test',
+                                           cache_file=self.cache_file,
+                                           cache_ttl=ttl)
+        return catalogue.load()
+
+    def test_catalogue_is_updated_in_place(self):
+        catalogue = utils.VersionCatalogue('https://redmine.test',
+                                           self.listed)
+        self.assertEquals(2, catalogue.find_by_name('Green Sprint 064').id)
+
+        catalogue.add(utils.VersionInfo(3, 'Green Sprint 065'))
+        self.assertEquals(3, catalogue.find_by_name('Green Sprint 065').id)
+        self.assertEquals('Green Sprint 065', catalogue.find_by_id(3).name)
+
+        catalogue.remove(catalogue.find_by_id(2))
+        self.assertEquals(None, catalogue.find_by_name('Green Sprint 064'))
+        self.assertEquals([1, 3], [v['id'] for v in catalogue.as_list()])
+
+    def test_catalogue_cache_file(self):
+        """ The versions are listed once and then read from the cache file
+        until the ttl expires """
+        listing = Mock(return_value=self.listed)
+        with patch.multiple(utils, list_project_versions=listing):
+            self.load().add(utils.VersionInfo(3, 'Green Sprint 065'))
+            catalogue = self.load()
+            self.assertEquals(1, listing.call_count)
+            self.assertEquals(3, catalogue.find_by_name('Green Sprint 065').id)
+
+            self.load(ttl=-1)
+            self.assertEquals(2, listing.call_count)
+
+    def test_catalogue_is_listed_again_once_per_run(self):
+        """ The cached versions are listed again to number a new sprint
+        and the versions listed during the run are not """
+        listing = Mock(return_value=self.listed)
+        with patch.multiple(utils, list_project_versions=listing):
+            self.load()
+            run_started = time.time()
+            catalogue = self.load()
+            self.assertEquals(1, listing.call_count)
+            catalogue.reload(since=run_started)
+            catalogue.reload(since=run_started)
+            self.assertEquals(2, listing.call_count)
+            self.assertEquals(2, catalogue.find_by_name('Green Sprint 064').id)
+
+    def test_failed_listing_is_not_cached(self):
+        """ An API error is raised instead of saving no versions"""
+        client = Mock()
+        client.version.filter.side_effect = Exception('HTTP 502')
+        with patch.multiple(utils, get_client_instance=Mock(
+                return_value=client)), \
+                patch.dict(utils.env, {'project_name': 'admin_project'}):
+            self.assertRaises(Exception, self.load)
+        self.assertFalse(os.path.exists(self.cache_file))
+
+    def test_catalogue_cache_is_kept_per_project(self):
+        """ The projects of a server share the cache file but not the
+        versions """
+        listing = Mock(return_value=self.listed)
+        with patch.multiple(utils, list_project_versions=listing):
+            for project_name in ('admin_project', 'other_project'):
+                utils.VersionCatalogue(
+                    'https://redmine.test', cache_file=self.cache_file,
+                    cache_ttl=60, project_name=project_name).load()
+        self.assertEquals(2, listing.call_count)
+        with open(self.cache_file) as fh:
+            self.assertEquals(['https://redmine.test|admin_project',
+                               'https://redmine.test|other_project'],
+                              sorted(json.load(fh)))
+
+    def test_catalogue_is_created_once_by_concurrent_threads(self):
+        """ The templates copied in parallel share one catalogue """
+        listing = Mock(side_effect=lambda: time.sleep(0.05) or self.listed)
+        env = {'api_url': 'https://redmine.test'}
+        with patch.multiple(utils, list_project_versions=listing,
+                            CATALOGUE=None), patch.dict(utils.env, env):
+            found = utils.run_parallel(
+                lambda _: utils.get_version_catalogue(), range(4), 4)
+        self.assertEquals(1, listing.call_count)
+        self.assertEquals(1, len(set(id(catalogue) for catalogue in found)))
+
+    def test_find_old_sprints(self):
+        """ The newest `cycles` sprints of every color are kept and the
+        cache files saved without the status can still be read """
+        catalogue = utils.VersionCatalogue('https://redmine.test', [
+            utils.VersionInfo(1, 'TEMPLATE_SPRINT_GREEN'),
+            utils.VersionInfo(2, 'Green Sprint 063', 'closed'),
+            utils.VersionInfo(3, 'Green Sprint 064'),
+            utils.VersionInfo(4, 'Green Sprint 065'),
+            utils.VersionInfo(5, 'Brown Sprint 010'),
+            utils.VersionInfo(6, 'Brown Sprint 012')])
+        old = catalogue.find_old_sprints(1)
+        self.assertEquals([5, 3], [ver.id for ver in old])
+        self.assertEquals([3], [ver.id for ver in
+                                catalogue.find_old_sprints(1, 'Green')])
+        self.assertEquals(5, catalogue.count_active())
+
+        catalogue.set_status(old, 'locked')
+        self.assertEquals([], catalogue.find_old_sprints(1))
+        self.assertEquals(3, catalogue.count_active())
+
+        with open(self.cache_file, 'w') as fh:
+            json.dump({'https://redmine.test|None': {
+                'saved_on': time.time(),
+                'versions': [[2, 'Green Sprint 064']]}}, fh)
+        self.assertEquals('open', self.load().find_by_id(2).status)
+
+
+class SprintIndexTests(unittest.TestCase):
+
+    COLORS = ('Green', 'Brown', 'Misc', 'Blue', 'Red')
+
+    def setUp(self):
+        # 50k versions: 10k sprints of every color
+        self.catalogue = utils.VersionCatalogue('https://redmine.test', [
+            utils.VersionInfo(ver_id, '{} Sprint {:03d}'.format(
+                self.COLORS[ver_id % 5], ver_id // 5))
+            for ver_id in range(50000)])
+        self.parse = Mock(side_effect=utils.SprintIndex.parse)
+
+    def test_lookup_is_constant_after_indexing(self):
+        with patch.object(utils.SprintIndex, 'parse', self.parse):
+            self.assertEquals('9999',
+                              self.catalogue.find_newest_sprint('green'))
+            self.assertEquals(50000, self.parse.call_count)
+
+            for color in self.COLORS * 100:
+                self.assertEquals('9999',
+                                  self.catalogue.find_newest_sprint(color))
+            self.assertEquals(50000, self.parse.call_count)
+
+    def test_index_is_updated_incrementally(self):
+        with patch.object(utils.SprintIndex, 'parse', self.parse):
+            self.catalogue.find_newest_sprint('green')
+            self.parse.reset_mock()
+
+            new_sprint = self.catalogue.add(
+                utils.VersionInfo(50001, 'Green Sprint 10000'))
+            self.assertEquals('10000',
+                              self.catalogue.find_newest_sprint('Green'))
+            self.catalogue.remove(new_sprint)
+            self.assertEquals('9999',
+                              self.catalogue.find_newest_sprint('Green'))
+            self.assertEquals('9999',
+                              self.catalogue.find_newest_sprint('Brown'))
+            self.assertEquals(2, self.parse.call_count)
+
+
+class DeleteSprintTests(unittest.TestCase):
+
+    def test_group_issues_by_height(self):
+        """ Tasks and dividers are deleted before the stories """
+        story = make_story(1, 'story')
+        divider = make_story(2, 'divider')
+        tasks = [make_task(3, 'task 1', 1), make_task(4, 'task 2', 1)]
+        leaves, parents = utils.group_issues_by_height(
+            [story, tasks[0], divider, tasks[1]])
+        self.assertEquals([3, 2, 4], [i.id for i in leaves])
+        self.assertEquals([1], [i.id for i in parents])
+
+    def test_wait_for_version_deletion(self):
+        version = Mock(get=Mock(side_effect=[Mock(), Mock(),
+                       utils.ResourceNotFoundError()]))
+        with patch.multiple(utils, get_client_instance=Mock(
+                return_value=Mock(version=version))):
+            self.assertTrue(utils.wait_for_version_deletion(5))
+        self.assertEquals(3, version.get.call_count)
+
+
+class SyncSprintTests(unittest.TestCase):
+
+    def test_update_task_only_when_different(self):
+        issue = Mock()
+        template_task = utils.TemplateIssue(id=1, subject='task',
+                                            estimated_hours=2)
+        new_task = make_task(2, 'task', 20)
+        new_task.estimated_hours = 2
+
+        with patch.multiple(utils, get_client_instance=Mock(
+                return_value=Mock(issue=issue))):
+            self.assertFalse(utils.update_task(template_task, new_task))
+            template_task.estimated_hours = 3
+            self.assertTrue(utils.update_task(template_task, new_task))
+        issue.update.assert_called_once_with(2, estimated_hours=3)
+
+
+class TemplateSnapshotTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.settings = {'template_snapshot_dir': self.tmp_dir,
+                         'api_url': 'https://redmine.test'}
+        story = utils.TemplateIssue(id=1, subject='story', project_id=2,
+                                    updated_on='2016-01-20T10:00:00Z')
+        taskk = utils.TemplateIssue(id=3, subject='task', parent_id=1,
+                                    updated_on='2016-01-25T10:00:00Z')
+        self.template = utils.Template(7, [], [story], {1: [taskk]},
+                                       issue_count=2)
+        utils.TEMPLATES.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+        utils.TEMPLATES.clear()
+
+    def load(self, updated_on, issue_count=2):
+        """ The newest template issue was updated on `updated_on`"""
+        newest = Mock(updated_on=parse(updated_on))
+        issue = Mock(filter=Mock(return_value=FakePage([newest],
+                                                       issue_count)))
+        with patch.dict(utils.env, self.settings):
+            with patch.multiple(
+                    utils,
+                    get_client_instance=Mock(return_value=Mock(issue=issue)),
+                    read_template=Mock(return_value=self.template)):
+                template = utils.load_template(7)
+                return template, utils.read_template.call_count, issue
+
+    def test_snapshot_is_used_until_the_template_changes(self):
+        self.assertEquals('2016-01-25T10:00:00Z', self.template.watermark)
+
+        # no snapshot yet: read the template
+        _, reads, _ = self.load('2016-01-25T10:00:00Z')
+        self.assertEquals(1, reads)
+
+        # one request confirms the snapshot is still valid
+        template, reads, issue = self.load('2016-01-25T10:00:00Z')
+        self.assertEquals(0, reads)
+        self.assertEquals(['task'], [t.subject for t in
+                                     template.tasks_by_story[1]])
+        self.assertEquals('updated_on:desc',
+                          issue.filter.call_args[1]['sort'])
+
+        # an issue changed: read the template again
+        _, reads, _ = self.load('2016-01-25T10:00:01Z')
+        self.assertEquals(1, reads)
+
+    def test_snapshot_is_read_again_when_an_issue_is_removed(self):
+        """ An issue deleted or moved out of the template sprint does not
+        change the newest `updated_on` """
+        self.load('2016-01-25T10:00:00Z')
+        _, reads, _ = self.load('2016-01-25T10:00:00Z', issue_count=1)
+        self.assertEquals(1, reads)
+
+
+class TransportTests(unittest.TestCase):
+
+    def transport(self, *statuses):
+        transport = Transport(max_retries=2, backoff=0)
+        transport.send = Mock(side_effect=[
+            Mock(status_code=status, headers={}) for status in statuses])
+        return transport
+
+    def test_retry_idempotent_calls(self):
+        transport = self.transport(502, 502, 200)
+        self.assertEquals(200, transport.get('https://redmine.test/a.json')
+                          .status_code)
+        self.assertEquals(3, transport.send.call_count)
+
+    def test_retry_post_only_when_not_processed(self):
+        transport = self.transport(502, 200)
+        self.assertEquals(502, transport.post('https://redmine.test/a.json')
+                          .status_code)
+
+        transport = self.transport(503, 429, 201)
+        self.assertEquals(201, transport.post('https://redmine.test/a.json')
+                          .status_code)
+
+    def test_give_up_after_max_retries(self):
+        transport = self.transport(500, 500, 500, 200)
+        self.assertEquals(500, transport.delete('https://redmine.test/1.json')
+                          .status_code)
+        self.assertEquals(3, transport.send.call_count)
+
+
+class MetricsTests(unittest.TestCase):
+
+    def test_get_endpoint(self):
+        url = 'https://redmine.test'
+        self.assertEquals('version_list', get_endpoint(
+            'get', url + '/projects/admin_project/versions.json'))
+        self.assertEquals('issue_filter', get_endpoint(
+            'get', url + '/issues.json?fixed_version_id=3&offset=100'))
+        self.assertEquals('issue_create', get_endpoint(
+            'post', url + '/projects/admin_project/issues.json'))
+        self.assertEquals('issue_get', get_endpoint(
+            'get', url + '/issues/12.json?include=children'))
+        self.assertEquals('issue_delete', get_endpoint(
+            'delete', url + '/issues/12.json'))
+
+    def test_transport_records_every_attempt(self):
+        metrics = Metrics()
+        transport = Transport(max_retries=2, backoff=0, metrics=metrics)
+        transport.send = Mock(side_effect=[
+            Mock(status_code=status, headers={}) for status in (502, 200)])
+        transport.get('https://redmine.test/issues/1.json')
+
+        stats = metrics.requests[('issue_get', 'GET')]
+        self.assertEquals((2, 1), (stats.count, stats.errors))
+        self.assertEquals(2, stats.latency.cumulative()[0][1])
+
+    def test_merge_the_metrics_of_another_process(self):
+        worker, total = Metrics(), Metrics()
+        for latency in (0.01, 0.2, 20):
+            worker.record_request('post', '/issues.json', latency)
+            total.record_request('post', '/issues.json', latency)
+        worker.add_phase('story_copy', 1.5)
+        total.merge(json.loads(json.dumps(worker.to_dict())))
+
+        stats = total.requests[('issue_create', 'POST')]
+        self.assertEquals(6, stats.latency.count)
+        self.assertEquals(4, dict(stats.latency.cumulative())[0.5])
+        self.assertEquals((1.5, 1), total.phases['story_copy'])
+
+    def test_prometheus_histogram_is_cumulative(self):
+        metrics = Metrics()
+        for latency in (0.01, 0.2, 0.3, 20):
+            metrics.record_request('post', '/issues.json', latency)
+        metrics.add_phase('story_copy', 1.5)
+        text = metrics.to_prometheus()
+        labels = 'endpoint="issue_create",method="POST"'
+
+        self.assertIn('redman_api_requests_total{{{}}} 4'.format(labels),
+                      text)
+        self.assertIn('redman_api_request_seconds_bucket{{{},le="0.1"}} 1'
+                      .format(labels), text)
+        self.assertIn('redman_api_request_seconds_bucket{{{},le="0.5"}} 3'
+                      .format(labels), text)
+        self.assertIn('redman_api_request_seconds_bucket{{{},le="+Inf"}} 4'
+                      .format(labels), text)
+        self.assertIn('redman_phase_seconds{phase="story_copy"} 1.5', text)
+
+
+class OutboxTests(unittest.TestCase):
+
+    def setUp(self):
+        self.spool_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.spool_dir)
+        self.outbox = Outbox(self.spool_dir, backoff=60)
+        for subject in ('green', 'brown'):
+            self.outbox.put('smtp.test:25', 'from@test', 'to@test',
+                            subject, '<p>{}</p>'.format(subject))
+
+    def deliver(self, smtp):
+        with patch('outbox.smtplib.SMTP', return_value=smtp) as connect:
+            sender = OutboxSender(self.outbox)
+            sender.start()
+            sender.notify()
+            sender.close(5)
+        return connect
+
+    def test_one_connection_for_all_the_emails(self):
+        smtp = Mock()
+        connect = self.deliver(smtp)
+        self.assertEquals(1, connect.call_count)
+        self.assertEquals(2, smtp.sendmail.call_count)
+        self.assertEquals(1, smtp.quit.call_count)
+        self.assertEquals([], self.outbox.due())
+
+    def test_email_is_sent_to_every_recipient(self):
+        """ The CC and BCC addresses receive the email like with Mailer"""
+        for path, _ in self.outbox.due():
+            os.remove(path)
+        self.outbox.put('smtp.test:25', 'from@test', ('a@test', 'b@test'),
+                        'misc', '<p>misc</p>', cc='c@test', bcc=['d@test'])
+        smtp = Mock()
+        self.deliver(smtp)
+        self.assertEquals(['a@test', 'b@test', 'c@test', 'd@test'],
+                          smtp.sendmail.call_args[0][1])
+
+    def test_body_is_streamed_to_the_spool(self):
+        chunks = (u'<li>task {} \u2713'.format(idx) for idx in range(3))
+        path = self.outbox.put('smtp.test:25', 'from@test', 'to@test',
+                               'misc', chunks)
+        with open(path) as fh:
+            entry = json.load(fh)
+        self.assertNotIn('html', entry)
+        self.assertEquals(u'<li>task 0 \u2713<li>task 1 \u2713<li>task 2 '
+                          u'\u2713', self.outbox.read_html(entry))
+
+        self.deliver(Mock())
+        self.assertEquals(['failed'], os.listdir(self.spool_dir))
+
+    def test_failed_emails_are_retried_later(self):
+        smtp = Mock()
+        smtp.sendmail.side_effect = smtplib.SMTPDataError(451, 'try later')
+        self.deliver(smtp)
+
+        self.assertEquals([], self.outbox.due())
+        retries = self.outbox.due(now=time.time() + 61)
+        self.assertEquals([1, 1], [entry['attempts'] for _, entry in retries])
+        self.assertIn('try later', retries[0][1]['last_error'])
+
+        # the next run happens after the backoff
+        for path, entry in retries:
+            entry['next_attempt'] = time.time()
+            self.outbox._write(path, entry)
+        self.deliver(Mock())
+        self.assertEquals([], self.outbox.due(now=time.time() + 61))
+
+    def test_each_email_is_claimed_by_one_sender(self):
+        """ Senders sharing the spool (threads, worker processes, a daemon
+        and a cron run) never deliver the same email twice """
+        path = self.outbox.due()[0][0]
+        claimed = self.outbox.claim(path)
+        self.assertEquals(None, self.outbox.claim(path))
+        self.assertEquals(1, len(self.outbox.due()))
+
+        smtp = Mock()
+        with patch('outbox.smtplib.SMTP', return_value=smtp):
+            senders = [OutboxSender(self.outbox) for _ in range(4)]
+            for sender in senders:
+                sender.start()
+                sender.notify()
+            for sender in senders:
+                sender.close(5)
+        self.assertEquals(1, smtp.sendmail.call_count)
+
+        # the claim of a sender which died is released after a while
+        os.utime(claimed, (0, 0))
+        self.assertEquals([], self.outbox.due())
+        self.assertEquals(1, len(self.outbox.due()))
+
+    def test_spool_is_drained_when_the_sender_starts(self):
+        """ The emails left by a previous run do not wait for a new email
+        """
+        smtp = Mock()
+        env = {'email_spool_dir': self.spool_dir}
+        with patch('outbox.smtplib.SMTP', return_value=smtp), \
+                patch.multiple(utils, OUTBOX_SENDER=None), \
+                patch.object(utils.atexit, 'register'), \
+                patch.dict(utils.env, env):
+            utils.get_outbox_sender().close(5)
+        self.assertEquals(2, smtp.sendmail.call_count)
+        self.assertEquals([], self.outbox.due())
+
+
+class TracerTests(unittest.TestCase):
+
+    def test_nested_spans_inherit_the_tags(self):
+        tracer = Tracer()
+        with tracer.span('copy task', 'copy', template_issue_id=7):
+            tracer.add_span('POST /issues.json', 'api', time.time(),
+                            time.time(), attempt=1)
+        with tracer.span('copy task', 'copy', template_issue_id=8):
+            pass
+
+        api, task7, task8 = tracer.to_dict()['traceEvents'][1:]
+        self.assertEquals({'template_issue_id': 7, 'attempt': 1},
+                          api['args'])
+        self.assertEquals(('X', 'api'), (api['ph'], api['cat']))
+        self.assertEquals({'template_issue_id': 7}, task7['args'])
+        self.assertEquals({'template_issue_id': 8}, task8['args'])
+        self.assertTrue(task7['ts'] <= api['ts'])
+
+
+class ProfilerTests(unittest.TestCase):
+
+    def test_stop_takes_the_statistics_of_every_thread(self):
+        """ A worker thread still running after stop() does not add to the
+        saved statistics """
+        started = threading.Event()
+        finished = threading.Event()
+
+        def work():
+            started.set()
+            while not finished.is_set():
+                time.sleep(0.001)
+
+        profiler = Profiler()
+        profiler.start()
+        worker = threading.Thread(target=work)
+        worker.start()
+        started.wait(5)
+        profiler.stop()
+        calls = profiler.stats.total_calls
+        time.sleep(0.05)
+        finished.set()
+        worker.join()
+
+        path = os.path.join(tempfile.mkdtemp(), 'copy.prof')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        self.assertEquals(2, len(profiler.profiles))
+        self.assertEquals(calls, profiler.save(path).total_calls)
+        self.assertEquals(calls, pstats.Stats(path).total_calls)
+
+
+class AimdLimiterTests(unittest.TestCase):
+
+    def call(self, limiter, latency, throttled=False):
+        limiter.acquire()
+        limiter.release(latency, throttled)
+
+    def test_limit_grows_while_latency_is_flat(self):
+        limiter = AimdLimiter(8)
+        for _ in range(100):
+            self.call(limiter, 0.1)
+        self.assertEquals(8, limiter.limit)
+
+        # slow responses do not increase the limit
+        limiter = AimdLimiter(8, initial_limit=2)
+        self.call(limiter, 0.1)
+        for _ in range(20):
+            self.call(limiter, 1)
+        self.assertTrue(limiter.limit < 3)
+
+    def test_limit_is_cut_when_throttled(self):
+        limiter = AimdLimiter(8, initial_limit=8)
+        self.call(limiter, 0.1, throttled=True)
+        self.assertEquals(4, limiter.limit)
+        for _ in range(5):
+            self.call(limiter, 0.1, throttled=True)
+        self.assertEquals(1, limiter.limit)
+
+    def test_limit_is_cut_when_the_call_fails(self):
+        """ Connection errors do not count as fast successful calls """
+        limiter = AimdLimiter(8, initial_limit=4)
+        transport = Transport(limiter=limiter)
+        transport.send_once = Mock(side_effect=ConnectionError('refused'))
+        for _ in range(3):
+            self.assertRaises(ConnectionError, transport.send,
+                              'get', 'https://redmine.test/a.json')
+        self.assertEquals(1, limiter.limit)
+        self.assertEquals(0, limiter.in_flight)
+
+
+class CopyStoriesTests(unittest.TestCase):
+
+    def setUp(self):
+        self.stories = [make_story(1, 'story A'),
+                        make_story(2, 'story B'),
+                        make_story(3, 'story C')]
+        self.tasks = [make_task(100 + i, 'task {}'.format(i), parent)
+                      for i, parent in enumerate([1, 1, 2, 2, 2, 3])]
+        self.issue = FakeIssueManager(self.stories, self.tasks)
+        self.client = Mock(issue=self.issue)
+
+    def copy(self, concurrency):
+        with patch.multiple(utils, get_client_instance=Mock(
+                return_value=self.client)):
+            with patch.dict(utils.env, {'concurrency': concurrency}):
+                return utils.copy_stories(7, Mock(id=8), date.today(),
+                                          date.today())
+
+    def test_copy_stories_parallel_keeps_template_order(self):
+        """ The parallel copy reports issues in the same order as the
+        serial copy """
+        serial_stories, serial_tasks = self.copy(1)
+        stories, tasks = self.copy(4)
+
+        self.assertEquals([s.subject for s in stories],
+                          [s.subject for s in serial_stories])
+        self.assertEquals([t.subject for t in tasks],
+                          [t.subject for t in serial_tasks])
+        self.assertEquals(['task {}'.format(i) for i in range(6)],
+                          [t.subject for t in tasks])
+
+    def test_copy_stories_prefetches_tasks_in_pages(self):
+        """ The number of GETs grows with the number of pages of tasks,
+        not with the number of tasks """
+        self.copy(1)
+        self.assertEquals(2, self.issue.requests('GET'))
+        self.assertEquals(9, self.issue.requests('POST'))
+
+        self.issue.tasks = [make_task(1000 + i, 'task {}'.format(i),
+                                      1 + i % 3)
+                            for i in range(250)]
+        self.issue.calls = []
+        self.copy(4)
+        self.assertEquals(1 + 3, self.issue.requests('GET'))
+        self.assertEquals(253, self.issue.requests('POST'))
+
+    def test_copy_stories_copies_the_children_of_any_tracker(self):
+        """ A bug created under a template story is copied as a task"""
+        bug = make_task(200, 'bug', 2)
+        bug.tracker = Mock(id=utils.TRACKERS[utils.TRACKER_BUG])
+        self.issue.tasks.append(bug)
+        stories, tasks = self.copy(4)
+        self.assertEquals(['task 2', 'task 3', 'task 4', 'bug'],
+                          [t.subject for t in tasks[2:6]])
+
+    def test_copy_stories_parallel_aborts_on_failure(self):
+        """ A failed create aborts the whole copy """
+        self.issue.create = Mock(side_effect=Exception('HTTP 500'))
+        self.assertRaises(SystemExit, self.copy, 4)
+
+
+class StreamResourcesTests(unittest.TestCase):
+
+    def setUp(self):
+        self.issue = FakeIssueManager(tasks=[
+            make_task(i, 'task {}'.format(i), 1) for i in range(250)])
+        self.client = Mock(issue=self.issue)
+
+    def stream(self, concurrency):
+        with patch.multiple(utils, get_client_instance=Mock(
+                return_value=self.client)):
+            with patch.dict(utils.env, {'concurrency': concurrency}):
+                return [taskk.id for taskk in utils.stream_resources(
+                    'issue', tracker_id=utils.TRACKERS[utils.TRACKER_TASK])]
+
+    def test_pages_are_fetched_once_in_order(self):
+        for concurrency in (1, 4):
+            self.issue.calls = []
+            self.assertEquals(list(range(250)), self.stream(concurrency))
+            self.assertEquals(3, self.issue.requests('GET'))
+
+
+class RunInProcessesTests(unittest.TestCase):
+
+    def test_failures_are_isolated(self):
+        def work(value):
+            if value == 'crash':
+                os._exit(3)
+            if value == 'abort':
+                utils.abort('no config')
+            return (value, os.getpid())
+
+        outcomes = utils.run_in_processes(
+            work, [('a',), ('crash',), ('abort',), ('b',)])
+        self.assertEquals([True, False, False, True],
+                          [ok for ok, _ in outcomes])
+        self.assertEquals('a', outcomes[0][1][0])
+        self.assertNotEquals(os.getpid(), outcomes[0][1][1])
+        self.assertIn('[3]', outcomes[1][1])
+        self.assertIn('SystemExit', outcomes[2][1])
+
+
+class DagSchedulerTests(unittest.TestCase):
+
+    def test_nodes_run_after_their_dependencies(self):
+        dag = DagScheduler(3)
+        dag.add('sprint', lambda: 'S')
+        for story in 'ab':
+            dag.add(story, lambda sprint, story=story: sprint + story,
+                    ['sprint'])
+            for idx in range(3):
+                dag.add((story, idx),
+                        lambda parent, idx=idx: '{}{}'.format(parent, idx),
+                        [story])
+        results = dag.run()
+        self.assertEquals('Sa', results['a'])
+        self.assertEquals(['Sb0', 'Sb1', 'Sb2'],
+                          [results[('b', idx)] for idx in range(3)])
+
+    def test_in_flight_limit(self):
+        lock = threading.Lock()
+        state = {'running': 0, 'peak': 0}
+
+        def node(*args):
+            with lock:
+                state['running'] += 1
+                state['peak'] = max(state['peak'], state['running'])
+            time.sleep(0.01)
+            with lock:
+                state['running'] -= 1
+
+        dag = DagScheduler(2)
+        root = dag.add('root', node)
+        for idx in range(10):
+            dag.add(idx, node, [root])
+        dag.run()
+        self.assertEquals(2, state['peak'])
+
+    def test_group_quota(self):
+        """ A large group does not starve the other groups """
+        lock = threading.Lock()
+        started = []
+        running = {'big': 0, 'small': 0}
+        peak = {'big': 0, 'small': 0}
+
+        def node(group):
+            def run(*args):
+                with lock:
+                    started.append(group)
+                    running[group] += 1
+                    peak[group] = max(peak[group], running[group])
+                time.sleep(0.01)
+                with lock:
+                    running[group] -= 1
+            return run
+
+        for quota, expected_peak in [(None, 2), (1, 1)]:
+            del started[:]
+            peak.update(big=0, small=0)
+            dag = DagScheduler(4, group_quota=quota)
+            root = dag.add('root', lambda: None)
+            for idx in range(12):
+                dag.add(('big', idx), node('big'), [root], group='big')
+            for idx in range(2):
+                dag.add(('small', idx), node('small'), [root], group='small')
+            dag.run()
+
+            self.assertEquals(expected_peak, peak['small'])
+            self.assertEquals(['big', 'small'], sorted(dag.timings))
+            # the small group starts with the first wave of nodes
+            self.assertEquals(expected_peak,
+                              started[:4 * expected_peak // 2].count('small'))
+
+    def test_failure_cancels_the_pending_nodes(self):
+        started = []
+
+        def node(key):
+            def run(*args):
+                started.append(key)
+                if key == 'story':
+                    utils.abort('HTTP 500')
+            return run
+
+        dag = DagScheduler(1)
+        dag.add('sprint', node('sprint'))
+        dag.add('story', node('story'), ['sprint'])
+        dag.add('task', node('task'), ['story'])
+        dag.add('other', node('other'), ['sprint'])
+        self.assertRaises(SystemExit, dag.run)
+        self.assertNotIn('task', started)
+        self.assertEquals(['sprint', 'story'], started[:2])
+
+    def test_cancelled_nodes_are_counted_once(self):
+        """ The failed nodes are not counted as cancelled """
+        release = threading.Event()
+
+        def fail():
+            release.wait(5)
+            raise ValueError('HTTP 500')
+
+        dag = DagScheduler(2)
+        dag.add('one', fail)
+        dag.add('two', fail)
+        dag.add('task', lambda one: None, ['one'])
+        release.set()
+        with patch('scheduler.logger') as logger:
+            self.assertRaises(ValueError, dag.run)
+        message = logger.error.call_args[0][0]
+        self.assertIn('([2] failed nodes), cancelled [1] of [3]', message)
+
+
+class StandinCopyTests(unittest.TestCase):
+    """ Copy a template through python-redmine and the http stand-in"""
+
+    def setUp(self):
+        self.env = dict(utils.env)
+        self.standin = RedmineStandin().start()
+        bench_copy.configure(self.standin, 4)
+        self.template_name = bench_copy.populate_template(self.standin, 30)
+
+    def tearDown(self):
+        self.standin.stop()
+        utils.env.clear()
+        utils.env.update(self.env)
+        utils.INSTANCE = utils.TRANSPORT = utils.CATALOGUE = None
+
+    def test_copy_and_delete_request_counts(self):
+        """ One POST per copied issue and a handful of reads """
+        self.standin.reset_counts()
+        utils.copy_template(self.template_name, date.today())
+        counts = self.standin.reset_counts()
+
+        self.assertEquals(30, counts['POST create_issue'])
+        self.assertEquals(1, counts['POST create_version'])
+        self.assertEquals(1, counts['GET list_versions'])
+        self.assertEquals(3, counts['GET list_issues'])
+        self.assertEquals(35, sum(counts.values()))
+
+        new_sprint = utils.get_sync_target(self.template_name)
+        parents, leaves = utils.delete_sprint(new_sprint)
+        self.assertEquals((3, 27), (len(parents), len(leaves)))
+        self.assertEquals(2, len(self.standin.data.versions))
+
+    def test_failed_template_fails_the_batch(self):
+        """ The summary is sent for all the templates and then the task
+        exits with an error status """
+        utils.env.update(sprint_name_green=self.template_name,
+                         sprint_name_misc='TEMPLATE_SPRINT_MISSING',
+                         start_date=date.today().isoformat(),
+                         repeat_after=14)
+        send_summary = Mock()
+        with patch.multiple(utils, send_summary=send_summary,
+                            save_metrics=Mock(), get_email_props=Mock(),
+                            get_outbox_sender=Mock()):
+            self.assertRaises(SystemExit, utils.copy_sprint_templates,
+                              'green+misc', is_dry_run=False)
+        html = ''.join(send_summary.call_args[0][1])
+        self.assertEquals(30, html.count('<li>'))
+        self.assertIn('Unable to copy [TEMPLATE_SPRINT_MISSING]', html)
+
+    def test_rendering_error_is_a_failed_template(self):
+        """ The summary is streamed and a rendering error fails the
+        template once the summary was written """
+        def render():
+            yield '<p>'
+            raise ValueError('broken summary')
+
+        with patch.object(utils, 'copy_template',
+                          Mock(return_value=render())):
+            outcome = utils.copy_template_safely(
+                self.template_name, date.today(), False)
+        self.assertEquals([], utils.get_failed_templates([(None, [outcome])]))
+        html = ''.join(outcome[1])
+        self.assertTrue(html.startswith('<p>'))
+        self.assertIn('Unable to copy', html)
+        self.assertEquals([self.template_name],
+                          utils.get_failed_templates([(None, [outcome])]))
+
+    def test_summary_is_rendered_without_requests(self):
+        """ The summary is rendered from the IssueRecords returned by the
+        creation calls """
+        content = utils.copy_template(self.template_name, date.today())
+        self.standin.reset_counts()
+        html = ''.join(content)
+
+        self.assertEquals(0, sum(self.standin.reset_counts().values()))
+        self.assertEquals(30, html.count('<li>'))
+        self.assertEquals(26, html.count('<li>  task #'))
+        self.assertIn('estimated_hours:', html)
+
+    def test_copy_is_sharded_by_project(self):
+        """ The summary lists the time spent on every project """
+        data = self.standin.data
+        project = data.add_project('other_project')
+        version = next(ver for ver in data.versions.values()
+                       if ver['name'] == self.template_name)
+        story = data.add_issue(
+            project_id=project['id'], subject='Other story',
+            tracker_id=utils.TRACKERS[utils.TRACKER_STORY],
+            fixed_version_id=version['id'])
+        data.add_issue(
+            project_id=project['id'], subject='Other task',
+            tracker_id=utils.TRACKERS[utils.TRACKER_TASK],
+            fixed_version_id=version['id'], parent_issue_id=story['id'])
+
+        utils.env['project_concurrency'] = 1
+        html = ''.join(utils.copy_template(self.template_name, date.today()))
+
+        self.assertIn('<tr><td>admin_project</td><td>3</td><td>26</td>', html)
+        self.assertIn('<tr><td>other_project</td><td>1</td><td>1</td>', html)
+        self.assertTrue(html.index('Other story') < html.index('Other task'))
+        self.assertEquals(32, html.count('<li>'))
+
+    def test_interrupted_copy_resumes_from_the_journal(self):
+        """ A rerun creates only the issues missing after a failure, even
+        when the last create was not recorded """
+        journal_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, journal_dir)
+        utils.env.update(journal_dir=journal_dir, concurrency=1)
+        client = utils.get_client_instance()
+        issue_manager = client.issue
+        created = []
+
+        def create(**kwargs):
+            if len(created) == 12:
+                raise Exception('HTTP 502')
+            created.append(kwargs['subject'])
+            return issue_manager.create(**kwargs)
+
+        with patch.object(client, 'issue',
+                          Mock(create=create, filter=issue_manager.filter)):
+            with patch.multiple(utils, get_client_instance=Mock(
+                    return_value=client)):
+                self.assertRaises(SystemExit, utils.copy_template,
+                                  self.template_name, date.today())
+
+        journal_file = os.path.join(journal_dir, os.listdir(journal_dir)[0])
+        with open(journal_file) as fh:
+            lines = fh.readlines()
+        # lose the entry of the last create and leave a torn line
+        with open(journal_file, 'w') as fh:
+            fh.writelines(lines[:-1])
+            fh.write(lines[-1][:10])
+
+        self.standin.reset_counts()
+        html = ''.join(utils.copy_template(self.template_name, date.today()))
+        counts = self.standin.reset_counts()
+
+        self.assertEquals(18, counts['POST create_issue'])
+        self.assertEquals(0, counts.get('POST create_version', 0))
+        self.assertEquals(30, html.count('<li>'))
+        sprint_id = utils.get_sync_target(self.template_name).id
+        copied = [issue for issue in self.standin.data.issues.values()
+                  if issue.get('fixed_version', {}).get('id') == sprint_id]
+        self.assertEquals(30, len(copied))
+        self.assertEquals([], os.listdir(journal_dir))
+
+    def test_interrupted_copy_without_journal_fails(self):
+        """ Without a journal the sprint of a copy which failed half way
+        is not reported as an existing sprint """
+        utils.env.update(journal_dir=None, concurrency=1)
+        client = utils.get_client_instance()
+        issue_manager = client.issue
+        created = []
+
+        def create(**kwargs):
+            if len(created) == 12:
+                raise Exception('HTTP 502')
+            created.append(kwargs['subject'])
+            return issue_manager.create(**kwargs)
+
+        with patch.object(client, 'issue',
+                          Mock(create=create, filter=issue_manager.filter)):
+            with patch.multiple(utils, get_client_instance=Mock(
+                    return_value=client)):
+                self.assertRaises(SystemExit, utils.copy_template,
+                                  self.template_name, date.today())
+
+        self.standin.reset_counts()
+        name, content, ok = utils.copy_template_safely(
+            self.template_name, date.today(), False)
+        self.assertFalse(ok)
+        self.assertEquals(0, self.standin.reset_counts().get(
+            'POST create_issue', 0))
+
+    def test_record_and_replay_the_copy(self):
+        """ A replayed copy sends the recorded requests in the recorded
+        order without reaching the server """
+        work_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, work_dir)
+        path = os.path.join(work_dir, 'copy.json')
+        utils.env.update(http_cassette=path, http_cassette_mode='record',
+                         http_cassette_strict=True,
+                         http_cassette_latency_scale=0, concurrency=1)
+        self.standin.reset_counts()
+
+        with patch.object(utils.atexit, 'register'):
+            utils.TRANSPORT = utils.INSTANCE = utils.CATALOGUE = None
+            utils.copy_template(self.template_name, date.today())
+            utils.TRANSPORT.cassette.save()
+            recorded = sum(self.standin.reset_counts().values())
+
+            utils.env['http_cassette_mode'] = 'replay'
+            utils.TRANSPORT = utils.INSTANCE = utils.CATALOGUE = None
+            utils.TEMPLATES.clear()
+            html = ''.join(utils.copy_template(self.template_name,
+                                               date.today()))
+        cassette = utils.TRANSPORT.cassette
+
+        with open(path) as fh:
+            self.assertNotIn('bench', fh.read())
+        self.assertEquals(0, sum(self.standin.reset_counts().values()))
+        self.assertEquals(30, html.count('<li>'))
+        self.assertEquals(recorded, cassette.played)
+        self.assertEquals([], cassette.unplayed())
+
+        # a new request (e.g. a N+1 call) is not in the recording
+        self.assertRaises(CassetteError, utils.TRANSPORT.get,
+                          self.standin.url + '/issues/1.json')
+        # the requests must come in the recorded order
+        first, second = [Cassette(path).interactions[idx]['request']
+                         for idx in (0, 1)]
+        cassette = Cassette(path, strict=True, latency_scale=0)
+        self.assertRaises(CassetteError, cassette.play, second['method'],
+                          second['url'], params=second['params'])
+        cassette.play(first['method'], first['url'], params=first['params'])
+
+    def test_new_sprint_is_numbered_after_the_listed_sprints(self):
+        """ A sprint created by hand after the versions were listed by a
+        previous run is not numbered again """
+        utils.copy_template(self.template_name, date(2026, 10, 19))
+        data = self.standin.data
+        data.add_version(data.find_project('admin_project')['id'],
+                         name='Green Sprint 007')
+        utils.reset_metrics()
+        self.standin.reset_counts()
+        utils.copy_template(self.template_name, date(2026, 11, 2))
+        self.assertEquals(1, self.standin.reset_counts()['GET list_versions'])
+        self.assertEquals(['Green Sprint 002', 'Green Sprint 007',
+                           'Green Sprint 008'],
+                          sorted(ver['name'] for ver in data.versions.values()
+                                 if ver['name'].startswith('Green Sprint 00')
+                                 and ver['name'] != 'Green Sprint 001'))
+
+    def test_generate_sprints(self):
+        """ Several sprints are numbered from one version listing and
+        copied from one template read """
+        work_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, work_dir)
+        utils.env.update(sprint_name_green=self.template_name,
+                         journal_dir=work_dir, repeat_after=14)
+        self.standin.reset_counts()
+        self.assertRaises(SystemExit, utils.generate_sprints, 'green',
+                          until='2026-11-30', start='2026-10-19')
+
+        send_summary = Mock()
+        with patch.multiple(utils, send_summary=send_summary,
+                            save_metrics=Mock(), get_email_props=Mock(),
+                            get_outbox_sender=Mock()):
+            utils.generate_sprints('green', count='3', start='2026-10-19',
+                                   is_dry_run='false')
+        counts = self.standin.reset_counts()
+        html = ''.join(send_summary.call_args[0][1])
+
+        self.assertEquals(3, counts['POST create_version'])
+        self.assertEquals(90, counts['POST create_issue'])
+        self.assertEquals(1, counts['GET list_versions'])
+        self.assertEquals(3, counts['GET list_issues'])
+        self.assertEquals(97, sum(counts.values()))
+        self.assertEquals(
+            [('Green Sprint 002', '2026-10-22', '2026-11-04'),
+             ('Green Sprint 003', '2026-11-05', '2026-11-18'),
+             ('Green Sprint 004', '2026-11-19', '2026-12-02')],
+            sorted((ver['name'], str(ver['sprint_start_date']),
+                    str(ver['due_date']))
+                   for ver in self.standin.data.versions.values()
+                   if ver['name'].startswith('Green Sprint 00')
+                   and ver['name'] != 'Green Sprint 001'))
+        self.assertEquals(90, html.count('<li>'))
+        self.assertEquals([], os.listdir(work_dir))
+
+        # the cron copy and the next run skip the pre-generated sprints
+        html = ''.join(utils.copy_template(self.template_name,
+                                           date(2026, 10, 19)))
+        self.assertIn('Sprint [Green Sprint 002] for dates [2026-10-22 to '
+                      '2026-11-04] already exists', html)
+        with patch.multiple(utils, send_summary=send_summary,
+                            save_metrics=Mock(), get_email_props=Mock(),
+                            get_outbox_sender=Mock()):
+            utils.generate_sprints('green', count='4', start='2026-10-19',
+                                   is_dry_run='false')
+        counts = self.standin.reset_counts()
+        self.assertEquals(1, counts['POST create_version'])
+        self.assertEquals(30, counts['POST create_issue'])
+        self.assertEquals(['Green Sprint 005'],
+                          [ver['name'] for ver
+                           in self.standin.data.versions.values()
+                           if ver['due_date'] == '2026-12-16'])
+
+    def test_archive_old_sprints(self):
+        """ Only the sprints older than the kept cycles are closed and the
+        versions are saved in the archive file first """
+        data = self.standin.data
+        project = data.find_project('admin_project')
+        for sequence in range(2, 11):
+            data.add_version(project['id'],
+                             name='Green Sprint {:03d}'.format(sequence))
+        for sequence in range(1, 4):
+            data.add_version(project['id'],
+                             name='Brown Sprint {:03d}'.format(sequence))
+        archive_file = os.path.join(tempfile.mkdtemp(), 'archive.json')
+        self.addCleanup(shutil.rmtree, os.path.dirname(archive_file))
+
+        utils.archive_old_sprints(cycles='3')
+        self.assertNotIn('PUT update_version', self.standin.reset_counts())
+
+        utils.archive_old_sprints(cycles='3', archive_file=archive_file,
+                                  is_dry_run='false')
+        counts = self.standin.reset_counts()
+        self.assertEquals(7, counts['PUT update_version'])
+        self.assertEquals(7, counts['GET get_version'])
+        self.assertEquals(
+            ['Green Sprint {:03d}'.format(sequence)
+             for sequence in range(1, 8)],
+            sorted(ver['name'] for ver in data.versions.values()
+                   if ver['status'] == 'closed'))
+        self.assertEquals(7, utils.get_version_catalogue().count_active())
+        with open(archive_file) as fh:
+            archived = [json.loads(line)['version'] for line in fh]
+        self.assertEquals(['open'] * 7, [ver['status'] for ver in archived])
+
+        # the closed sprints are not selected again
+        utils.archive_old_sprints(cycles='3', is_dry_run='false')
+        self.assertEquals({}, self.standin.reset_counts())
+
+    def test_profiled_copy(self):
+        """ The trace has one span per API call tagged with the template
+        issue id of the copied story or task """
+        profile_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, profile_dir)
+        utils.env['profile_dir'] = profile_dir
+        utils.copy_template_profiled(self.template_name, date.today())
+
+        files = sorted(os.listdir(profile_dir))
+        self.assertEquals(2, len(files))
+        self.assertTrue(files[0].endswith('.prof'))
+        with open(os.path.join(profile_dir, files[1])) as fh:
+            events = json.load(fh)['traceEvents']
+
+        creates = [event for event in events
+                   if event['name'].startswith('POST')
+                   and event['name'].endswith('/issues.json')]
+        self.assertEquals(30, len(creates))
+        self.assertTrue(all('template_issue_id' in event['args']
+                            for event in creates))
+        self.assertEquals(26, len([event for event in events
+                                   if event['name'] == 'copy task']))
+        self.assertEquals(None, utils.TRACER)
+
+    def test_fan_out_environments(self):
+        """ Each environment is copied by its own process; a broken one is
+        reported without stopping the others """
+        work_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, work_dir)
+        other = RedmineStandin().start()
+        self.addCleanup(other.stop)
+        bench_copy.populate_template(other, 30)
+
+        for target, url in [('one', self.standin.url), ('two', other.url),
+                            ('broken', 'http://127.0.0.1:1')]:
+            os.mkdir(os.path.join(work_dir, target))
+            with open(os.path.join(work_dir, target, 'fabric.py'), 'w') as fh:
+                fh.write(FAN_OUT_SETTINGS.format(
+                    target=target, url=url,
+                    start_date=date.today().isoformat(),
+                    sprint_name=self.template_name))
+
+        cwd = os.getcwd()
+        os.chdir(work_dir)
+        self.addCleanup(os.chdir, cwd)
+        created = utils.METRICS.requests.get(('issue_create', 'POST'))
+        created = created.count if created else 0
+
+        results = utils.fan_out_environments(
+            utils.parse_template_list('one.green+two.green+broken.green'),
+            date.today(), False)
+
+        self.assertEquals(3, len(results))
+        self.assertEquals(['one', 'two', 'broken'],
+                          [props.email_subject for props, _ in results])
+        self.assertIn('Unable to copy', results[2][1][0][1])
+        for standin in (self.standin, other):
+            self.assertEquals(3, len(standin.data.versions))
+        self.assertEquals(created + 60, utils.METRICS.requests[
+            ('issue_create', 'POST')].count)
+
+    def test_outbox_starts_after_the_workers_are_forked(self):
+        """ The worker processes do not inherit the outbox thread"""
+        calls = Mock()
+        calls.fan_out_environments.return_value = []
+        with patch.multiple(utils,
+                            fan_out_environments=calls.fan_out_environments,
+                            get_outbox_sender=calls.get_outbox_sender):
+            utils.copy_sprint_templates('green', is_dry_run=False,
+                                        processes=True)
+        self.assertEquals(['fan_out_environments', 'get_outbox_sender'],
+                          [name for name, _, _ in calls.mock_calls])
+
+
+FAN_OUT_SETTINGS = """
+def get_settings(overrides={{}}):
+    return {{'project_name': 'admin_project',
+            'api_url': '{url}',
+            'api_key': 'test',
+            'start_date': '{start_date}',
+            'repeat_after': 14,
+            'concurrency': 4,
+            'http_max_retries': 0,
+            'http_connect_timeout': 1,
+            'sprint_name_green': '{sprint_name}',
+            'email_sender': 'redman@example.com',
+            'email_recipient': 'team@example.com',
+            'email_subject': '{target}',
+            'email_server': 'localhost'}}
+"""
+
 
 if __name__ == '__main__':
     unittest.main()
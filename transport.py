@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Goal: provide a tuned HTTP transport for the redmine API client
+
+python-redmine 1.x sends every request through the module level functions
+`requests.get()`, `requests.post()`... which open a new connection for each
+call. The `Transport` object implements the same functions on top of one
+pooled keep-alive session and adds timeouts, retries and latency logging.
+
+@see fabfile.get_client_instance()
+"""
+
+import time
+import random
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError, ConnectTimeout, Timeout
+
+logger = logging.getLogger(__name__)
+
+# Methods which can be repeated without changing the result
+IDEMPOTENT_METHODS = ('get', 'head', 'options', 'put', 'delete')
+
+# Errors returned by the proxy in front of Redmine (safe to retry for
+# idempotent calls)
+RETRY_STATUSES = (500, 502, 503, 504)
+
+# Responses which guarantee the request was not processed (safe to retry
+# for any call)
+SAFE_RETRY_STATUSES = (429, 503)
+
+# Responses used by the proxy in front of Redmine to slow us down
+THROTTLE_STATUSES = (429, 503)
+
+
+class AimdLimiter(object):
+    """
+    Adaptive limit for the number of API calls in flight.
+
+    The limit grows additively (about +1 per round of calls) while the
+    latency stays close to the best latency observed and it is cut in half
+    (multiplicative decrease) when the server throttles us.
+    """
+
+    def __init__(self, max_limit, min_limit=1, initial_limit=None,
+                 latency_tolerance=2.0, log_every=100):
+        """
+        :param max_limit: the configured ceiling for the calls in flight
+        :param min_limit: the limit never drops below this value
+        :param initial_limit: where to start (defaults to `min_limit`)
+        :param latency_tolerance: stop growing the limit when the latency
+            is this many times higher than the baseline latency
+        :param log_every: log the current rate after this many calls
+        """
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.limit = float(initial_limit or self.min_limit)
+        self.latency_tolerance = latency_tolerance
+        self.log_every = log_every
+        self.baseline = None
+        self.in_flight = 0
+        self.calls = 0
+        self.window_started = time.time()
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """ Block until one more call can be sent"""
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self, latency, throttled=False):
+        """
+        Adjust the limit based on the outcome of a call
+
+        :param latency: how many seconds the call took
+        :param throttled: True if the server asked us to slow down
+        """
+        with self._cond:
+            self.in_flight -= 1
+            self.calls += 1
+
+            if throttled:
+                self.limit = max(self.min_limit, self.limit / 2)
+                logger.warn("Throttled by the server: {}".format(self))
+            else:
+                if self.baseline is None or latency < self.baseline:
+                    self.baseline = latency
+                else:
+                    # let the baseline follow slow drifts of the latency
+                    self.baseline = 0.99 * self.baseline + 0.01 * latency
+
+                if latency <= self.baseline * self.latency_tolerance:
+                    self.limit = min(self.max_limit,
+                                     self.limit + 1.0 / self.limit)
+
+            if self.calls % self.log_every == 0:
+                logger.info("Rate limiter: {}".format(self))
+                self.window_started = time.time()
+            self._cond.notify_all()
+
+    def rate(self):
+        """ @return the calls per second since the last log line"""
+        elapsed = time.time() - self.window_started
+        calls = self.calls % self.log_every or self.log_every
+        return calls / elapsed if elapsed > 0 else 0.0
+
+    def __str__(self):
+        return "limit {:.1f} of {} calls in flight, {:.1f} calls/s"\
+            .format(self.limit, self.max_limit, self.rate())
+
+
+class Transport(object):
+    """
+    Drop-in replacement for the `requests` module functions used by the
+    redmine client.
+    """
+
+    def __init__(self, pool_size=10, connect_timeout=5, read_timeout=60,
+                 max_retries=3, backoff=0.5, max_backoff=30, limiter=None,
+                 metrics=None, tracer=None, cassette=None):
+        """
+        :param pool_size: how many keep-alive connections to keep per host
+            (should match the number of worker threads)
+        :param connect_timeout: seconds to wait for the connection
+        :param read_timeout: seconds to wait for the response
+        :param max_retries: how many times to repeat a failed call
+        :param backoff: the base delay (seconds) between retries
+        :param max_backoff: the maximum delay (seconds) between retries
+        :param limiter: optional AimdLimiter for pacing the calls
+        :param metrics: optional Metrics object recording every attempt
+        :param tracer: optional profiling.Tracer recording every attempt
+        :param cassette: optional cassette.Cassette recording or replaying
+            the requests
+        """
+        self.limiter = limiter
+        self.metrics = metrics
+        self.tracer = tracer
+        self.cassette = cassette
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size,
+                              max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def get(self, url, **kwargs):
+        return self.request('get', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('post', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('put', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('delete', url, **kwargs)
+
+    def request(self, method, url, **kwargs):
+        """
+        Send the request and retry it with jittered exponential backoff
+        when it is safe to do so.
+
+        @return the `requests.Response` object of the last attempt
+        """
+        kwargs.setdefault('timeout', (self.connect_timeout,
+                                      self.read_timeout))
+        attempt = 0
+
+        while True:
+            attempt += 1
+            started = time.time()
+            try:
+                response = self.send(method, url, **kwargs)
+            except (ConnectionError, Timeout) as exc:
+                self.log_attempt(method, url, attempt, started, exc)
+                if attempt > self.max_retries \
+                        or not self.can_retry_error(method, exc):
+                    raise
+                self.wait(attempt)
+                continue
+
+            self.log_attempt(method, url, attempt, started,
+                             response.status_code)
+            if attempt > self.max_retries \
+                    or not self.can_retry_status(method,
+                                                 response.status_code):
+                return response
+            self.wait(attempt, response.headers.get('Retry-After'))
+
+    def send(self, method, url, **kwargs):
+        """ Send one request using the pooled session (and the limiter)"""
+        if self.limiter is None:
+            return self.send_once(method, url, **kwargs)
+
+        self.limiter.acquire()
+        started = time.time()
+        # a call which raised (e.g. the server is unreachable) slows us down
+        throttled = True
+        try:
+            response = self.send_once(method, url, **kwargs)
+            throttled = response.status_code in THROTTLE_STATUSES
+            return response
+        finally:
+            self.limiter.release(time.time() - started, throttled)
+
+    def send_once(self, method, url, **kwargs):
+        if self.cassette is not None:
+            return self.cassette.request(self.session, method, url, **kwargs)
+        return self.session.request(method, url, **kwargs)
+
+    def can_retry_error(self, method, exc):
+        """ A request which failed before a connection was established
+        was never seen by the server """
+        return method in IDEMPOTENT_METHODS \
+            or isinstance(exc, ConnectTimeout)
+
+    def can_retry_status(self, method, status_code):
+        if status_code in SAFE_RETRY_STATUSES:
+            return True
+        return method in IDEMPOTENT_METHODS and status_code in RETRY_STATUSES
+
+    def wait(self, attempt, retry_after=None):
+        """ Sleep a random amount of time up to `backoff * 2^attempt`
+        (or the delay requested by the server) before the next attempt """
+        delay = random.uniform(0, min(self.max_backoff,
+                                      self.backoff * 2 ** attempt))
+        try:
+            delay = max(delay, min(self.max_backoff, float(retry_after)))
+        except (TypeError, ValueError):
+            pass
+        logger.info("Retrying in {:.2f} seconds".format(delay))
+        time.sleep(delay)
+
+    def log_attempt(self, method, url, attempt, started, outcome):
+        """ :param outcome: the status code or the exception raised"""
+        if self.metrics is not None:
+            self.metrics.record_request(
+                method, url, time.time() - started,
+                error=not isinstance(outcome, int) or outcome >= 400)
+        if self.tracer is not None:
+            self.tracer.add_span(
+                "{} {}".format(method.upper(), url.split('?')[0]), 'api',
+                started, time.time(), attempt=attempt, outcome=str(outcome))
+        logger.info("{} {} attempt {}: {} in {:.0f} ms"
+                    .format(method.upper(), url.split('?')[0], attempt,
+                            outcome, (time.time() - started) * 1000))